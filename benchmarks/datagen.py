@@ -0,0 +1,104 @@
+"""Synthetic games for benchmarks.
+
+Import this module before anything from `database`: it points DATABASE_URL to
+a temporary SQLite file unless it is already set. reset_db only drops a
+SQLite database in the temporary directory, set BENCH_RESET_DB=1 to reset
+any other one.
+"""
+import os
+import random
+import tempfile
+import datetime as dt
+
+if "DATABASE_URL" not in os.environ:
+    _db_dir = tempfile.mkdtemp(prefix="fantamorto-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+
+from database.models.db import Base, engine, SessionLocal
+from database.models import Game, Team, Athlet, User, Status
+from database.models.athlet import Gender, Citizenship, Occupation
+from functions.constants import DEFAULT_FANTAMORTO_TEAM_SIZE
+
+NUM_GENDERS = 4
+NUM_CITIZENSHIPS = 60
+NUM_OCCUPATIONS = 120
+# Wikidata ids of the properties, numeric like the real ones (Q<base + i>)
+GENDER_ID_BASE = 1_000_000
+CITIZENSHIP_ID_BASE = 2_000_000
+OCCUPATION_ID_BASE = 3_000_000
+
+
+class FakeTelegramUser:
+    def __init__(self, id: int):
+        self.id = id
+        self.first_name = f"User {id}"
+        self.username = f"user{id}"
+
+    def mention_html(self, name: str) -> str:
+        return f'<a href="tg://user?id={self.id}">{name}</a>'
+
+
+def is_temp_database() -> bool:
+    """True for an in-memory SQLite database or a SQLite file in the temporary directory"""
+    url = engine.url
+    if url.get_backend_name() != "sqlite":
+        return False
+    if url.database in (None, "", ":memory:"):
+        return True
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    return os.path.commonpath([temp_dir, os.path.realpath(url.database)]) == temp_dir
+
+
+def reset_db() -> None:
+    """Drop and create all the tables"""
+    if not is_temp_database() and os.getenv("BENCH_RESET_DB") != "1":
+        raise RuntimeError(
+            f"Refusing to drop {engine.url.render_as_string(hide_password=True)}: "
+            "not a temporary SQLite database, set BENCH_RESET_DB=1 to reset it anyway"
+        )
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+
+def random_athlet(session, rnd: random.Random, idx: int, genders, citizenships, occupations, dead_ratio: float) -> Athlet:
+    dob = dt.date(1925, 1, 1) + dt.timedelta(days=rnd.randint(0, 365 * 80))
+    dod = None
+    if rnd.random() < dead_ratio:
+        dod = min(dob + dt.timedelta(days=rnd.randint(365 * 20, 365 * 100)), dt.date.today())
+    athlet = Athlet(session, f"Athlet {idx}", dob, dod, f"Q{idx}", [], [], [])
+    athlet.main_gender = rnd.choice(genders)
+    athlet.main_citizenship = rnd.choice(citizenships)
+    athlet.main_occupation = rnd.choice(occupations)
+    athlet.genders.append(athlet.main_gender)
+    athlet.citizenships.append(athlet.main_citizenship)
+    athlet.occupations.append(athlet.main_occupation)
+    return athlet
+
+
+def generate(num_chats: int, num_teams: int, team_size: int = DEFAULT_FANTAMORTO_TEAM_SIZE,
+             dead_ratio: float = 0.2, seed: int = 0, status: Status = Status.RUN) -> None:
+    """Create num_chats games with num_teams full teams each"""
+    rnd = random.Random(seed)
+    reset_db()
+    with SessionLocal() as session:
+        genders = [Gender(wiki_id=f"Q{GENDER_ID_BASE + i}", name=f"Gender {i}") for i in range(NUM_GENDERS)]
+        citizenships = [Citizenship(wiki_id=f"Q{CITIZENSHIP_ID_BASE + i}", name=f"Country {i}") for i in range(NUM_CITIZENSHIPS)]
+        occupations = [Occupation(wiki_id=f"Q{OCCUPATION_ID_BASE + i}", name=f"Occupation {i}") for i in range(NUM_OCCUPATIONS)]
+        session.add_all(genders + citizenships + occupations)
+
+        athlet_idx = 0
+        for chat in range(num_chats):
+            creator = User(FakeTelegramUser(chat * num_teams + 1))
+            game = Game(chat_id=-(chat + 1), creator=creator, team_size=team_size, status=status)
+            session.add(game)
+            for t in range(num_teams):
+                owner = creator if t == 0 else User(FakeTelegramUser(chat * num_teams + t + 1))
+                team = Team(name=f"Team {chat}.{t}", owner=owner, game=game, draft_order=t)
+                session.add(team)
+                for _ in range(team_size):
+                    athlet_idx += 1
+                    with session.no_autoflush:
+                        team.athlets.append(
+                            random_athlet(session, rnd, athlet_idx, genders, citizenships, occupations, dead_ratio))
+                team.captain = rnd.choice(team.athlets)
+        session.commit()
@@ -0,0 +1,100 @@
+"""Fake Bot API backend, so the real Application can run without Telegram."""
+import asyncio
+import json
+import time
+import itertools
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fantamorto", "username": "FantamortoBot"}
+TOKEN = "1:fake-token"
+
+
+class FakeRequest(BaseRequest):
+    """Answers every Bot API call locally and records the calls.
+
+    Updates pushed with add_updates are returned by getUpdates; latency adds
+    a fixed delay to every call to simulate the network. fail(endpoint,
+    params) can return an error answer of the Bot API, e.g.
+    {"error_code": 400, "description": "Bad Request: can't parse entities"}.
+    """
+
+    def __init__(self, latency: float = 0.0, fail=None):
+        self.latency = latency
+        self.fail = fail
+        self.calls: list[tuple[float, str, dict]] = []
+        self.updates: asyncio.Queue|None = None
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> float|None:
+        return None
+
+    async def initialize(self) -> None:
+        if self.updates is None:
+            self.updates = asyncio.Queue()
+
+    async def shutdown(self) -> None:
+        pass
+
+    def add_updates(self, updates: list[dict]) -> None:
+        for update in updates:
+            self.updates.put_nowait(update)
+
+    def sent_messages(self) -> list[tuple[float, str, dict]]:
+        return [c for c in self.calls if c[1] in ("sendMessage", "sendDocument")]
+
+    async def do_request(self, url, method, request_data: RequestData|None = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((time.perf_counter(), endpoint, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        error = self.fail(endpoint, params) if self.fail else None
+        if error:
+            return error["error_code"], json.dumps({"ok": False, **error}).encode()
+        return 200, json.dumps({"ok": True, "result": await self.result(endpoint, params)}).encode()
+
+    async def result(self, endpoint: str, params: dict):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            return await self.get_updates(float(params.get("timeout", 0) or 0))
+        if endpoint in ("sendMessage", "sendDocument"):
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "group", "title": "Fake"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        if endpoint == "getMyCommands":
+            return []
+        return True
+
+    async def get_updates(self, timeout: float) -> list[dict]:
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01)))
+        except asyncio.TimeoutError:
+            return updates
+        while not self.updates.empty() and len(updates) < 100:
+            updates.append(self.updates.get_nowait())
+        return updates
+
+
+def command_update(update_id: int, chat_id: int, user_id: int, text: str) -> dict:
+    """Update with a command message, as sent by Telegram"""
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
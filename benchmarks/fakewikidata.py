@@ -0,0 +1,188 @@
+"""Fake Wikidata endpoints, so the sweep and the parsing can run without the network.
+
+The payloads have the shape of the real SPARQL and wbgetentities answers.
+"""
+import re
+import json
+import time
+import random
+import threading
+import datetime as dt
+from dataclasses import dataclass, field
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from database.models import Athlet
+from database.models import wikidata
+
+from benchmarks.datagen import GENDER_ID_BASE, CITIZENSHIP_ID_BASE, OCCUPATION_ID_BASE
+from benchmarks.datagen import NUM_GENDERS, NUM_CITIZENSHIPS, NUM_OCCUPATIONS
+
+ENTITY_URL = "http://www.wikidata.org/entity/"
+DATE_TYPE = "http://www.w3.org/2001/XMLSchema#dateTime"
+
+
+@dataclass
+class Person:
+    wiki_id: str
+    label: str
+    birth: dt.date
+    death: dt.date|None = None
+    genders: list[tuple[str, str]] = field(default_factory=list)
+    citizenships: list[tuple[str, str]] = field(default_factory=list)
+    occupations: list[tuple[str, str]] = field(default_factory=list)
+
+
+def _uri(wiki_id: str) -> dict:
+    return {"type": "uri", "value": f"{ENTITY_URL}{wiki_id}"}
+
+def _literal(value: str) -> dict:
+    return {"xml:lang": "it", "type": "literal", "value": value}
+
+def _date(value: dt.date) -> dict:
+    return {"datatype": DATE_TYPE, "type": "literal", "value": f"{value:%Y-%m-%d}T00:00:00Z"}
+
+
+def sparql_payload(people: list[Person]) -> dict:
+    """SPARQL answer, one binding per combination of gender, citizenship and occupation"""
+    bindings = []
+    for person in people:
+        for gender in person.genders or [None]:
+            for citizenship in person.citizenships or [None]:
+                for occupation in person.occupations or [None]:
+                    row = {
+                        "person": _uri(person.wiki_id),
+                        "personLabel": _literal(person.label),
+                        "dateOfBirth": _date(person.birth),
+                    }
+                    if person.death:
+                        row["dateOfDeath"] = _date(person.death)
+                    for name, value in (("gender", gender), ("citizenship", citizenship), ("occupation", occupation)):
+                        if value:
+                            row[name] = _uri(value[0])
+                            row[f"{name}Label"] = _literal(value[1])
+                    bindings.append(row)
+    head = ["person", "personLabel", "dateOfBirth", "dateOfDeath", "gender", "genderLabel",
+            "citizenship", "citizenshipLabel", "occupation", "occupationLabel"]
+    return {"head": {"vars": head}, "results": {"bindings": bindings}}
+
+
+def entities_payload(people: list[Person]) -> dict:
+    """wbgetentities answer with the ranked claims of the properties"""
+    def claims(values: list[tuple[str, str]]) -> list[dict]:
+        return [
+            {"mainsnak": {"datavalue": {"value": {"id": wiki_id}}}, "rank": "preferred" if i == 0 else "normal"}
+            for i, (wiki_id, _) in enumerate(values)
+        ]
+    return {"entities": {
+        person.wiki_id: {"claims": {
+            wikidata.PROPERTIES_ID["gender"]: claims(person.genders),
+            wikidata.PROPERTIES_ID["citizenship"]: claims(person.citizenships),
+            wikidata.PROPERTIES_ID["occupation"]: claims(person.occupations),
+        }} for person in people
+    }}
+
+
+def synthetic_people(num_people: int, seed: int = 0, values_per_property: int = 2) -> list[Person]:
+    rnd = random.Random(seed)
+    def pick(base: int, count: int, name: str) -> list[tuple[str, str]]:
+        return [(f"Q{base + i}", f"{name} {i}") for i in rnd.sample(range(count), values_per_property)]
+    return [
+        Person(
+            wiki_id=f"Q{i + 1}",
+            label=f"Athlet {i + 1}",
+            birth=dt.date(1925, 1, 1) + dt.timedelta(days=rnd.randint(0, 365 * 80)),
+            genders=pick(GENDER_ID_BASE, NUM_GENDERS, "Gender")[:1],
+            citizenships=pick(CITIZENSHIP_ID_BASE, NUM_CITIZENSHIPS, "Country"),
+            occupations=pick(OCCUPATION_ID_BASE, NUM_OCCUPATIONS, "Occupation"),
+        )
+        for i in range(num_people)
+    ]
+
+
+def people_from_db(session, death_ratio: float, seed: int = 0) -> list[Person]:
+    """The athlets of the database, death_ratio of the alive ones die today"""
+    rnd = random.Random(seed)
+    people = []
+    for athlet in session.query(Athlet).all():
+        death = athlet.date_of_death
+        if not death and rnd.random() < death_ratio:
+            death = dt.date.today()
+        people.append(Person(
+            wiki_id=athlet.wiki_id,
+            label=athlet.name,
+            birth=athlet.date_of_birth,
+            death=death,
+            genders=[(g.wiki_id, g.name) for g in athlet.genders],
+            citizenships=[(c.wiki_id, c.name) for c in athlet.citizenships],
+            occupations=[(o.wiki_id, o.name) for o in athlet.occupations],
+        ))
+    return people
+
+
+class FakeWikidataHandler(BaseHTTPRequestHandler):
+    server: "FakeWikidata"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if url.path == "/sparql":
+            payload = sparql_payload(self.server.match_query(params["query"]))
+        elif url.path == "/w/api.php":
+            payload = entities_payload([self.server.people[i] for i in params["ids"].split("|") if i in self.server.people])
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWikidata(ThreadingHTTPServer):
+    """Local server answering the queries of database.models.wikidata.
+
+    Use it as a context manager: the module is pointed to the server and
+    back to Wikidata on exit.
+    """
+
+    def __init__(self, people: list[Person], latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), FakeWikidataHandler)
+        self.people = {p.wiki_id: p for p in people}
+        self.latency = latency
+        self.requests = 0
+        self._urls = None
+
+    def match_query(self, query: str) -> list[Person]:
+        self.requests += 1
+        only_deads = "OPTIONAL { ?person wdt:P570" not in query
+        ids = re.search(r"FILTER \(\?person (?:in \(([^)]*)\)|= (wd:Q\d+))\)", query)
+        if ids:
+            wiki_ids = re.findall(r"wd:(Q\d+)", ids.group(0))
+            people = [self.people[i] for i in wiki_ids if i in self.people]
+        else:
+            labels = set(re.findall(r'rdfs:label "([^"]*)"', query))
+            people = [p for p in self.people.values() if p.label in labels]
+        if only_deads:
+            people = [p for p in people if p.death]
+        return people
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        host, port = self.server_address
+        self._urls = (wikidata.WIKIDATA_URL, wikidata.WIKIDATA_REST_URL)
+        wikidata.WIKIDATA_URL = f"http://{host}:{port}/sparql"
+        wikidata.WIKIDATA_REST_URL = f"http://{host}:{port}/w/api.php"
+        return self
+
+    def __exit__(self, *exc):
+        wikidata.WIKIDATA_URL, wikidata.WIKIDATA_REST_URL = self._urls
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,59 @@
+"""Check that importing the bot stays within a startup budget.
+
+    python -m benchmarks.importtime --budget 1000
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter
+(best of --runs), prints the slowest imports and exits with 1 when the
+cumulative import time of main is over the budget, so it can run in CI.
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Milliseconds
+DEFAULT_BUDGET = 1000
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_times(module: str) -> dict[str, tuple[int, int, int]]:
+    """module -> (self us, cumulative us, depth) for every module imported by module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            times[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="milliseconds")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    best = min((import_times(args.module) for _ in range(args.runs)), key=lambda t: t[args.module][1])
+    total = best[args.module][1] / 1000
+
+    print(f"{'module':<50}{'cumulative ms':>15}")
+    direct = [(name, times) for name, times in best.items() if times[2] == 1]
+    for name, (_, cumulative, _) in sorted(direct, key=lambda item: -item[1][1])[:args.top]:
+        print(f"{name:<50}{cumulative / 1000:>15.1f}")
+    for name in ("pandas", "numpy"):
+        if name in best:
+            print(f"warning: {name} is imported at startup")
+    print(f"import {args.module}: {total:.0f} ms (budget {args.budget:.0f} ms)")
+    sys.exit(0 if total <= args.budget else 1)
+
+
+if __name__ == "__main__":
+    main()
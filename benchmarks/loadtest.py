@@ -0,0 +1,241 @@
+"""Play whole games in many chats at once against the real Application.
+
+    python -m benchmarks.loadtest --chats 50 --teams 6 --rate 200
+
+Every chat runs /start, /join for each player, /draft, the picks of the
+draft (interleaved with /ranking and /team bursts), concurrent /captain
+and final /ranking bursts. Players wait for the answer to each command
+before sending the next one, as people in a group do; updates of all the
+chats share a global rate (--rate updates per second) and go through the
+update queue, so they are scheduled by the same update processor as in
+production. Telegram and Wikidata are replaced by fakes.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from benchmarks.datagen import reset_db, SessionLocal
+from benchmarks.fakebot import FakeRequest, TOKEN, command_update
+from benchmarks.fakewikidata import FakeWikidata, synthetic_people
+
+from sqlalchemy import event
+from telegram import Update
+
+from database.models import Game, Status
+from database.models.db import engine
+from functions.broadcast import TokenBucket
+from functions.processing import ChatUpdateProcessor
+from functions.constants import DEFAULT_FANTAMORTO_TEAM_SIZE
+
+import main
+
+MENTION = re.compile(r"tg://user\?id=(\d+)")
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+
+
+class TrackingProcessor(ChatUpdateProcessor):
+    """Resolves a future when the handlers of an update are done"""
+
+    def __init__(self, workers: int):
+        super().__init__(workers)
+        self.waiting: dict[int, asyncio.Future] = {}
+        self.started: dict[int, float] = {}
+
+    async def do_process_update(self, update, coroutine) -> None:
+        async def tracked():
+            self.started[update.update_id] = time.perf_counter()
+            try:
+                await coroutine
+            finally:
+                future = self.waiting.pop(update.update_id, None)
+                if future and not future.done():
+                    future.set_result(time.perf_counter())
+        await super().do_process_update(update, tracked())
+
+
+class DatabaseStats:
+    """Statement timings and SQLite lock errors, from engine events"""
+
+    def __init__(self):
+        self.statements = 0
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.lock_errors = 0
+        event.listen(engine, "before_cursor_execute", self.before)
+        event.listen(engine, "after_cursor_execute", self.after)
+        event.listen(engine, "handle_error", self.error)
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["loadtest_start"] = time.perf_counter()
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        if statement.lstrip().upper().startswith(WRITE_STATEMENTS):
+            elapsed = time.perf_counter() - conn.info.pop("loadtest_start", time.perf_counter())
+            self.writes += 1
+            self.write_seconds += elapsed
+            self.max_write_seconds = max(self.max_write_seconds, elapsed)
+
+    def error(self, context):
+        if "locked" in str(context.original_exception):
+            self.lock_errors += 1
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.request = FakeRequest(latency=args.latency)
+        self.processor = TrackingProcessor(workers=args.workers)
+        self.application = main.build_application(TOKEN, request=self.request, update_processor=self.processor)
+        self.bucket = TokenBucket(args.rate, max(1, args.rate / 10))
+        self.update_ids = iter(range(1, 10**9))
+        # (command, enqueued, started, done)
+        self.samples: list[tuple[str, float, float, float]] = []
+
+    def last_text(self, chat_id: int) -> str:
+        for _, endpoint, params in reversed(self.request.calls):
+            if endpoint == "sendMessage" and int(params["chat_id"]) == chat_id:
+                return params.get("text", "")
+        return ""
+
+    async def send(self, chat_id: int, user_id: int, text: str) -> None:
+        await self.bucket.acquire()
+        update = Update.de_json(command_update(next(self.update_ids), chat_id, user_id, text), self.application.bot)
+        future = asyncio.get_running_loop().create_future()
+        self.processor.waiting[update.update_id] = future
+        enqueued = time.perf_counter()
+        await self.application.update_queue.put(update)
+        done = await future
+        started = self.processor.started.pop(update.update_id, done)
+        self.samples.append((text.split()[0], enqueued, started, done))
+
+    async def burst(self, chat_id: int, users: list[int], rnd: random.Random) -> None:
+        await asyncio.gather(*(
+            self.send(chat_id, user, rnd.choice(("/ranking", "/team")))
+            for user in rnd.sample(users, min(len(users), self.args.burst_size))
+        ))
+
+    async def play(self, chat: int) -> None:
+        args = self.args
+        rnd = random.Random(args.seed + chat)
+        chat_id = -(chat + 1)
+        users = [chat * args.teams + t + 1 for t in range(args.teams)]
+        picks = args.teams * DEFAULT_FANTAMORTO_TEAM_SIZE
+        athlets = iter(range(chat * picks + 1, (chat + 1) * picks + 1))
+
+        await self.send(chat_id, users[0], "/start")
+        for user in users:
+            await self.send(chat_id, user, f"/join Team {user}")
+        await self.send(chat_id, users[0], "/draft")
+        for _ in range(picks):
+            drafter = MENTION.search(self.last_text(chat_id))
+            if not drafter:
+                break
+            if rnd.random() < args.burst_ratio:
+                await self.burst(chat_id, users, rnd)
+                drafter = MENTION.search(self.last_text(chat_id)) or drafter
+            await self.send(chat_id, int(drafter.group(1)), f"/add Q{next(athlets)}")
+        await asyncio.gather(*(
+            self.send(chat_id, user, f"/captain {rnd.randrange(DEFAULT_FANTAMORTO_TEAM_SIZE)}") for user in users
+        ))
+        for _ in range(args.final_bursts):
+            await self.burst(chat_id, users, rnd)
+
+    async def run(self) -> float:
+        async with self.application:
+            await self.application.start()
+            start = time.perf_counter()
+            await asyncio.gather(*(self.play(chat) for chat in range(self.args.chats)))
+            elapsed = time.perf_counter() - start
+            await self.application.stop()
+        return elapsed
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def report(test: LoadTest, db: DatabaseStats, elapsed: float) -> dict:
+    by_command: dict[str, list[tuple[float, float]]] = {}
+    for command, enqueued, started, done in test.samples:
+        by_command.setdefault(command, []).append((done - enqueued, started - enqueued))
+    commands = {
+        command: {
+            "count": len(values),
+            "p50": percentile([v[0] for v in values], 0.5),
+            "p99": percentile([v[0] for v in values], 0.99),
+            "max": max(v[0] for v in values),
+            "wait_p99": percentile([v[1] for v in values], 0.99),
+        } for command, values in sorted(by_command.items())
+    }
+    with SessionLocal() as session:
+        games = session.execute(Game.__table__.select()).fetchall()
+    return {
+        "params": vars(test.args),
+        "elapsed": elapsed,
+        "updates": len(test.samples),
+        "throughput": len(test.samples) / elapsed,
+        "games_running": sum(g.status == Status.RUN for g in games),
+        "commands": commands,
+        "database": {
+            "statements": db.statements,
+            "writes": db.writes,
+            "write_seconds": db.write_seconds,
+            "max_write_seconds": db.max_write_seconds,
+            "lock_errors": db.lock_errors,
+        },
+        "processor": test.processor.metrics(),
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"{result['params']['chats']} chats, {result['updates']} updates in {result['elapsed']:.2f}s "
+          f"({result['throughput']:.0f} updates/s), {result['games_running']} games started")
+    print(f"{'command':<12}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'wait p99':>10}")
+    for command, stats in result["commands"].items():
+        print(f"{command:<12}{stats['count']:>7}{stats['p50'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}"
+              f"{stats['max'] * 1000:>10.1f}{stats['wait_p99'] * 1000:>10.1f}")
+    db = result["database"]
+    print(f"database: {db['statements']} statements, {db['writes']} writes in {db['write_seconds']:.2f}s "
+          f"(max {db['max_write_seconds'] * 1000:.1f} ms), {db['lock_errors']} lock errors")
+    processor = result["processor"]
+    print(f"processor: max queue {processor['max_queue_depth']}, max per chat {processor['max_chat_depth']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--teams", type=int, default=6)
+    parser.add_argument("--rate", type=float, default=200, help="updates per second over all the chats")
+    parser.add_argument("--workers", type=int, default=main.UPDATE_WORKERS)
+    parser.add_argument("--burst-ratio", type=float, default=0.2, help="picks preceded by a /ranking and /team burst")
+    parser.add_argument("--burst-size", type=int, default=3)
+    parser.add_argument("--final-bursts", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every Bot API and Wikidata call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the report as JSON")
+    return parser.parse_args()
+
+
+def main_loadtest():
+    args = parse_args()
+    reset_db()
+    people = synthetic_people(args.chats * args.teams * DEFAULT_FANTAMORTO_TEAM_SIZE, seed=args.seed)
+    db = DatabaseStats()
+    test = LoadTest(args)
+    with FakeWikidata(people, latency=args.latency):
+        elapsed = asyncio.run(test.run())
+    result = report(test, db, elapsed)
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_loadtest()
@@ -0,0 +1,129 @@
+"""Run the sharded mode locally: ingress and worker processes on the fake Bot API.
+
+    python -m benchmarks.sharded --shards 4 --chats 40 --teams 6
+
+The ingress polls the updates from a FakeRequest and routes them to the
+workers; every worker answers on its own FakeRequest and reports the
+replies at the end. The run checks that each chat was served by one worker
+only and that its replies follow the order of its updates.
+
+On SQLite the writes of all the workers still go through one file lock, so
+extra workers only pay off on read heavy traffic or a server database.
+"""
+import time
+import asyncio
+import argparse
+import functools
+import multiprocessing
+
+from benchmarks.datagen import reset_db
+from benchmarks.fakebot import FakeRequest, TOKEN, command_update
+
+from telegram import Bot
+
+from database.models.snapshot import share_generation
+from functions import sharding
+
+import main
+
+
+def bench_worker(index, updates, generation, build_application, token, request_factory,
+                 metrics_port, metrics_host, results=None) -> None:
+    """sharding.worker_main that sends the replies of the worker to results"""
+    share_generation(generation)
+    request = FakeRequest()
+    application = build_application(token, request=request, jobs=False)
+    asyncio.run(sharding.serve_shard(application, updates))
+    replies = [
+        (int(params["chat_id"]), params["reply_parameters"]["message_id"], at)
+        for at, endpoint, params in request.calls
+        if endpoint == "sendMessage" and "reply_parameters" in params
+    ]
+    results.put((index, replies))
+
+
+def chat_updates(chats: int, teams: int) -> list[dict]:
+    """Every chat starts a game, joins, asks for the ranking and starts the draft"""
+    per_chat = []
+    for chat in range(chats):
+        chat_id = -(chat + 1)
+        users = [chat * teams + t + 1 for t in range(teams)]
+        texts = [(users[0], "/start")]
+        texts += [(user, f"/join Team {user}") for user in users]
+        texts += [(user, "/allteams") for user in users]
+        texts += [(users[0], "/draft"), (users[-1], "/draftorder"), (users[-1], "/ranking")]
+        per_chat.append([(chat_id, user, text) for user, text in texts])
+    # Chats interleaved, as they arrive to a busy bot
+    updates = []
+    for step in range(max(len(c) for c in per_chat)):
+        for commands in per_chat:
+            if step < len(commands):
+                chat_id, user, text = commands[step]
+                updates.append(command_update(len(updates) + 1, chat_id, user, text))
+    return updates
+
+
+async def ingress(router: sharding.ShardRouter, updates: list[dict]) -> None:
+    request = FakeRequest()
+    request.updates = asyncio.Queue()
+    request.add_updates(updates)
+    await sharding.run_ingress(Bot(TOKEN, request=request, get_updates_request=request),
+                               router, max_updates=len(updates))
+
+
+def check(updates: list[dict], results: list) -> tuple[int, list[str]]:
+    errors = []
+    shard_of_chat = {}
+    replies = 0
+    for index, shard_replies in results:
+        last = {}
+        for chat_id, message_id, _ in sorted(shard_replies, key=lambda r: r[2]):
+            replies += 1
+            if shard_of_chat.setdefault(chat_id, index) != index:
+                errors.append(f"chat {chat_id} served by workers {shard_of_chat[chat_id]} and {index}")
+            if message_id < last.get(chat_id, 0):
+                errors.append(f"chat {chat_id}: reply to {message_id} after reply to {last[chat_id]}")
+            last[chat_id] = message_id
+    expected = {u["message"]["chat"]["id"] for u in updates}
+    if set(shard_of_chat) != expected:
+        errors.append(f"{len(expected - set(shard_of_chat))} chats without replies")
+    return replies, errors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--teams", type=int, default=6)
+    return parser.parse_args()
+
+
+def main_sharded():
+    args = parse_args()
+    reset_db()
+    updates = chat_updates(args.chats, args.teams)
+    results_queue = multiprocessing.get_context("spawn").Queue()
+    start = time.perf_counter()
+    processes, router = sharding.start_workers(
+        args.shards, main.build_application, TOKEN,
+        worker=functools.partial(bench_worker, results=results_queue),
+    )
+    asyncio.run(ingress(router, updates))
+    router.stop()
+    results = [results_queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    replies, errors = check(updates, results)
+    print(f"{len(updates)} updates of {args.chats} chats on {args.shards} workers in {elapsed:.2f}s "
+          f"(including the start of the workers), {replies} replies")
+    print(f"updates per worker: {router.routed}")
+    for error in errors:
+        print(f"ERROR {error}")
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main_sharded()
@@ -0,0 +1,83 @@
+"""Compare the ORM path with the snapshot read model for rankings.
+
+    python -m benchmarks.snapshot_vs_orm --chats 20 --teams 10
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks.datagen import generate, SessionLocal
+from database.models import Game
+from database.models.snapshot import GameSnapshot, get_snapshot, invalidate_snapshots
+
+
+def orm_rankings(game_ids):
+    with SessionLocal() as session:
+        return [[(t.id, t.score) for t in session.get(Game, game_id).ranking] for game_id in game_ids]
+
+
+def snapshot_rankings(game_ids, cached: bool):
+    if not cached:
+        invalidate_snapshots()
+    with SessionLocal() as session:
+        return [[(t.id, t.score) for t in get_snapshot(session, game_id).ranking] for game_id in game_ids]
+
+
+def measure(func, *args, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def retained_memory(load, game_ids):
+    """Bytes still allocated by the objects built to rank the games"""
+    gc.collect()
+    tracemalloc.start()
+    with SessionLocal() as session:
+        start = tracemalloc.take_snapshot()
+        kept = load(session, game_ids)
+        gc.collect()
+        size = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(start, "filename"))
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def load_orm(session, game_ids):
+    games = [session.get(Game, game_id) for game_id in game_ids]
+    for game in games:
+        game.ranking
+    return games
+
+
+def load_snapshots(session, game_ids):
+    return [GameSnapshot.load(session, game_id) for game_id in game_ids]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--teams", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    generate(args.chats, args.teams)
+    with SessionLocal() as session:
+        game_ids = [g.id for g in session.query(Game).all()]
+
+    assert orm_rankings(game_ids) == snapshot_rankings(game_ids, cached=False)
+
+    print(f"{args.chats} chats x {args.teams} teams")
+    print(f"orm       {measure(orm_rankings, game_ids, repeat=args.repeat) * 1000:8.2f} ms")
+    print(f"snapshot  {measure(snapshot_rankings, game_ids, False, repeat=args.repeat) * 1000:8.2f} ms (cold)")
+    print(f"snapshot  {measure(snapshot_rankings, game_ids, True, repeat=args.repeat) * 1000:8.2f} ms (cached)")
+    print(f"orm       {retained_memory(load_orm, game_ids) / 1024:8.1f} KiB")
+    print(f"snapshot  {retained_memory(load_snapshots, game_ids) / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
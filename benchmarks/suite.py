@@ -0,0 +1,207 @@
+"""Timings of the hot paths, saved as JSON to compare commits.
+
+    python -m benchmarks.suite --chats 20 --teams 8 --output before.json
+    python -m benchmarks.suite --chats 20 --teams 8 --output after.json --compare before.json
+
+Every benchmark runs `--repeat` times on a synthetic database (see datagen)
+and reports min, median and mean seconds.
+
+The output is one JSON object:
+
+    {"commit": "abc1234", "date": "...", "python": "3.11.7",
+     "params": {"chats": 20, "teams": 8, ...},
+     "results": {"<benchmark>": {"min": s, "median": s, "mean": s, "repeat": n}}}
+
+--compare reads a previous output and flags the medians more than
+REGRESSION_THRESHOLD slower, warning when the params differ.
+
+It is a script like the other benchmarks and not a pytest-benchmark (or
+asv) suite: the size of the database, the Wikidata payloads and the fake
+latency are command line parameters, one database is shared by all the
+benchmarks, and the runs are compared across commits checked out one after
+the other. The tests (pytest) only cover correctness.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import datetime as dt
+
+from benchmarks.datagen import generate, SessionLocal
+from benchmarks.fakebot import FakeRequest, TOKEN
+from benchmarks.fakewikidata import FakeWikidata, synthetic_people, people_from_db, sparql_payload
+
+from telegram.ext import CallbackContext
+
+from database.models import Game, Team, Athlet
+from database.models.wikidata import get_query_df
+from database.models.snapshot import GameSnapshot, invalidate_snapshots
+from functions.views import render_team
+from functions.scheduler import SweepScheduler
+
+import main
+
+PAYLOAD_SIZES = (10, 100, 1000, 5000)
+# Relative slowdown of the median reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.10
+
+
+def timings(func, repeat: int, setup=None) -> dict:
+    """Run setup (untimed) and func repeat times"""
+    results = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        func(state) if setup else func()
+        results.append(time.perf_counter() - start)
+    return {
+        "min": min(results),
+        "median": statistics.median(results),
+        "mean": statistics.fmean(results),
+        "repeat": repeat,
+    }
+
+
+def game_ids() -> list[int]:
+    with SessionLocal() as session:
+        return [g.id for g in session.query(Game).order_by(Game.id)]
+
+
+def bench_ranking(ids: list[int]) -> None:
+    with SessionLocal() as session:
+        for game_id in ids:
+            session.get(Game, game_id).ranking
+
+
+def bench_team_score() -> None:
+    with SessionLocal() as session:
+        for team in session.query(Team).all():
+            team.score
+
+
+def bench_team_render(ids: list[int]) -> None:
+    invalidate_snapshots()
+    with SessionLocal() as session:
+        for game_id in ids:
+            snapshot = GameSnapshot.load(session, game_id)
+            for team in snapshot.teams:
+                render_team(snapshot, team.id)
+
+
+def bench_refresh(people) -> None:
+    """Athlet.get_or_create on athlets already in the database, as the sweep does"""
+    with SessionLocal() as session:
+        for p in people:
+            Athlet.get_or_create(
+                session=session, name=p.label, dob=p.birth, dod=p.death, WID=p.wiki_id,
+                genders=p.genders, citizenships=p.citizenships, occupations=p.occupations,
+            )
+        session.flush()
+        session.rollback()
+
+
+def setup_sweep(args):
+    """Fresh games and a fake Wikidata where death_ratio of the drafted athlets died"""
+    def setup():
+        generate(args.chats, args.teams, seed=args.seed)
+        # Every athlet due and no call budget: the whole watch set is checked
+        main.sweep_scheduler = SweepScheduler(calls_per_day=10**9)
+        with SessionLocal() as session:
+            people = people_from_db(session, args.death_ratio, seed=args.seed)
+        return people
+    return setup
+
+
+def bench_sweep(people, latency: float) -> None:
+    async def run():
+        application = main.build_application(TOKEN, request=FakeRequest(latency=latency))
+        async with application:
+            context = CallbackContext(application)
+            await main.update_deads(context)
+            await main.dispatch_outbox(context)
+    with FakeWikidata(people, latency=latency):
+        asyncio.run(run())
+
+
+def run_all(args) -> dict:
+    results = {}
+    generate(args.chats, args.teams, seed=args.seed)
+    ids = game_ids()
+    results["game_ranking"] = timings(lambda: bench_ranking(ids), args.repeat)
+    results["team_score"] = timings(bench_team_score, args.repeat)
+    results["on_team_render"] = timings(lambda: bench_team_render(ids), args.repeat)
+    for size in PAYLOAD_SIZES:
+        payload = sparql_payload(synthetic_people(size, seed=args.seed))
+        results[f"get_query_df_{size}"] = timings(lambda: get_query_df(payload), args.repeat)
+    with SessionLocal() as session:
+        people = people_from_db(session, death_ratio=0, seed=args.seed)
+    results["athlet_refresh"] = timings(bench_refresh, args.repeat, setup=lambda: people)
+    results["update_deads"] = timings(
+        lambda people: bench_sweep(people, args.latency), args.sweep_repeat, setup=setup_sweep(args))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(results: dict, baseline: dict) -> None:
+    print(f"{'benchmark':<22}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median"], current["median"]
+        change = (after - before) / before if before else 0.0
+        flag = "  REGRESSION" if change > REGRESSION_THRESHOLD else ""
+        print(f"{name:<22}{before * 1000:>10.2f}ms{after * 1000:>10.2f}ms{change:>+10.1%}{flag}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--teams", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sweep-repeat", type=int, default=3)
+    parser.add_argument("--death-ratio", type=float, default=0.02, help="athlets found dead by the sweep")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake Wikidata and Bot API call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="JSON of a previous run")
+    return parser.parse_args()
+
+
+def main_benchmarks():
+    args = parse_args()
+    results = run_all(args)
+    report = {
+        "commit": git_commit(),
+        "date": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:<22}{result['median'] * 1000:>10.2f} ms (min {result['min'] * 1000:.2f} ms)")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["params"] != report["params"]:
+            print(f"Warning: the baseline ran with {baseline['params']}")
+        compare(results, baseline["results"])
+
+
+if __name__ == "__main__":
+    main_benchmarks()
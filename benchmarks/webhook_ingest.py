@@ -0,0 +1,80 @@
+"""Post synthetic /ranking updates to a local webhook and measure ingestion.
+
+    python -m benchmarks.webhook_ingest --updates 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.datagen import generate, FakeTelegramUser
+from benchmarks.fakebot import FakeRequest, TOKEN, command_update
+
+import main
+
+SECRET = "benchmark-secret"
+
+
+async def run(args) -> None:
+    request = FakeRequest()
+    application = main.build_application(TOKEN, request=request)
+    url = f"http://127.0.0.1:{args.port}/{main.WEBHOOK_PATH}"
+
+    async with application:
+        await application.updater.start_webhook(
+            listen="127.0.0.1", port=args.port, url_path=main.WEBHOOK_PATH,
+            webhook_url=url, secret_token=SECRET,
+        )
+        await application.start()
+
+        updates = [
+            command_update(i + 1, -(i % args.chats + 1), FakeTelegramUser(1).id, "/ranking")
+            for i in range(args.updates)
+        ]
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+        async with httpx.AsyncClient() as client:
+            # Requests without the secret token must be refused
+            rejected = await client.post(url, json=updates[0])
+            assert rejected.status_code == 403, rejected.status_code
+
+            async def post(update):
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post(
+                        url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+                    latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(post(u) for u in updates))
+            accepted = time.perf_counter() - start
+            while len(request.sent_messages()) < args.updates:
+                await asyncio.sleep(0.01)
+            processed = time.perf_counter() - start
+
+        await application.updater.stop()
+        await application.stop()
+
+    latencies.sort()
+    print(f"{args.updates} updates, {args.concurrency} concurrent clients")
+    print(f"accepted in  {accepted:.3f}s ({args.updates / accepted:.0f} updates/s)")
+    print(f"processed in {processed:.3f}s ({args.updates / processed:.0f} updates/s)")
+    print(f"post p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--teams", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    generate(args.chats, args.teams)
+    asyncio.run(run(args))
@@ -1,11 +1,37 @@
-from models.db import Base, engine
+from sqlalchemy import inspect
+
+from models.db import Base, engine, SessionLocal
+from models.replay import backfill
 import models.athlet  # Ensure all models are imported
 import models.team
 import models.game
 import models.user
 import models.bonus
+import models.outbox
+import models.events
 
 # Create all tables in the database
 Base.metadata.create_all(bind=engine)
 
-print("Database tables created successfully!")
\ No newline at end of file
+# athlet_team got an id for the pick order: older SQLite databases have the
+# picks in rowid order, copy them in that order
+with engine.begin() as conn:
+    columns = [c["name"] for c in inspect(conn).get_columns("athlet_team")]
+    if "id" not in columns and engine.dialect.name == "sqlite":
+        conn.exec_driver_sql("ALTER TABLE athlet_team RENAME TO athlet_team_old")
+        models.athlet.athlet_team.create(conn)
+        conn.exec_driver_sql(
+            "INSERT INTO athlet_team (athlet_id, team_id) SELECT athlet_id, team_id FROM athlet_team_old ORDER BY rowid"
+        )
+        conn.exec_driver_sql("DROP TABLE athlet_team_old")
+        print("athlet_team upgraded with the pick order")
+
+# The event log is younger than the games: log the state of the games that
+# have no events yet here, before the bot appends to them, so that their
+# replay starts from the beginning
+with SessionLocal() as session, session.begin():
+    filled = backfill(session)
+    if filled:
+        print(f"Events written for {filled} games older than the log")
+
+print("Database tables created successfully!")
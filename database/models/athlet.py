@@ -2,7 +2,7 @@ import datetime as dt
 import dateutil.parser as dp
 from typing import Optional, List
 from html import escape
-from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Table, create_engine
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Table, UniqueConstraint, create_engine
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.orm import Session
 
@@ -21,8 +21,10 @@ firstdeath_game = Table(
 
 athlet_team = Table(
     'athlet_team', Base.metadata,
-    Column('athlet_id', Integer, ForeignKey('athlets.id'), primary_key=True),
-    Column('team_id', Integer, ForeignKey('teams.id'), primary_key=True)
+    Column('id', Integer, primary_key=True, autoincrement=True),  # Pick order
+    Column('athlet_id', Integer, ForeignKey('athlets.id'), nullable=False),
+    Column('team_id', Integer, ForeignKey('teams.id'), nullable=False),
+    UniqueConstraint('athlet_id', 'team_id'),
 )
 
 athlet_gender = Table(
@@ -241,31 +243,28 @@ class Athlet(Base):
     def is_dead(self) -> bool:
         return self.date_of_death is not None
     @property
+    def stats(self) -> "AthletStats":
+        return athlet_stats(self.wiki_id, self.date_of_birth, self.date_of_death)
+
+    @property
     def age(self) -> int:
-        recent_date = dt.datetime.now().date()
-        if self.is_dead and self.date_of_death:
-            recent_date = self.date_of_death
-        return self.calculate_age(self.date_of_birth, recent_date)
+        return self.stats.age
 
     @property
     def gonzales(self) -> bool:
-        return self.is_dead and self.date_of_death and self.date_of_death.month == 1
+        return self.stats.gonzales
 
     @property
     def cesarini(self) -> bool:
-        return self.is_dead and self.date_of_death and self.date_of_death.month == 12 and self.date_of_death.day >= 25
+        return self.stats.cesarini
 
     @property
     def club27(self) -> bool:
-        return self.age == 27
+        return self.stats.club27
 
     @property
     def birthday(self) -> bool:
-        return (
-            self.is_dead and 
-            self.date_of_death and 
-            self.month_and_day(self.date_of_death) == self.month_and_day(self.date_of_birth)
-        )
+        return self.stats.birthday
 
     @property
     def score(self) -> int:
@@ -273,7 +272,7 @@ class Athlet(Base):
 
     @property
     def theoretical_score(self) -> int:
-        return self.calculate_theoretical_score()
+        return self.stats.theoretical_score
 
     @staticmethod
     def calculate_age(date1: dt.date, date2: dt.date) -> int:
@@ -298,21 +297,7 @@ class Athlet(Base):
         return None
 
     def calculate_theoretical_score(self) -> int:
-        basic_score = 100 - self.age
-
-        # Speedy Gonzales
-        gonzales = Bonus.SPEEDY_GONZALES if self.gonzales else 0
-
-        # Zona Cesarini
-        cesarini = Bonus.ZONA_CESARINI if self.cesarini else 0
-
-        # Club 27
-        club27 = Bonus.CLUB_27 if self.club27 else 0
-
-        # Happy Birthday
-        birthday = Bonus.HAPPY_BIRTHDAY if self.birthday else 0
-
-        return basic_score + gonzales + cesarini + club27 + birthday
+        return self.stats.theoretical_score
 
     def calculate_score(self) -> int:
         if self.is_banned or not self.is_dead:
@@ -350,3 +335,46 @@ class Athlet(Base):
         return desc
 
 
+class AthletStats:
+    """Age, bonus flags and theoretical score of an athlet on a given day"""
+    __slots__ = ("age", "gonzales", "cesarini", "club27", "birthday", "theoretical_score")
+
+    def __init__(self, date_of_birth: dt.date, date_of_death: dt.date|None, today: dt.date):
+        is_dead = date_of_death is not None
+        recent_date = date_of_death if is_dead else today
+        self.age = Athlet.calculate_age(date_of_birth, recent_date)
+        self.gonzales = is_dead and date_of_death.month == 1
+        self.cesarini = is_dead and date_of_death.month == 12 and date_of_death.day >= 25
+        self.club27 = self.age == 27
+        self.birthday = is_dead and Athlet.month_and_day(date_of_death) == Athlet.month_and_day(date_of_birth)
+
+        basic_score = 100 - self.age
+        # Speedy Gonzales
+        gonzales = Bonus.SPEEDY_GONZALES if self.gonzales else 0
+        # Zona Cesarini
+        cesarini = Bonus.ZONA_CESARINI if self.cesarini else 0
+        # Club 27
+        club27 = Bonus.CLUB_27 if self.club27 else 0
+        # Happy Birthday
+        birthday = Bonus.HAPPY_BIRTHDAY if self.birthday else 0
+        self.theoretical_score = basic_score + gonzales + cesarini + club27 + birthday
+
+
+# Day-scoped memo: wiki_id -> (date_of_birth, date_of_death, stats).
+# The whole memo is dropped when the day changes, a single entry is replaced
+# as soon as the dates it was computed from change.
+_stats_day: dt.date|None = None
+_stats_memo: dict[str, tuple[dt.date, dt.date|None, AthletStats]] = {}
+
+def athlet_stats(wiki_id: str, date_of_birth: dt.date, date_of_death: dt.date|None) -> AthletStats:
+    global _stats_day
+    today = dt.date.today()
+    if today != _stats_day:
+        _stats_memo.clear()
+        _stats_day = today
+    entry = _stats_memo.get(wiki_id)
+    if entry is not None and entry[0] == date_of_birth and entry[1] == date_of_death:
+        return entry[2]
+    stats = AthletStats(date_of_birth, date_of_death, today)
+    _stats_memo[wiki_id] = (date_of_birth, date_of_death, stats)
+    return stats
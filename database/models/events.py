@@ -0,0 +1,36 @@
+import enum
+import datetime as dt
+from sqlalchemy import Enum, Column, Integer, String, Date, DateTime, ForeignKey
+from sqlalchemy.orm import relationship
+
+from .db import Base
+
+class EventKind(enum.Enum):
+    PICK         = 0  # team, athlet
+    CAPTAIN      = 1  # team, athlet
+    CANCEL_DRAFT = 2  # every team loses its athlets and captain
+    DEATH        = 3  # athlet, date of death
+    FIRST_DEATH  = 4  # athlet, the teams that have him get the bonus
+
+class GameEvent(Base):
+    """Change of a game, written in the same transaction as the change and never updated.
+
+    The id gives the order of the events; see replay.py to rebuild a game from them.
+    """
+    __tablename__ = 'game_events'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False, index=True)
+    kind = Column(Enum(EventKind), nullable=False)
+    team_id = Column(Integer, ForeignKey("teams.id"), nullable=True)
+    athlet_id = Column(Integer, ForeignKey("athlets.id"), nullable=True)
+    date = Column(Date, nullable=True)
+    source = Column(String, nullable=True)  # What made the change, e.g. "sweep" or "kill"
+    created_on = Column(DateTime, default=dt.datetime.utcnow)
+
+    # Set the ids at flush time, the athlet of a pick can be new
+    team = relationship("Team", foreign_keys=[team_id])
+    athlet = relationship("Athlet", foreign_keys=[athlet_id])
+
+    def __repr__(self):
+        return f"<GameEvent(game_id={self.game_id}, kind={self.kind.name}, team_id={self.team_id}, athlet_id={self.athlet_id})>"
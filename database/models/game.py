@@ -1,11 +1,14 @@
 from typing import Optional
+import os
 import random
 import uuid
 import enum
 import datetime as dt
+import yaml
 from typing import Optional, List
 from html import escape
 from sqlalchemy import Enum, Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Table, create_engine
+from sqlalchemy import func, case
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.orm import Session
 
@@ -13,10 +16,37 @@ from telegram import User as TgUser
 
 from .db import Base
 from .team import Team
-from .athlet import Athlet
+from .athlet import Athlet, athlet_team
 from .user import User
+from .events import GameEvent, EventKind
 from . import utils
 
+BAN_LIST_FILE = os.getenv("BAN_LIST_FILE", "ban_list.yaml")
+
+_ban_list: frozenset[str]|None = None
+
+def get_ban_list() -> frozenset[str]:
+    """Wikidata IDs of the athlets that can not be picked, read once from BAN_LIST_FILE"""
+    global _ban_list
+    if _ban_list is None:
+        try:
+            with open(BAN_LIST_FILE, 'r') as f:
+                _ban_list = frozenset(str(wid) for wid in (yaml.safe_load(f) or {}))
+        except FileNotFoundError:
+            _ban_list = frozenset()
+    return _ban_list
+
+# Version of what the views of a game show, bumped by every write path.
+# Process local: it keys caches of rendered messages (see functions/views.py)
+_versions: dict[int, int] = {}
+
+def game_version(game_id: int) -> int:
+    return _versions.get(game_id, 0)
+
+def bump_game_version(game_id: int|None) -> None:
+    if game_id is not None:
+        _versions[game_id] = _versions.get(game_id, 0) + 1
+
 class Status(enum.Enum):
     START   = 0
     DRAFT   = 1
@@ -24,6 +54,8 @@ class Status(enum.Enum):
     RUN     = 3
     END     = 4
 
+ACTIVE_STATUSES = (Status.DRAFT, Status.CAPTAIN, Status.RUN)
+
 class Game(Base):
     __tablename__ = 'games'
     
@@ -42,6 +74,8 @@ class Game(Base):
     creator = relationship("User", back_populates="games", foreign_keys=[creator_id])
     
     teams = relationship("Team", back_populates="game", foreign_keys="[Team.game_id]", cascade="all, delete-orphan")
+    # Append only, never loaded as a whole: see database/models/replay.py
+    events = relationship("GameEvent", lazy="write_only", order_by="GameEvent.id")
 
     @property
     def ranking(self) -> list[Team]:
@@ -67,9 +101,85 @@ class Game(Base):
     def num_athlets(self) -> int:
         return len(self.athlets)
 
+    @property
+    def athlets_index(self) -> dict[Athlet, list[Team]]:
+        # athlet -> teams of this game, kept on the instance and updated by
+        # add_athlet and cancel_draft so that membership checks are O(1)
+        index = getattr(self, "_athlets_index", None)
+        if index is None:
+            index = {}
+            for team in self.teams:
+                for athlet in team.athlets:
+                    index.setdefault(athlet, []).append(team)
+            self._athlets_index = index
+        return index
+
+    @staticmethod
+    def watched_athlets_ids(session: Session):
+        """Subquery with the ids of the athlets drafted in at least one active game"""
+        return (
+            session.query(athlet_team.c.athlet_id)
+            .join(Team, athlet_team.c.team_id == Team.id)
+            .join(Game, Team.game_id == Game.id)
+            .where(Game.status.in_(ACTIVE_STATUSES))
+            .distinct()
+        )
+
+    @staticmethod
+    def watched_athlets(session: Session) -> list[Athlet]:
+        """Alive athlets drafted in at least one active game, each one only once"""
+        return session.query(Athlet).where(
+            Athlet.date_of_death == None,
+            Athlet.id.in_(Game.watched_athlets_ids(session))
+        ).all()
+
+    @staticmethod
+    def watched_athlets_weights(session: Session) -> list[tuple[int, str, dt.date, int, int]]:
+        """(id, wiki id, date of birth, teams, captaincies) of the alive athlets drafted in active games"""
+        return session.query(
+            Athlet.id,
+            Athlet.wiki_id,
+            Athlet.date_of_birth,
+            func.count(Team.id),
+            func.sum(case((Team.captain_id == Athlet.id, 1), else_=0)),
+        ).join(athlet_team, athlet_team.c.athlet_id == Athlet.id
+        ).join(Team, athlet_team.c.team_id == Team.id
+        ).join(Game, Team.game_id == Game.id
+        ).where(
+            Athlet.date_of_death == None,
+            Game.status.in_(ACTIVE_STATUSES),
+        ).group_by(Athlet.id).all()
+
+    @staticmethod
+    def unwatched_athlets(session: Session) -> list[Athlet]:
+        """Alive athlets that are not part of any active game"""
+        return session.query(Athlet).where(
+            Athlet.date_of_death == None,
+            Athlet.id.not_in(Game.watched_athlets_ids(session))
+        ).all()
+
+    @staticmethod
+    def bump_athlet_games(athlet: Athlet) -> None:
+        """New version for every game of the athlet, e.g. after his death"""
+        for team in athlet.teams:
+            bump_game_version(team.game_id)
+
+    @staticmethod
+    def log_death(athlet: Athlet, source: str) -> None:
+        """DEATH event in every game of the athlet"""
+        for game in dict.fromkeys(team.game for team in athlet.teams):
+            game.log_event(EventKind.DEATH, athlet=athlet, date=athlet.date_of_death, source=source)
+
+    def bump_version(self) -> None:
+        bump_game_version(self.id)
+
+    def log_event(self, kind: EventKind, team: Team|None = None, athlet: Athlet|None = None,
+                  date: dt.date|None = None, source: str|None = None) -> None:
+        self.events.add(GameEvent(kind=kind, team=team, athlet=athlet, date=date, source=source))
+
     def get_team_from_owner(self, owner: User, session: Session) -> Team:
-        team = session.query(Team).filter_by(game=self, owner=owner).one_or_none()
-        return team
+        # From the loaded teams: the owner can be new, not flushed yet
+        return next((team for team in self.teams if team.owner == owner), None)
     
     def start_draft(self) -> None:
         draft_order = list(range(self.num_teams))
@@ -99,6 +209,9 @@ class Game(Base):
     def cancel_draft(self) -> None:
         for team in self.teams:
             team.remove_all_athlets()
+        self._athlets_index = None
+        self.bump_version()
+        self.log_event(EventKind.CANCEL_DRAFT, source="cancel_draft")
         self.current_drafter_idx = None
         self.status = Status.START
     
@@ -128,11 +241,14 @@ class Game(Base):
             raise ValueError(f"There is no athlet with index {idx}.")
 
         team.set_captain_from_idx(idx)
+        self.bump_version()
+        self.log_event(EventKind.CAPTAIN, team=team, athlet=team.captain, source="captain")
     
     def rename_team(self, team: Team, name: str) -> None:
         if team not in self.teams:
             raise ValueError("The team is not part of the game")
         team.name = name
+        self.bump_version()
     
     def add_athlet(self, team: Team, athlet: Athlet, allow_deads: bool = False) -> None:
         if self.status != Status.DRAFT:
@@ -141,25 +257,38 @@ class Game(Base):
         if team not in self.teams:
             raise ValueError("The team is not part of the game!")
         
-        # if athlet in self.ban_list:
-        #     raise ValueError("The athlet is in the ban list")
+        self.check_eligibility(athlet, allow_deads=allow_deads)
+
+        team.add_athlet(athlet)
+        self.athlets_index.setdefault(athlet, []).append(team)
+        self.bump_version()
+        self.log_event(EventKind.PICK, team=team, athlet=athlet, source="draft")
+        if athlet.is_dead:
+            # Picked already dead: the replay needs his death too
+            self.log_event(EventKind.DEATH, athlet=athlet, date=athlet.date_of_death, source="draft")
+
+    def check_eligibility(self, athlet: Athlet, allow_deads: bool = False) -> None:
+        if athlet.is_banned or athlet.wiki_id in get_ban_list():
+            raise ValueError("The athlet is in the ban list")
         
-        if athlet in self.athlets:
+        if athlet in self.athlets_index:
             raise ValueError("The athlet is already part of a team")
         
         if athlet.is_dead and not allow_deads:
             raise ValueError("The athlet is already dead :(")
-
-        team.add_athlet(athlet)
     
     def get_teams_with_athlet(self, athlet: Athlet) -> list[Team]:
-        return [t for t in self.teams if athlet in t.athlets]
+        return list(self.athlets_index.get(athlet, []))
+
+    def update_first_death(self, new_dead_athlets: list[Athlet], source: str = "sweep") -> list[Team]:
+        athlets_index = self.athlets_index
+        athlets_in_game = [ath for ath in new_dead_athlets if ath in athlets_index]
+        if athlets_in_game:
+            self.bump_version()
 
-    def update_first_death(self, new_dead_athlets: list[Athlet]) -> list[Team]:
         if self.first_deaths:
             return []
         
-        athlets_in_game = [ath for ath in new_dead_athlets if ath in self.athlets]
         # remove alive athlets (this should never happen)
         athlets_in_game = [ath for ath in athlets_in_game if ath.is_dead]
 
@@ -173,6 +302,8 @@ class Game(Base):
         first_dead_athlets = [ath for ath in athlets_in_game if ath.date_of_death == first_date]
         
         self.first_deaths = first_dead_athlets
+        for ath in first_dead_athlets:
+            self.log_event(EventKind.FIRST_DEATH, athlet=ath, date=first_date, source=source)
 
         first_death_teams = []
 
@@ -184,9 +315,6 @@ class Game(Base):
 
         return first_death_teams
     
-    # def add_to_banlist(self, athlet: Athlet) -> None:
-    #     self.ban_list.append(athlet)
-
     def is_creator(self, user: int|TgUser) -> bool:
         user_id = utils.user_id(user)
         return user_id == self.creator.telegram_id
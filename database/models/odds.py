@@ -0,0 +1,173 @@
+import os
+import datetime as dt
+from dataclasses import dataclass
+
+import numpy as np
+import yaml
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .athlet import Gender
+from .bonus import Bonus
+from .scoring import ScoringArrays, NO_PROPERTY, athlet_points, death_points, split_date, team_scores
+
+# Monte Carlo projection of the season of a game.
+# Every alive athlet dies on a random day until the end of the season with
+# the death rate of his age and gender (bundled life tables), the deaths are
+# scored with the same rules as scoring.team_scores.
+
+LIFE_TABLES_FILE = os.path.join(os.path.dirname(__file__), "life_tables.yaml")
+MAX_AGE = 120
+# Wikidata ids of the genders with a life table, the others use the mean
+MALE = "Q6581097"
+FEMALE = "Q6581072"
+SEX_MALE, SEX_FEMALE, SEX_OTHER = 0, 1, 2
+
+SEASONS = 20000
+# Seasons simulated at once, bounds the memory to a few MB per 100 athlets
+BATCH_SEASONS = 5000
+
+_death_rates: np.ndarray|None = None
+
+
+def death_rates() -> np.ndarray:
+    """Yearly probability of dying, by sex (male, female, other) and age"""
+    global _death_rates
+    if _death_rates is None:
+        with open(LIFE_TABLES_FILE) as f:
+            tables = yaml.safe_load(f)
+        ages = np.arange(MAX_AGE + 1)
+        rates = []
+        for sex in ("male", "female"):
+            table_ages = np.array(sorted(tables[sex]), dtype=float)
+            table_q = np.array([tables[sex][a] for a in sorted(tables[sex])], dtype=float)
+            rates.append(np.exp(np.interp(ages, table_ages, np.log(table_q))))
+        rates.append((rates[0] + rates[1]) / 2)
+        _death_rates = np.array(rates)
+    return _death_rates
+
+
+@dataclass
+class TeamOdds:
+    team_id: int
+    score: int
+    expected_score: float
+    win_probability: float
+
+
+def load_sexes(session: Session, arrays: ScoringArrays) -> np.ndarray:
+    """Life table (SEX_*) of every athlet of the arrays, from his main gender"""
+    gender_ids = np.unique(arrays.genders[arrays.genders != NO_PROPERTY])
+    wiki_ids = dict(session.execute(select(Gender.id, Gender.wiki_id).where(Gender.id.in_(gender_ids.tolist()))).all())
+    sex_of = {MALE: SEX_MALE, FEMALE: SEX_FEMALE}
+    return np.array([sex_of.get(wiki_ids.get(int(g)), SEX_OTHER) for g in arrays.genders], dtype=np.int64)
+
+
+def one_hot(index: np.ndarray, size: int) -> np.ndarray:
+    matrix = np.zeros((len(index), size))
+    matrix[np.arange(len(index)), index] = 1
+    return matrix
+
+
+def season_end(today: dt.date) -> dt.date:
+    return dt.date(today.year, 12, 31)
+
+
+def simulate(arrays: ScoringArrays, sexes: np.ndarray, seasons: int = SEASONS,
+             seed: int|None = None, end: dt.date|None = None) -> list[TeamOdds]:
+    """Expected final score and win probability of every team of the arrays.
+
+    The arrays must hold the teams of one game. With a seed the result is
+    always the same.
+    """
+    rng = np.random.default_rng(seed)
+    n_teams = len(arrays.team_ids)
+    if n_teams == 0:
+        return []
+    current = team_scores(arrays)
+    if len(arrays.athlet_ids) == 0:
+        return [TeamOdds(int(team_id), 0, 0.0, 1 / n_teams) for team_id in arrays.team_ids]
+    today = arrays.today
+    end = np.datetime64(end or season_end(today.item()), "D")
+    days = max(int((end - today).astype(np.int64)) + 1, 1)
+
+    dead = ~np.isnat(arrays.death)
+    alive = np.flatnonzero(~dead)
+    points = athlet_points(arrays).astype(float)
+
+    # Daily death rate of the alive athlets, from the age of today
+    birth_y, birth_m, birth_d = split_date(arrays.birth[alive])
+    today_y, today_m, today_d = split_date(today)
+    age = today_y - birth_y - 1 + (((today_m - birth_m) >= 0) & ((today_d - birth_d) >= 0))
+    yearly = death_rates()[sexes[alive], np.clip(age, 0, MAX_AGE)]
+    daily = -np.log1p(-np.minimum(yearly, 0.999)) / 365.25
+    # Points of a death on each day of the rest of the season
+    dates = today + np.arange(days)
+    day_points = death_points(arrays.birth[alive][:, None], dates[None, :]).astype(float)
+    day_points[arrays.banned[alive]] = 0
+
+    members = arrays.member_athlets
+    member_teams = one_hot(arrays.member_teams, n_teams)
+    property_groups = []
+    for properties, mult in (
+        (arrays.citizenships, Bonus.GLOBETROTTER_MULT),
+        (arrays.genders, Bonus.INCLUSIVITY_MULT),
+        (arrays.occupations, Bonus.JACK_OF_ALL_TRADES_MULT),
+    ):
+        # Members grouped by (team, main property): a group counts once if any of them died
+        codes = properties[members]
+        valid = codes != NO_PROPERTY
+        keys = arrays.member_teams * (int(properties.max(initial=NO_PROPERTY)) + 1) + codes
+        groups, group_of_member = np.unique(keys[valid], return_inverse=True)
+        member_groups = np.zeros((len(members), len(groups)))
+        member_groups[np.flatnonzero(valid), group_of_member] = 1
+        group_teams = one_hot(arrays.member_teams[valid][np.unique(group_of_member, return_index=True)[1]], n_teams)
+        property_groups.append((member_groups, group_teams, mult))
+
+    captains = arrays.captains
+    has_captain = captains >= 0
+    first_death_done = bool(arrays.first_death.any())
+
+    total_scores = np.zeros(n_teams)
+    wins = np.zeros(n_teams)
+    for start in range(0, seasons, BATCH_SEASONS):
+        n = min(BATCH_SEASONS, seasons - start)
+        # Exponential time to death: dies this season if it comes before the end
+        death_day = -np.log1p(-rng.random((n, len(alive)))) / daily
+        dies = death_day < days
+        day = np.where(dies, death_day, 0).astype(np.int64)
+
+        season_points = np.broadcast_to(points, (n, len(points))).copy()
+        season_points[:, alive] = np.where(dies, day_points[np.arange(len(alive)), day], 0)
+        season_dead = np.broadcast_to(dead, (n, len(dead))).copy()
+        season_dead[:, alive] = dies
+
+        scores = season_points[:, members] @ member_teams
+        scores += np.where(has_captain, (Bonus.CAPTAIN_MULT - 1) * season_points[:, np.maximum(captains, 0)], 0)
+        dead_members = season_dead[:, members].astype(float)
+        for member_groups, group_teams, mult in property_groups:
+            distinct = (dead_members @ member_groups > 0) @ group_teams
+            scores += mult * np.maximum(distinct - 1, 0)
+        if first_death_done:
+            scores += Bonus.FIRST_DEATH * arrays.first_death
+        else:
+            # Teams with one of the athlets dead on the first day of death
+            death_days = np.where(dies, day, days)
+            first_day = death_days.min(axis=1, keepdims=True)
+            first_dead = np.zeros((n, len(dead)))
+            first_dead[:, alive] = (death_days == first_day) & (first_day < days)
+            scores += Bonus.FIRST_DEATH * ((first_dead[:, members] @ member_teams) > 0)
+
+        total_scores += scores.sum(axis=0)
+        winners = scores == scores.max(axis=1, keepdims=True)
+        wins += (winners / winners.sum(axis=1, keepdims=True)).sum(axis=0)
+
+    return [
+        TeamOdds(int(team_id), int(current[i]), float(total_scores[i] / seasons), float(wins[i] / seasons))
+        for i, team_id in enumerate(arrays.team_ids)
+    ]
+
+
+def project(session: Session, game_id: int, seasons: int = SEASONS, seed: int|None = None) -> list[TeamOdds]:
+    arrays = ScoringArrays.load(session, [game_id])
+    return simulate(arrays, load_sexes(session, arrays), seasons=seasons, seed=seed)
@@ -0,0 +1,77 @@
+import datetime as dt
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.orm import Session
+
+from .db import Base
+
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = dt.timedelta(seconds=30)
+# A claimed message is not pending again before this, unless its outcome is stored
+CLAIM_LEASE = dt.timedelta(minutes=5)
+
+class OutboxMessage(Base):
+    """Message to be delivered to a chat, written in the same transaction as the change it announces"""
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    key = Column(String, unique=True, nullable=False)  # Idempotency key
+    chat_id = Column(Integer, nullable=False)
+    text = Column(String, nullable=False)
+    parse_mode = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    next_attempt_on = Column(DateTime, default=dt.datetime.utcnow)
+    sent_on = Column(DateTime, nullable=True)
+    created_on = Column(DateTime, default=dt.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<OutboxMessage(key='{self.key}', chat_id={self.chat_id})>"
+
+    @staticmethod
+    def enqueue(session: Session, key: str, chat_id: int, text: str, parse_mode: str|None = None) -> "OutboxMessage":
+        """Add a message to the outbox, unless a message with the same key is already there"""
+        message = session.query(OutboxMessage).filter_by(key=key).one_or_none()
+        if not message:
+            message = OutboxMessage(key=key, chat_id=chat_id, text=text, parse_mode=parse_mode)
+            session.add(message)
+        return message
+
+    @staticmethod
+    def pending(session: Session, limit: int|None = None) -> list["OutboxMessage"]:
+        query = (
+            session.query(OutboxMessage)
+            .where(
+                OutboxMessage.sent_on == None,
+                OutboxMessage.attempts < MAX_ATTEMPTS,
+                OutboxMessage.next_attempt_on <= dt.datetime.utcnow(),
+            )
+            .order_by(OutboxMessage.id)
+        )
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    @staticmethod
+    def claim(session: Session, limit: int|None = None) -> list["OutboxMessage"]:
+        """Pending messages, hidden from the other dispatchers until CLAIM_LEASE is over"""
+        messages = OutboxMessage.pending(session, limit)
+        lease_end = dt.datetime.utcnow() + CLAIM_LEASE
+        for message in messages:
+            message.next_attempt_on = lease_end
+        return messages
+
+    @staticmethod
+    def backlog(session: Session) -> int:
+        return session.query(OutboxMessage).where(
+            OutboxMessage.sent_on == None,
+            OutboxMessage.attempts < MAX_ATTEMPTS,
+        ).count()
+
+    def mark_sent(self) -> None:
+        self.sent_on = dt.datetime.utcnow()
+
+    def mark_failed(self, error: str, permanent: bool = False) -> None:
+        """permanent: no retry, e.g. the message is malformed or the bot left the chat"""
+        self.attempts = MAX_ATTEMPTS if permanent else self.attempts + 1
+        self.last_error = error
+        self.next_attempt_on = dt.datetime.utcnow() + RETRY_BASE_DELAY * 2 ** (self.attempts - 1)
@@ -0,0 +1,187 @@
+import datetime as dt
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .athlet import Athlet, athlet_team, firstdeath_game
+from .team import Team
+from .game import Game, Status
+from .events import GameEvent, EventKind
+from .scoring import ScoringArrays, team_scores, rescore
+
+# Replay of the game event log.
+# Rebuilds the teams, the first deaths and the scores of games from the
+# game_events table alone, in one pass over the events ordered by id. Only
+# the static data of the athlets (birth, main properties, ban) is read from
+# the tables, so scores can be checked or recomputed with new rules without
+# any Wikidata call.
+
+EVENTS_PER_FETCH = 10000
+
+
+class ReplayedGame:
+    """State of a game after its events"""
+
+    def __init__(self, game_id: int):
+        self.game_id = game_id
+        self.rosters: dict[int, list[int]] = {}  # team id -> athlet ids, pick order
+        self.captains: dict[int, int] = {}
+        self.deaths: dict[int, dt.date] = {}
+        self.first_deaths: set[int] = set()
+        self.first_death_teams: set[int] = set()
+        self.events = 0
+
+    def apply(self, kind: EventKind, team_id: int|None, athlet_id: int|None, date: dt.date|None) -> None:
+        self.events += 1
+        if kind == EventKind.PICK:
+            self.rosters.setdefault(team_id, []).append(athlet_id)
+        elif kind == EventKind.CAPTAIN:
+            self.captains[team_id] = athlet_id
+        elif kind == EventKind.CANCEL_DRAFT:
+            # Same as Game.cancel_draft: the first deaths stay
+            self.rosters = {team: [] for team in self.rosters}
+            self.captains = {}
+        elif kind == EventKind.DEATH:
+            self.deaths[athlet_id] = date
+        elif kind == EventKind.FIRST_DEATH:
+            # Same as Game.update_first_death: the teams that have him now
+            self.first_deaths.add(athlet_id)
+            self.first_death_teams.update(team for team, athlets in self.rosters.items() if athlet_id in athlets)
+
+
+def replay(session: Session, game_ids: list[int]|None = None) -> dict[int, ReplayedGame]:
+    """Replay the events of the given (or all the) games, by game id"""
+    query = (
+        select(GameEvent.game_id, GameEvent.kind, GameEvent.team_id, GameEvent.athlet_id, GameEvent.date)
+        .order_by(GameEvent.id)
+        .execution_options(yield_per=EVENTS_PER_FETCH)
+    )
+    if game_ids is not None:
+        query = query.where(GameEvent.game_id.in_(game_ids))
+    games: dict[int, ReplayedGame] = {}
+    for game_id, kind, team_id, athlet_id, date in session.execute(query):
+        game = games.get(game_id)
+        if game is None:
+            game = games[game_id] = ReplayedGame(game_id)
+        game.apply(kind, team_id, athlet_id, date)
+    return games
+
+
+def replay_scores(session: Session, games: dict[int, ReplayedGame], today: dt.date|None = None) -> dict[int, int]:
+    """Score of every team of the replayed games with the current rules, by team id"""
+    teams = session.execute(
+        select(Team.id, Team.game_id).where(Team.game_id.in_(list(games))).order_by(Team.id)
+    ).all()
+    deaths = {}
+    members = []
+    team_rows = []
+    for team_id, game_id in teams:
+        game = games[game_id]
+        deaths.update(game.deaths)
+        members += [(athlet_id, team_id) for athlet_id in game.rosters.get(team_id, ())]
+        team_rows.append((team_id, game_id, game.captains.get(team_id), team_id in game.first_death_teams))
+    athlet_ids = {m[0] for m in members} | {t[2] for t in team_rows if t[2]}
+    athlets = [
+        (id, birth, deaths.get(id), banned, gender, citizenship, occupation)
+        for id, birth, banned, gender, citizenship, occupation in session.execute(
+            select(
+                Athlet.id, Athlet.date_of_birth, Athlet.is_banned,
+                Athlet.main_gender_id, Athlet.main_citizenship_id, Athlet.main_occupation_id,
+            )
+            .where(Athlet.id.in_(athlet_ids))
+            .order_by(Athlet.id)
+        )
+    ]
+    arrays = ScoringArrays(athlets, team_rows, members, today or dt.date.today())
+    return {int(team_id): int(score) for team_id, score in zip(arrays.team_ids, team_scores(arrays))}
+
+
+def active_game_ids(session: Session) -> list[int]:
+    """Games scored by rescore: all but the ended ones"""
+    return list(session.scalars(select(Game.id).where(Game.status != Status.END).order_by(Game.id)))
+
+
+def check_replay(session: Session, game_ids: list[int]|None = None) -> list[tuple[int, str]]:
+    """Differences between the tables and the replay of the log, as (game id, description)"""
+    game_ids = active_game_ids(session) if game_ids is None else game_ids
+    games = replay(session, game_ids)
+    differences = []
+
+    rosters: dict[int, list[int]] = {}
+    for athlet_id, team_id in session.execute(
+        select(athlet_team.c.athlet_id, athlet_team.c.team_id)
+        .join(Team, athlet_team.c.team_id == Team.id)
+        .where(Team.game_id.in_(game_ids))
+        # Pick order, as in GameSnapshot.load
+        .order_by(athlet_team.c.id)
+    ):
+        rosters.setdefault(team_id, []).append(athlet_id)
+    first_deaths: dict[int, set[int]] = {}
+    for athlet_id, game_id in session.execute(
+        select(firstdeath_game.c.athlet_id, firstdeath_game.c.game_id).where(firstdeath_game.c.game_id.in_(game_ids))
+    ):
+        first_deaths.setdefault(game_id, set()).add(athlet_id)
+    teams = session.execute(
+        select(Team.id, Team.game_id, Team.captain_id, Team.has_first_death)
+        .where(Team.game_id.in_(game_ids))
+        .order_by(Team.id)
+    ).all()
+    dates_of_death = dict(session.execute(
+        select(Athlet.id, Athlet.date_of_death)
+        .where(Athlet.id.in_({a for athlets in rosters.values() for a in athlets}))
+    ).all())
+
+    for team_id, game_id, captain_id, has_first_death in teams:
+        game = games.get(game_id)
+        if game is None:
+            if rosters.get(team_id):
+                differences.append((game_id, "no events, the game is older than the log"))
+            continue
+        if rosters.get(team_id, []) != game.rosters.get(team_id, []):
+            differences.append((game_id, f"team {team_id}: athlets {rosters.get(team_id, [])} vs {game.rosters.get(team_id, [])}"))
+        if captain_id != game.captains.get(team_id):
+            differences.append((game_id, f"team {team_id}: captain {captain_id} vs {game.captains.get(team_id)}"))
+        if bool(has_first_death) != (team_id in game.first_death_teams):
+            differences.append((game_id, f"team {team_id}: first death {bool(has_first_death)} vs {team_id in game.first_death_teams}"))
+        for athlet_id in rosters.get(team_id, []):
+            if dates_of_death.get(athlet_id) != game.deaths.get(athlet_id):
+                differences.append((game_id, f"athlet {athlet_id}: died {dates_of_death.get(athlet_id)} vs {game.deaths.get(athlet_id)}"))
+    for game_id, game in games.items():
+        if first_deaths.get(game_id, set()) != game.first_deaths:
+            differences.append((game_id, f"first deaths {sorted(first_deaths.get(game_id, ()))} vs {sorted(game.first_deaths)}"))
+
+    # Games without events were reported above, their scores are not comparable
+    logged = [game_id for game_id in game_ids if game_id in games]
+    if logged:
+        scores = replay_scores(session, games)
+        game_of_team = {team_id: game_id for team_id, game_id, *_ in teams}
+        for team_id, score in rescore(session, logged).items():
+            if scores.get(team_id) != score:
+                differences.append((game_of_team[team_id], f"team {team_id}: score {score} vs {scores.get(team_id)}"))
+    # Games without events are reported once, not once per team
+    return list(dict.fromkeys(differences))
+
+
+def backfill(session: Session, game_ids: list[int]|None = None) -> int:
+    """Events for the games that have none, from their current state. Returns the number of games
+
+    Run by init_db.py: a game that got events before being backfilled is
+    skipped and its replay stays incomplete.
+    """
+    game_ids = active_game_ids(session) if game_ids is None else game_ids
+    logged = set(session.scalars(select(GameEvent.game_id).where(GameEvent.game_id.in_(game_ids)).distinct()))
+    filled = 0
+    for game in session.scalars(select(Game).where(Game.id.in_(game_ids)).order_by(Game.id)):
+        if game.id in logged or not game.athlets:
+            continue
+        for team in game.teams:
+            for athlet in team.athlets:
+                game.log_event(EventKind.PICK, team=team, athlet=athlet, source="backfill")
+                if athlet.is_dead:
+                    game.log_event(EventKind.DEATH, athlet=athlet, date=athlet.date_of_death, source="backfill")
+            if team.captain is not None:
+                game.log_event(EventKind.CAPTAIN, team=team, athlet=team.captain, source="backfill")
+        for athlet in game.first_deaths:
+            game.log_event(EventKind.FIRST_DEATH, athlet=athlet, date=athlet.date_of_death, source="backfill")
+        filled += 1
+    return filled
@@ -0,0 +1,170 @@
+import datetime as dt
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .athlet import Athlet, athlet_team
+from .team import Team
+from .game import Game, Status
+from .bonus import Bonus
+
+# Columnar scoring engine.
+# Scores every team of many games at once from plain arrays instead of
+# walking the ORM objects. It must give exactly the same result as
+# Team._calculate_score: see check_scores.
+
+NO_PROPERTY = 0
+
+
+class ScoringArrays:
+    """Columns needed to score a set of teams"""
+
+    def __init__(self, athlets, teams, members, today: dt.date):
+        # athlets: (id, date_of_birth, date_of_death, is_banned, gender, citizenship, occupation)
+        self.athlet_ids = np.array([a[0] for a in athlets], dtype=np.int64)
+        self.birth = np.array([a[1] for a in athlets], dtype="datetime64[D]")
+        self.death = np.array([a[2] if a[2] else "NaT" for a in athlets], dtype="datetime64[D]")
+        self.banned = np.array([bool(a[3]) for a in athlets], dtype=bool)
+        self.genders = np.array([a[4] or NO_PROPERTY for a in athlets], dtype=np.int64)
+        self.citizenships = np.array([a[5] or NO_PROPERTY for a in athlets], dtype=np.int64)
+        self.occupations = np.array([a[6] or NO_PROPERTY for a in athlets], dtype=np.int64)
+        self.today = np.datetime64(today, "D")
+
+        # teams: (id, game_id, captain_id, has_first_death)
+        self.team_ids = np.array([t[0] for t in teams], dtype=np.int64)
+        self.game_ids = np.array([t[1] for t in teams], dtype=np.int64)
+        self.captains = self._athlet_index(np.array([t[2] or -1 for t in teams], dtype=np.int64))
+        self.first_death = np.array([bool(t[3]) for t in teams], dtype=bool)
+
+        # members: (athlet_id, team_id)
+        self.member_athlets = self._athlet_index(np.array([m[0] for m in members], dtype=np.int64))
+        self.member_teams = np.searchsorted(self.team_ids, np.array([m[1] for m in members], dtype=np.int64))
+
+    @staticmethod
+    def load(session: Session, game_ids: list[int]|None = None, today: dt.date|None = None) -> "ScoringArrays":
+        teams_query = (
+            select(Team.id, Team.game_id, Team.captain_id, Team.has_first_death)
+            .join(Game, Team.game_id == Game.id)
+            .where(Game.status != Status.END)
+            .order_by(Team.id)
+        )
+        if game_ids is not None:
+            teams_query = teams_query.where(Game.id.in_(game_ids))
+        teams = session.execute(teams_query).all()
+        team_ids = [t[0] for t in teams]
+
+        members = session.execute(
+            select(athlet_team.c.athlet_id, athlet_team.c.team_id)
+            .where(athlet_team.c.team_id.in_(team_ids))
+        ).all()
+        athlet_ids = {m[0] for m in members} | {t[2] for t in teams if t[2]}
+
+        athlets = session.execute(
+            select(
+                Athlet.id, Athlet.date_of_birth, Athlet.date_of_death, Athlet.is_banned,
+                Athlet.main_gender_id, Athlet.main_citizenship_id, Athlet.main_occupation_id,
+            )
+            .where(Athlet.id.in_(athlet_ids))
+            .order_by(Athlet.id)
+        ).all()
+        return ScoringArrays(athlets, teams, members, today or dt.date.today())
+
+    def _athlet_index(self, ids: np.ndarray) -> np.ndarray:
+        # Position of each athlet id in self.athlet_ids, -1 for missing ids
+        if len(self.athlet_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.athlet_ids, ids), len(self.athlet_ids) - 1)
+        return np.where(self.athlet_ids[idx] == ids, idx, -1)
+
+
+def split_date(dates: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    years = dates.astype("datetime64[Y]")
+    months = dates.astype("datetime64[M]")
+    return (
+        years.astype(np.int64) + 1970,
+        (months - years).astype(np.int64) + 1,
+        (dates - months).astype(np.int64) + 1,
+    )
+
+
+def death_points(birth: np.ndarray, death: np.ndarray) -> np.ndarray:
+    """Points of a death on the given dates (broadcast), same rules as AthletStats"""
+    birth_y, birth_m, birth_d = split_date(birth)
+    death_y, death_m, death_d = split_date(death)
+
+    # Same arithmetic as Athlet.calculate_age
+    age = death_y - birth_y - 1 + (((death_m - birth_m) >= 0) & ((death_d - birth_d) >= 0))
+
+    score = 100 - age
+    score += Bonus.SPEEDY_GONZALES * (death_m == 1)
+    score += Bonus.ZONA_CESARINI * ((death_m == 12) & (death_d >= 25))
+    score += Bonus.CLUB_27 * (age == 27)
+    score += Bonus.HAPPY_BIRTHDAY * ((death_m == birth_m) & (death_d == birth_d))
+    return score
+
+
+def athlet_points(arrays: ScoringArrays) -> np.ndarray:
+    """Score of every athlet, same rules as Athlet.score"""
+    dead = ~np.isnat(arrays.death)
+    recent = np.where(dead, arrays.death, arrays.today)
+    return np.where(dead & ~arrays.banned, death_points(arrays.birth, recent), 0)
+
+
+def distinct_dead_properties(arrays: ScoringArrays, properties: np.ndarray, dead: np.ndarray) -> np.ndarray:
+    """Number of distinct main properties among the dead athlets of each team"""
+    athlets = arrays.member_athlets
+    codes = properties[athlets]
+    valid = dead[athlets] & (codes != NO_PROPERTY)
+    width = int(properties.max(initial=NO_PROPERTY)) + 1
+    keys = np.unique(arrays.member_teams[valid] * width + codes[valid])
+    return np.bincount(keys // width, minlength=len(arrays.team_ids))
+
+
+def team_scores(arrays: ScoringArrays) -> np.ndarray:
+    """Score of every team, same rules as Team._calculate_score"""
+    n_teams = len(arrays.team_ids)
+    if n_teams == 0:
+        return np.zeros(0, dtype=np.int64)
+    points = athlet_points(arrays)
+    dead = ~np.isnat(arrays.death)
+
+    athlets_score = np.bincount(
+        arrays.member_teams, weights=points[arrays.member_athlets], minlength=n_teams
+    ).astype(np.int64)
+
+    def len_min_0(counts):
+        return np.maximum(counts - 1, 0)
+
+    team_score = (
+        Bonus.GLOBETROTTER_MULT * len_min_0(distinct_dead_properties(arrays, arrays.citizenships, dead))
+        + Bonus.INCLUSIVITY_MULT * len_min_0(distinct_dead_properties(arrays, arrays.genders, dead))
+        + Bonus.JACK_OF_ALL_TRADES_MULT * len_min_0(distinct_dead_properties(arrays, arrays.occupations, dead))
+    )
+
+    has_captain = arrays.captains >= 0
+    # Teams without athlets (e.g. before the draft) have no captain either
+    captain_points = points[np.maximum(arrays.captains, 0)] if len(points) else np.zeros(n_teams, dtype=np.int64)
+    captain_score = np.where(has_captain, (Bonus.CAPTAIN_MULT - 1) * captain_points, 0)
+
+    first_death_score = Bonus.FIRST_DEATH * arrays.first_death
+
+    return athlets_score + team_score + captain_score + first_death_score
+
+
+def rescore(session: Session, game_ids: list[int]|None = None) -> dict[int, int]:
+    """Score of every team in the given (or all the active) games, by team id"""
+    arrays = ScoringArrays.load(session, game_ids)
+    scores = team_scores(arrays)
+    return {int(team_id): int(score) for team_id, score in zip(arrays.team_ids, scores)}
+
+
+def check_scores(session: Session, game_ids: list[int]|None = None) -> list[tuple[Team, int, int]]:
+    """Teams where the columnar score and Team.score differ, as (team, orm score, columnar score)"""
+    scores = rescore(session, game_ids)
+    mismatches = []
+    for team_id, score in scores.items():
+        team = session.get(Team, team_id)
+        if team.score != score:
+            mismatches.append((team, team.score, score))
+    return mismatches
@@ -0,0 +1,281 @@
+import datetime as dt
+from html import escape
+
+from sqlalchemy import select, and_, event
+from sqlalchemy.orm import Session
+
+from .athlet import Athlet, Gender, Citizenship, Occupation, athlet_team, firstdeath_game, athlet_stats
+from .team import Team, ScoreBreakdown
+from .game import Game
+from .user import User
+
+# Read model used to render rankings and team views.
+# Records are immutable and hold only plain values, so a snapshot can be kept
+# in a process cache and shared between requests. It is rebuilt with a single
+# query when the day changes or after any committed write to the game tables.
+
+
+class FrozenRecord:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read only")
+
+    def _set(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.id == other.id
+
+    def __hash__(self):
+        return hash((type(self), self.id))
+
+
+class PropertyRecord(FrozenRecord):
+    """Main gender, citizenship or occupation of an athlet"""
+    __slots__ = ("id", "name")
+
+    def __init__(self, id: int, name: str):
+        self._set(id=id, name=name)
+
+    def __str__(self):
+        return f"{self.name}"
+
+
+class AthletRecord(FrozenRecord):
+    __slots__ = (
+        "id", "wiki_id", "name", "date_of_birth", "date_of_death", "is_banned",
+        "main_gender", "main_citizenship", "main_occupation",
+    )
+
+    def __init__(self, id, wiki_id, name, date_of_birth, date_of_death, is_banned,
+                 main_gender, main_citizenship, main_occupation):
+        self._set(
+            id=id, wiki_id=wiki_id, name=name,
+            date_of_birth=date_of_birth, date_of_death=date_of_death, is_banned=bool(is_banned),
+            main_gender=main_gender, main_citizenship=main_citizenship, main_occupation=main_occupation,
+        )
+
+    @property
+    def main_gender_id(self) -> int|None:
+        return self.main_gender.id if self.main_gender else None
+
+    @property
+    def main_citizenship_id(self) -> int|None:
+        return self.main_citizenship.id if self.main_citizenship else None
+
+    @property
+    def main_occupation_id(self) -> int|None:
+        return self.main_occupation.id if self.main_occupation else None
+
+    @property
+    def name_escaped_html(self) -> str:
+        return escape(self.name)
+
+    @property
+    def is_dead(self) -> bool:
+        return self.date_of_death is not None
+
+    @property
+    def stats(self):
+        return athlet_stats(self.wiki_id, self.date_of_birth, self.date_of_death)
+
+    @property
+    def age(self) -> int:
+        return self.stats.age
+
+    @property
+    def gonzales(self) -> bool:
+        return self.stats.gonzales
+
+    @property
+    def cesarini(self) -> bool:
+        return self.stats.cesarini
+
+    @property
+    def club27(self) -> bool:
+        return self.stats.club27
+
+    @property
+    def birthday(self) -> bool:
+        return self.stats.birthday
+
+    @property
+    def score(self) -> int:
+        if self.is_banned or not self.is_dead:
+            return 0
+        return self.stats.theoretical_score
+
+
+class TeamRecord(FrozenRecord):
+    __slots__ = ("id", "name", "owner_name", "draft_order", "athlets", "captain", "has_first_death", "breakdown")
+
+    def __init__(self, id, name, owner_name, draft_order, athlets, captain, has_first_death):
+        self._set(
+            id=id, name=name, owner_name=owner_name, draft_order=draft_order,
+            athlets=tuple(athlets), captain=captain, has_first_death=bool(has_first_death),
+        )
+        self._set(breakdown=ScoreBreakdown.from_team(self))
+
+    def __str__(self):
+        return self.name_escaped_html
+
+    @property
+    def name_escaped_html(self) -> str:
+        return escape(self.name)
+
+    @property
+    def athlet_ids(self) -> tuple[int]:
+        return tuple(a.id for a in self.athlets)
+
+    @property
+    def score(self) -> int:
+        return self.breakdown.total
+
+    def has_captain(self) -> bool:
+        return self.captain is not None
+
+
+class GameSnapshot:
+    __slots__ = ("game_id", "day", "teams", "first_death_ids")
+
+    def __init__(self, game_id: int, day: dt.date, teams: list[TeamRecord], first_death_ids: frozenset[int]):
+        self.game_id = game_id
+        self.day = day
+        self.teams = tuple(teams)
+        self.first_death_ids = first_death_ids
+
+    @property
+    def ranking(self) -> list[TeamRecord]:
+        return sorted(self.teams, key=lambda x: x.score, reverse=True)
+
+    def get_team(self, team_id: int) -> TeamRecord|None:
+        for team in self.teams:
+            if team.id == team_id:
+                return team
+        return None
+
+    @staticmethod
+    def load(session: Session, game_id: int) -> "GameSnapshot":
+        query = (
+            select(
+                Team.id, Team.name, User.name, Team.draft_order, Team.captain_id, Team.has_first_death,
+                Athlet.id, Athlet.wiki_id, Athlet.name, Athlet.date_of_birth, Athlet.date_of_death, Athlet.is_banned,
+                Gender.id, Gender.name, Citizenship.id, Citizenship.name, Occupation.id, Occupation.name,
+                firstdeath_game.c.athlet_id,
+            )
+            .join(User, Team.owner_id == User.id)
+            .outerjoin(athlet_team, athlet_team.c.team_id == Team.id)
+            .outerjoin(Athlet, athlet_team.c.athlet_id == Athlet.id)
+            .outerjoin(Gender, Athlet.main_gender_id == Gender.id)
+            .outerjoin(Citizenship, Athlet.main_citizenship_id == Citizenship.id)
+            .outerjoin(Occupation, Athlet.main_occupation_id == Occupation.id)
+            .outerjoin(firstdeath_game, and_(
+                firstdeath_game.c.athlet_id == Athlet.id,
+                firstdeath_game.c.game_id == Team.game_id,
+            ))
+            .where(Team.game_id == game_id)
+            # Same order used to load Team.athlets (pick order), /captain relies on it
+            .order_by(Team.id, athlet_team.c.id)
+        )
+
+        properties = {}
+        def property_record(kind, id, name):
+            if id is None:
+                return None
+            key = (kind, id)
+            if key not in properties:
+                properties[key] = PropertyRecord(id, name)
+            return properties[key]
+
+        teams = {}
+        rosters = {}
+        first_death_ids = set()
+        for row in session.execute(query):
+            (team_id, team_name, owner_name, draft_order, captain_id, has_first_death,
+             athlet_id, wiki_id, name, dob, dod, is_banned,
+             gender_id, gender, citizenship_id, citizenship, occupation_id, occupation,
+             first_death_id) = row
+            if team_id not in teams:
+                teams[team_id] = (team_name, owner_name, draft_order, captain_id, has_first_death)
+                rosters[team_id] = []
+            if athlet_id is None:
+                continue
+            rosters[team_id].append(AthletRecord(
+                athlet_id, wiki_id, name, dob, dod, is_banned,
+                property_record(Gender, gender_id, gender),
+                property_record(Citizenship, citizenship_id, citizenship),
+                property_record(Occupation, occupation_id, occupation),
+            ))
+            if first_death_id is not None:
+                first_death_ids.add(first_death_id)
+
+        team_records = []
+        for team_id, (team_name, owner_name, draft_order, captain_id, has_first_death) in teams.items():
+            roster = rosters[team_id]
+            captain = next((a for a in roster if a.id == captain_id), None)
+            team_records.append(TeamRecord(team_id, team_name, owner_name, draft_order, roster, captain, has_first_death))
+
+        return GameSnapshot(game_id, dt.date.today(), team_records, frozenset(first_death_ids))
+
+
+# Process cache: game id -> snapshot
+_snapshots: dict[int, GameSnapshot] = {}
+
+SNAPSHOT_MODELS = (Athlet, Team, Game, User)
+
+# Commits that changed the games, counted by all the worker processes in
+# sharded mode (see functions/sharding.py). None in a single process.
+_shared_generation = None
+_seen_generation = 0
+
+def share_generation(generation) -> None:
+    """Use a multiprocessing.Value as the generation of the data"""
+    global _shared_generation
+    _shared_generation = generation
+
+def data_generation() -> int:
+    if _shared_generation is None:
+        return 0
+    return _shared_generation.value
+
+def get_snapshot(session: Session, game_id: int) -> GameSnapshot:
+    global _seen_generation
+    generation = data_generation()
+    if generation != _seen_generation:
+        # Another process committed a change
+        invalidate_snapshots()
+        _seen_generation = generation
+    snapshot = _snapshots.get(game_id)
+    if snapshot is None or snapshot.day != dt.date.today():
+        snapshot = GameSnapshot.load(session, game_id)
+        _snapshots[game_id] = snapshot
+    return snapshot
+
+def invalidate_snapshots() -> None:
+    _snapshots.clear()
+
+@event.listens_for(Session, "after_flush")
+def _mark_snapshots_dirty(session: Session, flush_context) -> None:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, SNAPSHOT_MODELS):
+            session.info["snapshots_dirty"] = True
+            return
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    if session.info.pop("snapshots_dirty", False):
+        invalidate_snapshots()
+        if _shared_generation is not None:
+            with _shared_generation.get_lock():
+                _shared_generation.value += 1
+
+@event.listens_for(Session, "after_rollback")
+def _invalidate_after_rollback(session: Session) -> None:
+    # A snapshot may have been built from the flushed, now discarded, changes
+    if session.info.pop("snapshots_dirty", False):
+        invalidate_snapshots()
@@ -18,7 +18,7 @@ class Team(Base):
     updated_on = Column(DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow)
 
     # Many-to-many relationships
-    athlets = relationship("Athlet", secondary="athlet_team", back_populates="teams")
+    athlets = relationship("Athlet", secondary="athlet_team", back_populates="teams", order_by="athlet_team.c.id")
 
     # One-to-many relationship
     captain_id = Column(Integer, ForeignKey("athlets.id"), nullable=True)
@@ -40,47 +40,53 @@ class Team(Base):
     def dead_athlets(self):
         return [athlet for athlet in self.athlets if athlet.is_dead]
 
+    @property
+    def breakdown(self) -> "ScoreBreakdown":
+        # The breakdown lives on the instance, so it is shared by everything
+        # that reads the team during the same session (i.e. the same request).
+        # The key makes it follow deaths, picks and captain changes.
+        key = self._breakdown_key()
+        cached = getattr(self, "_breakdown", None)
+        if cached is None or cached.key != key:
+            cached = ScoreBreakdown.from_team(self, key)
+            self._breakdown = cached
+        return cached
+
     @property
     def all_citizenships(self) -> list[str]:
-        main_citizenships = list(set([p.main_citizenship for p in self.athlets if p.main_citizenship]))
-        return main_citizenships
+        return list(self.breakdown.all_citizenships)
     
     @property
     def globetrotter(self) -> list[str]:
-        main_citizenships = list(set([p.main_citizenship for p in self.dead_athlets if p.main_citizenship]))
-        return main_citizenships
+        return list(self.breakdown.citizenships)
     
     @property
     def globetrotter_score(self) -> int:
-        return Bonus.GLOBETROTTER_MULT * self.len_min_0(self.globetrotter)
+        return self.breakdown.globetrotter_score
     
     @property
     def all_genders(self) -> list[str]:
-        main_genders = list(set([p.main_gender for p in self.athlets if p.main_gender]))
-        return main_genders
+        return list(self.breakdown.all_genders)
     
     @property
     def inclusivity(self) -> list[str]:
-        main_genders = list(set([p.main_gender for p in self.dead_athlets if p.main_gender]))
-        return main_genders
+        return list(self.breakdown.genders)
     
     @property
     def inclusivity_score(self) -> int:
-        return Bonus.INCLUSIVITY_MULT * self.len_min_0(self.inclusivity)
+        return self.breakdown.inclusivity_score
 
     @property
     def all_occupations(self) -> list[str]:
-        main_occupations = list(set([p.main_occupation for p in self.athlets if p.main_occupation]))
-        return main_occupations
+        return list(self.breakdown.all_occupations)
 
     @property
     def jack_of_all_trades(self) -> list[str]:
-        main_occupations = list(set([p.main_occupation for p in self.dead_athlets if p.main_occupation]))
-        return main_occupations
+        return list(self.breakdown.occupations)
         
     @property
     def jack_of_all_trades_score(self) -> int:
-        return Bonus.JACK_OF_ALL_TRADES_MULT * self.len_min_0(self.jack_of_all_trades)
+        return self.breakdown.jack_of_all_trades_score
 
     @property
     def score(self) -> int:
@@ -94,18 +100,15 @@ class Team(Base):
     def len_min_0(l):
         return max((len(l) - 1), 0)
 
-    def _calculate_score(self):
-        from .bonus import Bonus
-        athlets_score = sum(athlet.score for athlet in self.athlets if athlet.is_dead)
-        team_score = (
-            self.globetrotter_score + self.inclusivity_score + self.jack_of_all_trades_score
+    def _breakdown_key(self) -> tuple:
+        return (
+            tuple((id(a), a.date_of_death, a.is_banned) for a in self.athlets),
+            id(self.captain),
+            self.has_first_death,
         )
-        captain_score = 0
-        if self.has_captain():
-            captain_score = (Bonus.CAPTAIN_MULT - 1) * self.captain.score
-        first_death_score = Bonus.FIRST_DEATH if self.has_first_death else 0
 
-        return athlets_score + team_score + captain_score + first_death_score
+    def _calculate_score(self):
+        return self.breakdown.total
 
     def has_captain(self):
         return self.captain is not None
@@ -128,4 +131,85 @@ class Team(Base):
 
     def remove_all_athlets(self):
         self.captain = None
-        self.athlets.clear()
\ No newline at end of file
+        self.athlets.clear()
+
+
+class ScoreBreakdown:
+    """Everything needed to score and describe a team, computed in one pass over the roster"""
+
+    def __init__(self, key: tuple = ()):
+        self.key = key
+        self.athlet_scores = {}
+        self.genders = set()
+        self.citizenships = set()
+        self.occupations = set()
+        self.all_genders = set()
+        self.all_citizenships = set()
+        self.all_occupations = set()
+        self.captain = None
+        self.captain_mult = 1
+        self.has_first_death = False
+
+    @staticmethod
+    def from_team(team: Team, key: tuple = ()) -> "ScoreBreakdown":
+        breakdown = ScoreBreakdown(key)
+        for athlet in team.athlets:
+            breakdown.add_athlet(athlet)
+        if team.has_captain():
+            breakdown.captain = team.captain
+            breakdown.captain_mult = Bonus.CAPTAIN_MULT
+        breakdown.has_first_death = bool(team.has_first_death)
+        return breakdown
+
+    def add_athlet(self, athlet) -> None:
+        if athlet.main_gender:
+            self.all_genders.add(athlet.main_gender)
+        if athlet.main_citizenship:
+            self.all_citizenships.add(athlet.main_citizenship)
+        if athlet.main_occupation:
+            self.all_occupations.add(athlet.main_occupation)
+        if not athlet.is_dead:
+            self.athlet_scores[athlet] = 0
+            return
+        self.athlet_scores[athlet] = athlet.score
+        if athlet.main_gender:
+            self.genders.add(athlet.main_gender)
+        if athlet.main_citizenship:
+            self.citizenships.add(athlet.main_citizenship)
+        if athlet.main_occupation:
+            self.occupations.add(athlet.main_occupation)
+
+    @property
+    def athlets_score(self) -> int:
+        return sum(self.athlet_scores.values())
+
+    @property
+    def captain_score(self) -> int:
+        if self.captain is None:
+            return 0
+        return (self.captain_mult - 1) * self.athlet_scores.get(self.captain, self.captain.score)
+
+    @property
+    def globetrotter_score(self) -> int:
+        return Bonus.GLOBETROTTER_MULT * Team.len_min_0(self.citizenships)
+
+    @property
+    def inclusivity_score(self) -> int:
+        return Bonus.INCLUSIVITY_MULT * Team.len_min_0(self.genders)
+
+    @property
+    def jack_of_all_trades_score(self) -> int:
+        return Bonus.JACK_OF_ALL_TRADES_MULT * Team.len_min_0(self.occupations)
+
+    @property
+    def first_death_score(self) -> int:
+        return Bonus.FIRST_DEATH if self.has_first_death else 0
+
+    @property
+    def total(self) -> int:
+        return (
+            self.athlets_score
+            + self.globetrotter_score + self.inclusivity_score + self.jack_of_all_trades_score
+            + self.captain_score
+            + self.first_death_score
+        )
@@ -1,10 +1,28 @@
+import os
 import re
+import atexit
+import asyncio
 import requests
-import pandas as pd
+import multiprocessing
+from typing import TYPE_CHECKING, NamedTuple
+from concurrent.futures import ProcessPoolExecutor
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from .athlet import Athlet
+from .game import Game
+
+# pandas takes longer to import than the rest of the bot: it is only loaded
+# by the first Wikidata query
+if TYPE_CHECKING:
+    import pandas as pd
+
+# orjson decodes the large sweep answers several times faster, when installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 WIKIMEDIA_ID_FORMAT = r"^Q\d+$"
 WIKIDATA_URL = "https://query.wikidata.org/sparql"
@@ -29,95 +47,166 @@ ID_COLUMNS = [
     "occupationID"
 ]
 
+# requests response hooks called for every Wikidata response (e.g. metrics)
+RESPONSE_HOOKS = []
+
 PROPERTIES_ID = {
     "gender": "P21",
     "citizenship": "P27",
     "occupation": "P106"
 }
 
+# Processes decoding the Wikidata answers for the async functions (0 decodes
+# on the event loop); answers smaller than PARSE_OFFLOAD_BYTES are decoded on
+# the loop anyway, sending them to another process would take longer
+PARSE_WORKERS = int(os.getenv("WIKIDATA_PARSE_WORKERS", "1"))
+PARSE_OFFLOAD_BYTES = 64 * 1024
 
-def get_athlet(session: Session, input:str|list[str], alive:bool=True, only_deads:bool=False) -> list[Athlet]:
-    athlets = []
+# Ids per SPARQL query of the sweeps, the ids are sent in the url
+MAX_IDS_PER_QUERY = 200
 
-    # Retrieve basic info using Sparql
-    df = get_athlet_info(input, only_deads=only_deads)
-    if df.empty:
-        return athlets
 
-    if alive:
-        df = df[df["death"] == ''].sort_values(by=["birth"]).reset_index(drop=True)
-    
-    wids = df.personID.to_list()
+class WikidataPerson(NamedTuple):
+    """A person of a Wikidata answer, (id, label) of the properties in rank order"""
+    wiki_id: str
+    label: str
+    birth: str
+    death: str
+    genders: list[tuple[str, str]]
+    citizenships: list[tuple[str, str]]
+    occupations: list[tuple[str, str]]
 
-    ordered_properties = get_athlets_ordered_properties(wids=wids)
-    
-    for _, athlet in df.iterrows():
-        wiki_id = athlet.personID
-        genders_idx = [athlet.genderID.index(x) for x in ordered_properties[wiki_id]["genders"]]
-        citizenships_idx = [athlet.citizenshipID.index(x) for x in ordered_properties[wiki_id]["citizenships"]]
-        occupations_idx = [athlet.occupationID.index(x) for x in ordered_properties[wiki_id]["occupations"]]
-        # import pdb
-        # pdb.set_trace()
-        p = Athlet.get_or_create(
+
+def get_athlet(session: Session, input:str|list[str], alive:bool=True, only_deads:bool=False, source:str="refresh") -> list[Athlet]:
+    people = parse_athlet_info(fetch_athlet_info(input, only_deads=only_deads), alive=alive)
+    if not people:
+        return []
+    entities = fetch_entities([p.wiki_id for p in people])
+    return merge_athlets(session, parse_ordered_properties(entities, people), source)
+
+
+async def fetch_people_async(input:str|list[str], alive:bool=True, only_deads:bool=False) -> list[WikidataPerson]:
+    """The people of get_athlet, with the requests in a thread and the decoding in the parse pool.
+
+    No session is needed: merge them with merge_athlets once the answers are in,
+    so that no transaction is open while Wikidata answers.
+    """
+    content = await asyncio.to_thread(fetch_athlet_info, input, only_deads)
+    people = await offload(parse_athlet_info, content, alive)
+    if not people:
+        return []
+    entities = await asyncio.to_thread(fetch_entities, [p.wiki_id for p in people])
+    return await offload(parse_ordered_properties, entities, people)
+
+
+def merge_athlets(session: Session, people: list[WikidataPerson], source: str = "refresh", preview: bool = False) -> list[Athlet]:
+    """Create or update the athlets of the people.
+
+    A changed date of death of a known athlet is logged in all his games
+    and bumps their version, so that their cached views are rendered again.
+    A preview is rolled back by the caller: nothing is logged or bumped.
+    """
+    known_deaths = dict(session.execute(
+        select(Athlet.wiki_id, Athlet.date_of_death).where(Athlet.wiki_id.in_([p.wiki_id for p in people]))
+    ).all())
+    athlets = [
+        Athlet.get_or_create(
             session=session,
-            name=athlet.label,
-            dob=athlet.birth,
-            dod=athlet.death if athlet.death else None,
-            WID=wiki_id,
-            genders=[(athlet.genderID[x], athlet.gender[x]) for x in genders_idx],
-            citizenships=[(athlet.citizenshipID[x],athlet.citizenship[x]) for x in citizenships_idx],
-            occupations=[(athlet.occupationID[x],athlet.occupation[x]) for x in occupations_idx],
+            name=person.label,
+            dob=person.birth,
+            dod=person.death if person.death else None,
+            WID=person.wiki_id,
+            genders=person.genders,
+            citizenships=person.citizenships,
+            occupations=person.occupations,
         )
-        athlets.append(p)
+        for person in people
+    ]
+    if preview:
+        return athlets
+    for athlet in athlets:
+        if athlet.wiki_id in known_deaths and athlet.date_of_death != known_deaths[athlet.wiki_id]:
+            Game.log_death(athlet, source=source)
+            Game.bump_athlet_games(athlet)
     return athlets
 
 
-def find_dead_athlets(session: Session, ids:list[str]) -> list[Athlet]:
-    # updated_athlets = {}
-    # for id, pers in dict_athlets.items():
-    #     updated_pers = get_athlet(id, alive=False, lang=lang, only_deads=True)
-    #     if (pers.dod != updated_pers.dod or
-    #        pers.genders != updated_pers.genders or
-    #        pers.citizenships != updated_pers.citizenships or
-    #        pers.occupations != updated_pers.occupations):
-    #         updated_athlets[id] = updated_pers
-    updated_athlets = get_athlet(session, ids, alive=False, only_deads=True)
-    return updated_athlets
- 
-
-def get_athlet_info(input:str|list[str], only_deads:bool=False) -> pd.DataFrame:
+def find_dead_athlets(session: Session, ids:list[str], source:str="sweep") -> list[Athlet]:
+    dead_athlets = []
+    for start in range(0, len(ids), MAX_IDS_PER_QUERY):
+        dead_athlets += get_athlet(session, ids[start:start + MAX_IDS_PER_QUERY], alive=False, only_deads=True, source=source)
+    return dead_athlets
+
+
+async def find_dead_people_async(ids:list[str]) -> list[WikidataPerson]:
+    dead_people = []
+    for start in range(0, len(ids), MAX_IDS_PER_QUERY):
+        dead_people += await fetch_people_async(ids[start:start + MAX_IDS_PER_QUERY], alive=False, only_deads=True)
+    return dead_people
+
+
+_parse_pool: ProcessPoolExecutor|None = None
+
+def parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        atexit.register(_parse_pool.shutdown, cancel_futures=True)
+    return _parse_pool
+
+
+async def offload(parse, content: bytes, *args):
+    """parse(content, *args) in the parse pool, or here for small answers"""
+    if PARSE_WORKERS and len(content) >= PARSE_OFFLOAD_BYTES:
+        return await asyncio.get_running_loop().run_in_executor(parse_pool(), parse, content, *args)
+    return parse(content, *args)
+
+
+def get_athlet_info(input:str|list[str], only_deads:bool=False) -> "pd.DataFrame":
+    return get_query_df(json_loads(fetch_athlet_info(input, only_deads=only_deads)))
+
+
+def fetch_athlet_info(input:str|list[str], only_deads:bool=False) -> bytes:
+    """Body of the SPARQL answer for a name, an id or a list of ids"""
     if type(input) is list or re.match(WIKIMEDIA_ID_FORMAT, input):
         query = get_query_sparql(input=input, is_id=True, only_deads=only_deads)
     else:
         query = get_query_sparql(input=input, is_id=False, only_deads=only_deads)
-    # Set the headers and parameters for the request
-    # headers = {
-    #     'Content-Type': 'application/x-www-form-urlencoded',
-    # }
     params = {
         'format': 'json',
         'query': query
     }
 
     # Send the request and get the response
-    response = requests.get(WIKIDATA_URL, params=params, headers=HEADERS)
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the response as JSON
-        data = response.json()
+    response = requests.get(WIKIDATA_URL, params=params, headers=HEADERS, hooks={'response': RESPONSE_HOOKS})
+    if response.status_code != 200:
+        raise requests.ConnectionError(f"Wikidata problem. Response status code: {response.status_code}")
+    return response.content
 
-        df = get_query_df(data)
 
-        # if not is_unique_athlet(df):
-        #     raise ValueError("Too many results, try to directly send the Wikimedia ID")
-     
-        return df
-    else:
-        # The request was not successful, so return None
-        raise requests.ConnectionError(f"Wikidata problem. Response status code: {response.status_code}")
+def parse_athlet_info(content: bytes, alive: bool = True) -> list[WikidataPerson]:
+    """SPARQL answer to persons, properties still in the order of the answer.
+
+    Runs in the parse pool: pandas is only loaded there.
+    """
+    df = get_query_df(json_loads(content))
+    if df.empty:
+        return []
+    if alive:
+        df = df[df["death"] == ''].sort_values(by=["birth"])
+    return [
+        WikidataPerson(
+            row.personID, row.label, row.birth, row.death,
+            list(zip(row.genderID, row.gender)),
+            list(zip(row.citizenshipID, row.citizenship)),
+            list(zip(row.occupationID, row.occupation)),
+        )
+        for row in df.itertuples(index=False)
+    ]
 
 
-def get_query_df(data: dict) -> pd.DataFrame:
+def get_query_df(data: dict) -> "pd.DataFrame":
+    import pandas as pd
     df = pd.json_normalize(data["results"]["bindings"])
     if df.empty:
         return df
@@ -135,7 +224,7 @@ def get_query_df(data: dict) -> pd.DataFrame:
     return with_dob
 
 
-def is_unique_athlet(df:pd.DataFrame) -> bool:
+def is_unique_athlet(df:"pd.DataFrame") -> bool:
     if len(df["person"].unique()) == 1:
         return True
     else:
@@ -193,6 +282,11 @@ def get_query_sparql(input:str|list[str], is_id:bool=False, only_deads:bool=Fals
 
 
 def get_athlets_ordered_properties(wids:list[str]) -> dict:
+    return ordered_properties(json_loads(fetch_entities(wids)), wids)
+
+
+def fetch_entities(wids:list[str]) -> bytes:
+    """Body of the wbgetentities answer, with the ranked claims"""
     ids = '|'.join(wids)
     params = {
             'action': 'wbgetentities',
@@ -200,29 +294,46 @@ def get_athlets_ordered_properties(wids:list[str]) -> dict:
             'format': 'json',
             'languages': 'en'
         }
-    response = requests.get(WIKIDATA_REST_URL, params=params, headers=HEADERS)
+    response = requests.get(WIKIDATA_REST_URL, params=params, headers=HEADERS, hooks={'response': RESPONSE_HOOKS})
     if response.status_code != 200:
-        # The request was not successful, so return None
         raise requests.ConnectionError(f"Wikidata problem. Response status code: {response.status_code}")
+    return response.content
+
 
-    data = response.json()
+def ordered_properties(data: dict, wids:list[str]) -> dict:
     ordered_properties = {}
     for id in wids:
-        # Genders ordered
         data_property = data['entities'][id]
-        genders_ids = get_ordered_property(data_property, PROPERTIES_ID["gender"])
-        citizenships_ids = get_ordered_property(data_property, PROPERTIES_ID["citizenship"])
-        occupations_ids = get_ordered_property(data_property, PROPERTIES_ID["occupation"])
-        
-        # Store in dictionary
         ordered_properties[id] = {
-            "genders": genders_ids,
-            "citizenships": citizenships_ids,
-            "occupations": occupations_ids
+            "genders": get_ordered_property(data_property, PROPERTIES_ID["gender"]),
+            "citizenships": get_ordered_property(data_property, PROPERTIES_ID["citizenship"]),
+            "occupations": get_ordered_property(data_property, PROPERTIES_ID["occupation"]),
         }
-
     return ordered_properties
 
+
+def parse_ordered_properties(content: bytes, people: list[WikidataPerson]) -> list[WikidataPerson]:
+    """Put the properties of the persons in rank order, from the wbgetentities answer"""
+    properties = ordered_properties(json_loads(content), [p.wiki_id for p in people])
+
+    def ranked(values: list[tuple[str, str]], ids: list[str]) -> list[tuple[str, str]]:
+        labels = {}
+        for wiki_id, label in values:
+            labels.setdefault(wiki_id, label)
+        missing = [wiki_id for wiki_id in ids if wiki_id not in labels]
+        if missing:
+            raise ValueError(f"{', '.join(missing)} not in the SPARQL answer")
+        return [(wiki_id, labels[wiki_id]) for wiki_id in ids]
+
+    return [
+        person._replace(
+            genders=ranked(person.genders, properties[person.wiki_id]["genders"]),
+            citizenships=ranked(person.citizenships, properties[person.wiki_id]["citizenships"]),
+            occupations=ranked(person.occupations, properties[person.wiki_id]["occupations"]),
+        )
+        for person in people
+    ]
+
 def get_ordered_property(data:dict, propertyID:str) -> list[str]:
     prop_data = data['claims'].get(propertyID,[])
     prop_pref = []
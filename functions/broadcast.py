@@ -0,0 +1,189 @@
+import asyncio
+import time
+import logging
+import datetime as dt
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from .utils import setupLogger
+
+# Logging
+LOG_FOLDER = "logs"
+LOG_FILENAME = "fantamorto_bot.log"
+LOG_LEVEL = logging.DEBUG
+
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+# Telegram limits: ~30 messages per second overall, ~20 per minute in a group
+GLOBAL_RATE = 25
+GLOBAL_BURST = 25
+CHAT_RATE = 20 / 60
+CHAT_BURST = 3
+MAX_CONCURRENT_CHATS = 20
+MAX_RETRIES = 3
+MESSAGE_MAX_LENGTH = 4096
+MESSAGE_SEPARATOR = "\n\n"
+# Errors that sending the same message again cannot fix
+PERMANENT_ERRORS = (BadRequest, Forbidden)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float) -> None:
+        """No token is given for the next seconds (e.g. after a RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+def split_text(text: str, max_length: int = MESSAGE_MAX_LENGTH) -> list[str]:
+    """Pieces of at most max_length characters, cut at a line break when there is one"""
+    pieces = []
+    while len(text) > max_length:
+        cut = text.rfind("\n", 0, max_length + 1)
+        if cut <= 0:
+            pieces.append(text[:max_length])
+            text = text[max_length:]
+        else:
+            pieces.append(text[:cut])
+            text = text[cut + 1:]
+    if text or not pieces:
+        pieces.append(text)
+    return pieces
+
+
+def merge_texts(texts: list[str], max_length: int = MESSAGE_MAX_LENGTH) -> list[tuple[str, list[int]]]:
+    """Join the texts for one chat in as few messages as possible.
+
+    Returns every message with the indexes of the texts in it. A text longer
+    than max_length is split over messages of its own.
+    """
+    merged = []
+    current, indexes = "", []
+    for index, text in enumerate(texts):
+        if len(text) > max_length:
+            if indexes:
+                merged.append((current, indexes))
+                current, indexes = "", []
+            merged += [(piece, [index]) for piece in split_text(text, max_length)]
+            continue
+        if indexes and len(current) + len(MESSAGE_SEPARATOR) + len(text) > max_length:
+            merged.append((current, indexes))
+            current, indexes = "", []
+        current = f"{current}{MESSAGE_SEPARATOR}{text}" if indexes else text
+        indexes.append(index)
+    if indexes:
+        merged.append((current, indexes))
+    return merged
+
+
+def retry_after_seconds(err: RetryAfter) -> float:
+    retry_after = err.retry_after
+    if isinstance(retry_after, dt.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class Broadcaster:
+    """Send messages to many chats at once within the Telegram rate limits.
+
+    All the texts for a chat are merged in as few messages as possible,
+    chats are served concurrently and every send waits for a token of both
+    the global and the chat bucket. Buckets live as long as the broadcaster,
+    so keep one per bot. Outcomes are per text: a failed message only fails
+    the texts in it.
+    """
+
+    def __init__(self, bot: Bot,
+                 global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 max_concurrent_chats: int = MAX_CONCURRENT_CHATS, max_retries: int = MAX_RETRIES):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.max_concurrent_chats = max_concurrent_chats
+        self.max_retries = max_retries
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self.chat_buckets[chat_id]
+
+    async def send(self, chat_id: int, text: str, parse_mode: str|None = None) -> None:
+        retries = 0
+        while True:
+            await self.chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                return
+            except RetryAfter as err:
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                seconds = retry_after_seconds(err)
+                logger.warning("Flood control on chat %s, retrying in %ss", chat_id, seconds)
+                self.chat_bucket(chat_id).block(seconds)
+
+    async def try_send(self, chat_id: int, text: str, parse_mode: str|None = None) -> TelegramError|None:
+        try:
+            await self.send(chat_id, text, parse_mode)
+        except TelegramError as err:
+            logger.warning("Broadcast to chat %s failed: %s", chat_id, err)
+            return err
+        return None
+
+    async def send_chat(self, chat_id: int, texts: list[str], parse_mode: str|None = None) -> list[TelegramError|None]:
+        """Send the texts to a chat, returns the error of each text (None if delivered)"""
+        outcomes: list[TelegramError|None] = [None] * len(texts)
+        for message, indexes in merge_texts(texts):
+            error = await self.try_send(chat_id, message, parse_mode)
+            if isinstance(error, BadRequest) and len(indexes) > 1:
+                # Most likely one broken text (e.g. its HTML): send them one by one
+                for index in indexes:
+                    outcomes[index] = await self.try_send(chat_id, texts[index], parse_mode)
+                continue
+            for index in indexes:
+                # The pieces of a long text: the first error counts
+                outcomes[index] = outcomes[index] or error
+            if isinstance(error, Forbidden):
+                # The bot cannot write to the chat, the other messages would fail too
+                for index in range(indexes[-1] + 1, len(texts)):
+                    outcomes[index] = error
+                break
+        return outcomes
+
+    async def broadcast(self, messages: dict[int, list[str]], parse_mode: str|None = None) -> dict[int, list[TelegramError|None]]:
+        """Send the texts of every chat, returns the errors of the texts of each chat (None if delivered)"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_chats)
+
+        async def deliver(chat_id: int, texts: list[str]) -> list[TelegramError|None]:
+            async with semaphore:
+                return await self.send_chat(chat_id, texts, parse_mode)
+
+        chat_ids = list(messages)
+        results = await asyncio.gather(*(deliver(chat_id, messages[chat_id]) for chat_id in chat_ids))
+        return dict(zip(chat_ids, results))
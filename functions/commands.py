@@ -1,4 +1,5 @@
 import os
+import asyncio
 import requests
 from html import escape
 from datetime import date
@@ -9,10 +10,16 @@ from telegram.ext import ContextTypes
 
 from sqlalchemy.orm import Session
 
-from database.models import User, Game, Team, Status, Athlet, Bonus
-from database.models.wikidata import get_athlet
+from database.models import User, Game, Team, Status, Athlet
+from database.models.wikidata import fetch_people_async
+from database.models.snapshot import get_snapshot
 
-from .wrappers import get_session, get_chat_game, active_game, team_owner, game_creator, superuser
+from .wrappers import get_session, get_read_only_session, require_args
+from .wrappers import get_chat_game, active_game, team_owner, game_creator, superuser
+from .wrappers import invalidate_chat, invalidate_team, merge_people, write_lock
+from .views import cached_view, cached_view_async, render_ranking, render_team, render_all_teams, render_odds
+from .metrics import render_stats
+from .profiling import profiler
 
 import logging
 from logging.handlers import RotatingFileHandler
@@ -25,13 +32,19 @@ LOG_FOLDER = "logs"
 LOG_FILENAME = "fantamorto_bot.log"
 LOG_LEVEL = logging.DEBUG
 
-logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL)
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+# Usage messages
+ADD_USAGE = "You have to specify a name or a Wikimedia ID after the command <code>/add</code>. For example <code>/add Silvio Berlusconi</code> or <code>/add Q11860</code>"
+INFO_USAGE = "You have to specify a name or a Wikimedia ID after the command <code>/info</code>. For example <code>/info Silvio Berlusconi</code> or <code>/info Q11860</code>"
+CAPTAIN_USAGE = "You have to specify the index of the athlet. Like 0, 1, 2... You can find them with <code>/team</code>"
+RENAME_USAGE = "You have to specify a new name for your team"
 
 # Functions
 async def on_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
     # logging
-    logger.debug(f'Help - Chat {update.effective_chat.id}')
+    logger.debug('Help - Chat %s', update.effective_chat.id)
 
     await update.message.reply_html(
         "This bot allows to play Fantamorto in a group!\n"
@@ -43,6 +56,7 @@ async def on_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         + "For example you can pick Silvio Berlusconi both with <code>/add Silvio Berlusconi</code> or <code>/add Q11860</code>\n"
         + "5. Once all the teams are full the game will start automatically\n"
         + "6. To check the current ranking use <code>/ranking</code>\n"
+        + "7. To see the expected final scores and the chances to win use <code>/odds</code>\n"
         + "\nEnjoy! But do not try to help the Death do his work!"
     )
     
@@ -60,9 +74,7 @@ async def on_start(session: Session, update: Update, context: ContextTypes.DEFAU
     
     chat_id = update.effective_chat
     tg_user = update.effective_user
-    logger.info(f"New game - Chat {chat_id}")
-    # with open(BAN_LIST_FILE, 'r') as f:
-        # ban_list = yaml.load(f, Loader=yaml.FullLoader)
+    logger.info("New game - Chat %s", chat_id)
     creator = User.get_or_create_user(tg_user, session)
     game = Game(
         chat_id=update.effective_chat.id,
@@ -70,6 +82,7 @@ async def on_start(session: Session, update: Update, context: ContextTypes.DEFAU
         team_size=DEFAULT_FANTAMORTO_TEAM_SIZE
         )
     session.add(game)
+    invalidate_chat(update.effective_chat.id)
     await update.message.reply_text(
         "Welcome to Fantamorto!\n"
         +f"Each player can add up to {game.team_size} real, alive people with a page on wikidata.org.\n"
@@ -83,11 +96,12 @@ async def on_start(session: Session, update: Update, context: ContextTypes.DEFAU
 async def on_stop(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, *args, **kwargs) -> None:
     """Stop the fantamorto game in the chat"""    
     end_msg = "The game has ended!\n"
-    if game.ranking:
-        end_msg += f"And the winner is......\n<b>{game.ranking[0]}</b>\n"
+    ranking = get_snapshot(session, game.id).ranking
+    if ranking:
+        end_msg += f"And the winner is......\n<b>{ranking[0]}</b>\n"
         
         end_msg += "Here the final ranking\n"
-        for idx, team in enumerate(game.ranking):
+        for idx, team in enumerate(ranking):
             if idx == 0:
                 end_msg += f"{Emoji.FIRST_PLACE}\t"
             elif idx == 1:
@@ -96,11 +110,12 @@ async def on_stop(session: Session, update: Update, context: ContextTypes.DEFAUL
                 end_msg += f"{Emoji.THIRD_PLACE}\t"
             else:
                 end_msg += f"{idx+1}.\t"
-            end_msg += f"{team.name_escaped_html}: {team.score}\n"
+            end_msg += f"{team.name_escaped_html}: {team.breakdown.total}\n"
 
     end_msg += "\nTo start a new game send <code>/start</code>"
     
     game.status = Status.END
+    invalidate_chat(game.chat_id)
 
     await update.message.reply_html(end_msg)
 
@@ -136,8 +151,10 @@ async def on_join(session: Session, update: Update, context: ContextTypes.DEFAUL
         game=game
     )
     session.add(team)
+    invalidate_team(game.id, tg_user.id)
+    game.bump_version()
 
-    logger.debug(f"Join - Chat: {update.effective_chat} > User: {update.effective_user} > Name: {team_name}")
+    logger.debug("Join - Chat: %s > User: %s > Name: %s", update.effective_chat, update.effective_user, team_name)
     
     await update.message.reply_html(f"{team.name_escaped_html} is now part of the game.\nWhen all the players have joined you can send the command <code>/draft</code> to start the draft")
 
@@ -156,10 +173,10 @@ async def on_draft(session: Session, update: Update, context: ContextTypes.DEFAU
         return
     
     game.start_draft()
-    logger.debug(f"Draft start - Chat: {update.effective_chat}")
+    logger.debug("Draft start - Chat: %s", update.effective_chat)
 
     current_drafter = game.get_current_drafter()
-    logger.debug(f"Draft - Chat: {update._effective_chat} Current drafter: {current_drafter}")
+    logger.debug("Draft - Chat: %s Current drafter: %s", update.effective_chat, current_drafter)
 
     await update.message.reply_html(
             f"The team {current_drafter} ({current_drafter.owner.mention}) must pick the next person\n"
@@ -190,7 +207,7 @@ async def on_cancel_draft(session: Session, update: Update, context: ContextType
     pass
 
     game.cancel_draft()
-    logger.debug(f"Draft cancel - Chat: {update.effective_chat}")
+    logger.debug("Draft cancel - Chat: %s", update.effective_chat)
 
     await update.message.reply_html("The draft is cancelled!\nAll athlets have been dismissed!\nNow new teams can join the game with /join.\n To start a new draft send /draft")
 
@@ -212,15 +229,13 @@ async def on_draft_order(session: Session, update: Update, context: ContextTypes
         msg += f"{idx+1}. {t.name_escaped_html} ({escape(t.owner.name)})\n"
     await update.message.reply_html(msg)
 
-@get_session
+@get_read_only_session
+@require_args(INFO_USAGE)
 async def on_info(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-    if not context.args:
-        await update.effective_message.reply_html("You have to specify a name or a Wikimedia ID adter the command <code>/add</code>. For example <code>/add Silvio Berlusconi</code> or <code>/add Q11860</code>")
-        return
     athlet_name = ' '.join(context.args)
     
     try:
-        athlets = get_athlet(session, athlet_name)
+        athlets = await merge_people(session, await fetch_people_async(athlet_name))
         if len(athlets) == 0:
             await update.effective_message.reply_text("I couldn't find any match. Try to send directly the Wikimedia ID")
             return
@@ -249,6 +264,7 @@ async def on_info(session: Session, update: Update, context: ContextTypes.DEFAUL
     session.rollback()
 
 @get_session
+@require_args(ADD_USAGE)
 @get_chat_game
 @active_game
 @team_owner
@@ -256,9 +272,6 @@ async def on_add(session: Session, update: Update, context: ContextTypes.DEFAULT
     if game.status != Status.DRAFT:
         await update.message.reply_text("The game is not in the draft!")
         return
-    if not context.args:
-        await update.effective_message.reply_html("You have to specify a name or a Wikimedia ID adter the command <code>/add</code>. For example <code>/add Silvio Berlusconi</code> or <code>/add Q11860</code>")
-        return
 
     if team.num_athlets >= game.team_size:
         await update.effective_message.reply_text(f"You already have {team.num_athlets} players")
@@ -274,7 +287,9 @@ async def on_add(session: Session, update: Update, context: ContextTypes.DEFAULT
     athlet_name = ' '.join(context.args)
 
     try:
-        athlets = get_athlet(session, athlet_name, alive=False)
+        people = await fetch_people_async(athlet_name, alive=False)
+        # Several matches are only listed: they are not kept
+        athlets = await merge_people(session, people, preview=len(people) > 1)
         if len(athlets) == 0:
             await update.effective_message.reply_text("I couldn't find any match. Try to send directly the Wikimedia ID")
             return
@@ -327,14 +342,11 @@ async def on_add(session: Session, update: Update, context: ContextTypes.DEFAULT
             return
 
 @get_session
+@require_args(CAPTAIN_USAGE)
 @get_chat_game
 @active_game
 @team_owner
 async def on_captain(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, team: Team, *args, **kwargs):
-    if not context.args:
-        await update.effective_message.reply_html("You have to specify the index of the athlet. Like 0, 1, 2... You can find them with <code>/team</code>")
-        return
-
     if game.status not in [Status.DRAFT, Status.CAPTAIN]:
         await update.effective_message.reply_text("You must be in the draft or immediately after to set the captain")
         return
@@ -364,87 +376,58 @@ async def on_captain(session: Session, update: Update, context: ContextTypes.DEF
         await update.message.reply_text(f"There are still {sum(remaining_captains)} teams without captain")
         return
 
-@get_session
+@get_read_only_session
 @get_chat_game
 @active_game
 async def on_ranking(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, *args, **kwargs):
-    msg = "RANKING\n"
-    for idx, team in enumerate(game.ranking):
-        msg += f"{idx+1}. {team.score} - {team.name_escaped_html}\n"
+    msg = cached_view(game.id, "ranking", None, lambda: render_ranking(get_snapshot(session, game.id)))
     await update.message.reply_html(msg)
 
-@get_session
+@get_read_only_session
 @get_chat_game
 @active_game
 @team_owner
 async def on_team(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, team: Team, *args, **kwargs):
-    msg = f"NAME: {team.name_escaped_html}\n"
-    msg += f"OWNER: {team.owner.name}\n"
-    msg += f"SCORE: {team.score if team.score else 0}\n"
-    msg += f"**** ATHLETS ****\n"
-    for idx, athlet in enumerate(team.athlets):
-        athlet_msg = f"{idx}: "
-        if athlet == team.captain:
-            athlet_msg += f"{Emoji.CAPTAIN} "
-        athlet_msg += f"{athlet.name} - {athlet.age}y "
-        
-        if not athlet.is_dead:
-            athlet_msg += f"{Emoji.ALIVE} "
-        else:
-            athlet_msg += f"{Emoji.DEAD} "
-            if athlet in game.first_deaths:
-                athlet_msg += f"{Emoji.FIRST_DEATH} "
-            if athlet.gonzales:
-                athlet_msg += f"{Emoji.SPEEDY_GONZALES} "
-            if athlet.cesarini:
-                athlet_msg += f"{Emoji.ZONA_CESARINI} "
-            if athlet.club27:
-                athlet_msg += f"{Emoji.CLUB_27} "
-            if athlet.birthday:
-                athlet_msg += f"{Emoji.HAPPY_BIRTHDAY} "
-
-        athlet_msg += f"({athlet.score} pt)"
-        msg += f"{athlet_msg}\n"
-    
-    msg += f"**** BONUS *****\n"
-    if team.has_first_death:
-        msg += f"{Emoji.FIRST_DEATH} First death: {Bonus.FIRST_DEATH} pt\n"
-        msg += f"({', '.join([a.name_escaped_html for a in team.athlets if a in game.first_deaths])})\n"
-    msg += f"{Emoji.INCLUSIVITY} Inclusivity: {team.inclusivity_score} pt\n"
-    gender_dead = [f"<b>{g}</b>" for g in team.inclusivity]
-    gender_alive = [g.name for g in team.all_genders if g not in team.inclusivity]
-    msg += f"({', '.join(gender_dead + gender_alive)})\n"
-    msg += f"{Emoji.GLOBETROTTER} Globetrotter: {team.globetrotter_score} pt\n"
-    citizenship_dead = [f"<b>{c}</b>" for c in team.globetrotter]
-    citizenship_alive = [c.name for c in team.all_citizenships if c not in team.globetrotter]
-    msg += f"({', '.join(citizenship_dead + citizenship_alive)})\n"
-    msg += f"{Emoji.JACK_OF_ALL_TRADES} Jack of all Trades: {team.jack_of_all_trades_score} pt\n"
-    occupation_dead = [f"<b>{o}</b>" for o in team.jack_of_all_trades]
-    occupation_alive = [o.name for o in team.all_occupations if o not in team.jack_of_all_trades]
-    msg += f"({', '.join(occupation_dead + occupation_alive)})\n"
+    msg = cached_view(game.id, "team", team.id, lambda: render_team(get_snapshot(session, game.id), team.id))
     await update.message.reply_html(msg)
 
-@get_session
+@get_read_only_session
 @get_chat_game
 @active_game
 async def on_allTeams(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, *args, **kwargs):
-    msg = f"There are {game.num_teams} teams in game:\n"
-    for team in game.teams:
-        msg += f"{team.name_escaped_html} ({team.owner.name})\n"
-    
+    msg = cached_view(game.id, "allteams", None, lambda: render_all_teams(get_snapshot(session, game.id)))
+    await update.message.reply_html(msg)
+
+@get_read_only_session
+@get_chat_game
+@active_game
+async def on_odds(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, *args, **kwargs):
+    """Expected final score and win probability of the teams, by Monte Carlo on the life tables"""
+    if game.status == Status.DRAFT:
+        await update.message.reply_text("The odds are available once the draft is over")
+        return
+    from database.models.scoring import ScoringArrays
+    from database.models.odds import simulate, load_sexes
+
+    async def render():
+        arrays = ScoringArrays.load(session, [game.id])
+        sexes = load_sexes(session, arrays)
+        # Tens of thousands of seasons take a few hundred ms, off the event loop
+        odds = await asyncio.to_thread(simulate, arrays, sexes)
+        return render_odds(get_snapshot(session, game.id), odds)
+
+    msg = await cached_view_async(game.id, "odds", None, render)
     await update.message.reply_html(msg)
 
 @get_session
+@require_args(RENAME_USAGE)
 @get_chat_game
 @active_game
 @team_owner
 async def on_rename(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, team: Team, *args, **kwargs):
-    if not context.args:
-        await update.message.reply_text("You have to specify a new name for your team")
-        return
-
     team_name = ' '.join(context.args)
     game.rename_team(team, team_name)
+    invalidate_team(game.id, update.effective_user.id)
 
     await update.message.reply_html(f"The name of your team is now: {team.name_escaped_html}")
 
@@ -479,7 +462,9 @@ async def on_kill(session: Session, update: Update, context: ContextTypes.DEFAUL
         await update.message.reply_text("Athlet is not present")
         return
     athlet.date_of_death = date.today()
-    game.update_first_death([athlet])
+    Game.bump_athlet_games(athlet)
+    Game.log_death(athlet, source="kill")
+    game.update_first_death([athlet], source="kill")
 
 @get_session
 @superuser
@@ -492,4 +477,70 @@ async def on_sendmessage(session: Session, update: Update, context: ContextTypes
     await context.bot.send_message(
         chat_id = chat,
         text = msg
-    )
\ No newline at end of file
+    )
+
+@get_session
+@superuser
+async def on_rescore(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+    """Rescore all the active games with the columnar engine and compare with the team scores"""
+    from database.models.scoring import check_scores
+    mismatches = check_scores(session)
+    if not mismatches:
+        await update.message.reply_text("All the active games have been rescored, no differences found")
+        return
+    msg = f"{len(mismatches)} teams have a different score:\n"
+    for team, orm_score, score in mismatches:
+        msg += f"{team.name_escaped_html} (game {team.game_id}): {orm_score} vs {score}\n"
+    await update.message.reply_html(msg)
+
+@get_session
+@superuser
+async def on_verify_events(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+    """Replay the event log of the active games and compare it with the tables.
+
+    /verifyevents backfill first writes the events of the games older than the log.
+    """
+    from database.models.replay import check_replay, backfill
+    if context.args and context.args[0].lower() == "backfill":
+        async with write_lock():
+            filled = backfill(session)
+            session.commit()
+        await update.message.reply_text(f"Events written for {filled} games")
+    differences = check_replay(session)
+    if not differences:
+        await update.message.reply_text("The event log matches the tables of all the active games")
+        return
+    msg = f"{len(differences)} differences (tables vs log):\n"
+    # Telegram messages are at most 4096 characters
+    for game_id, difference in differences[:40]:
+        msg += f"game {game_id}: {escape(difference)}\n"
+    if len(differences) > 40:
+        msg += "...\n"
+    await update.message.reply_html(msg)
+
+@get_session
+@superuser
+async def on_stats(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+    await update.message.reply_text(render_stats())
+
+@get_session
+@superuser
+async def on_profile(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+    """/profile N for the next N commands, /profile sweep for the next update_deads, /profile stop"""
+    arg = context.args[0].lower() if context.args else ""
+    if arg == "stop":
+        await profiler.finish()
+        await update.message.reply_text("Profiling stopped")
+        return
+    if arg != "sweep" and not arg.isdigit():
+        await update.message.reply_text("Use /profile N, /profile sweep or /profile stop")
+        return
+    try:
+        if arg == "sweep":
+            profiler.request_sweep(context.bot, update.effective_chat.id)
+            await update.message.reply_text("The next update of the deads will be profiled")
+        else:
+            profiler.start_updates(context.bot, update.effective_chat.id, int(arg))
+            await update.message.reply_text(f"Profiling the next {arg} commands")
+    except ValueError as err:
+        await update.message.reply_text(str(err))
@@ -0,0 +1,225 @@
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SWEEP_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+# Statements per update
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Command or job the current task is working for, statements are counted on it
+current_scope: contextvars.ContextVar[tuple[str, list[int]]|None] = contextvars.ContextVar("metrics_scope", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels_text(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self.values)
+        return self.header() + [f"{self.name}{_labels_text(self.labels, k)} {v}" for k, v in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> (counts per bucket, +Inf included, sum)
+        self.values: dict[tuple, tuple[list[int], float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            counts, total = self.values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value)
+
+    def count(self, *labels) -> int:
+        with self._lock:
+            return sum(self.values[labels][0]) if labels in self.values else 0
+
+    def quantile(self, q: float, *labels) -> float|None:
+        """Upper bound of the bucket holding the q quantile (None if empty or above the last bucket)"""
+        with self._lock:
+            if labels not in self.values:
+                return None
+            counts = list(self.values[labels][0])
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def mean(self, *labels) -> float|None:
+        with self._lock:
+            if labels not in self.values:
+                return None
+            counts, total = self.values[labels]
+        return total / sum(counts)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = {k: (list(c), t) for k, (c, t) in self.values.items()}
+        lines = self.header()
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels_text((*self.labels, 'le'), (*labels, bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, labels)} {cumulative}")
+        return lines
+
+
+# Metrics
+command_latency = Histogram("fantamorto_command_seconds", "Time to handle a command", ("command",))
+command_errors = Counter("fantamorto_command_errors_total", "Commands ended by an exception", ("command",))
+database_locked = Counter("fantamorto_database_locked_total", "Commands ended by a locked database", ("command",))
+command_statements = Histogram("fantamorto_command_sql_statements", "SQL statements run by a command", ("command",), STATEMENT_BUCKETS)
+sql_statements = Counter("fantamorto_sql_statements_total", "SQL statements run", ("scope",))
+wikidata_latency = Histogram("fantamorto_wikidata_seconds", "Time of the Wikidata requests", ("endpoint",))
+wikidata_responses = Counter("fantamorto_wikidata_responses_total", "Wikidata responses", ("endpoint", "status"))
+sweep_duration = Histogram("fantamorto_sweep_seconds", "Duration of the sweeps for new deaths", ("sweep",), SWEEP_BUCKETS)
+outbox_backlog = Gauge("fantamorto_outbox_backlog", "Outbox messages waiting to be delivered")
+loop_lag = Histogram("fantamorto_loop_lag_seconds", "Delay of the event loop heartbeat", buckets=LAG_BUCKETS)
+loop_stalls = Histogram("fantamorto_loop_stall_seconds", "Event loop stalls over the threshold", ("handler",), LAG_BUCKETS)
+
+REGISTRY: list[Metric] = [
+    command_latency, command_errors, database_locked, command_statements, sql_statements,
+    wikidata_latency, wikidata_responses, sweep_duration, outbox_backlog,
+    loop_lag, loop_stalls,
+]
+
+
+def render_metrics() -> str:
+    """All the metrics in the Prometheus text format"""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+@contextmanager
+def scope(name: str):
+    """Count the statements run inside the block on name"""
+    statements = [0]
+    token = current_scope.set((name, statements))
+    try:
+        yield statements
+    finally:
+        current_scope.reset(token)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    current = current_scope.get()
+    if current:
+        current[1][0] += 1
+    sql_statements.inc(current[0] if current else "other")
+
+def instrument_engine(engine: Engine) -> None:
+    if not event.contains(engine, "before_cursor_execute", _count_statement):
+        event.listen(engine, "before_cursor_execute", _count_statement)
+
+
+def record_wikidata_response(response, *args, **kwargs) -> None:
+    """requests response hook"""
+    endpoint = "sparql" if "sparql" in response.url else "api"
+    wikidata_latency.observe(response.elapsed.total_seconds(), endpoint)
+    wikidata_responses.inc(endpoint, response.status_code)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def render_stats() -> str:
+    """Short summary for the /stats command"""
+    def ms(value: float|None) -> str:
+        return f"{value * 1000:.0f}ms" if value is not None else "-"
+
+    lines = ["COMMANDS (count, p50, p95, avg queries)"]
+    for (command,) in sorted(command_latency.values):
+        lines.append(
+            f"{command}: {command_latency.count(command)}, {ms(command_latency.quantile(0.5, command))}, "
+            f"{ms(command_latency.quantile(0.95, command))}, {command_statements.mean(command) or 0:.1f}"
+        )
+    errors = {k[0]: int(v) for k, v in command_errors.values.items()}
+    if errors:
+        lines.append("Errors: " + ", ".join(f"{c} {n}" for c, n in sorted(errors.items())))
+    locked = {k[0]: int(v) for k, v in database_locked.values.items()}
+    if locked:
+        lines.append("Database locked: " + ", ".join(f"{c} {n}" for c, n in sorted(locked.items())))
+    lines.append("WIKIDATA (requests, p95)")
+    for (endpoint,) in sorted(wikidata_latency.values):
+        statuses = ", ".join(f"{s}: {int(n)}" for (e, s), n in sorted(wikidata_responses.values.items()) if e == endpoint)
+        lines.append(f"{endpoint}: {wikidata_latency.count(endpoint)} ({statuses}), {ms(wikidata_latency.quantile(0.95, endpoint))}")
+    lines.append("SWEEPS (runs, avg)")
+    for (sweep,) in sorted(sweep_duration.values):
+        lines.append(f"{sweep}: {sweep_duration.count(sweep)}, {sweep_duration.mean(sweep):.1f}s")
+    lines.append(f"Outbox backlog: {int(outbox_backlog.values.get((), 0))}")
+    stalls = ", ".join(f"{h} {loop_stalls.count(h)}" for (h,) in sorted(loop_stalls.values))
+    lines.append(f"Loop stalls: {stalls or 0}")
+    return "\n".join(lines)
@@ -0,0 +1,88 @@
+import logging
+import datetime as dt
+
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+
+from database.models.db import SessionLocal
+from database.models.outbox import OutboxMessage
+
+from .utils import setupLogger
+from .broadcast import Broadcaster, PERMANENT_ERRORS
+from .wrappers import write_lock
+from . import metrics
+
+# Logging
+LOG_FOLDER = "logs"
+LOG_FILENAME = "fantamorto_bot.log"
+LOG_LEVEL = logging.DEBUG
+
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+# Messages sent by a single run of the dispatcher
+DISPATCH_BATCH_SIZE = 200
+# Name of the repeating job of dispatch_outbox
+DISPATCH_JOB = "dispatch_outbox"
+
+
+def trigger_dispatch(job_queue) -> None:
+    """Run the repeating dispatch job now rather than at its next tick"""
+    for job in job_queue.get_jobs_by_name(DISPATCH_JOB):
+        job.job.modify(next_run_time=dt.datetime.now(dt.timezone.utc))
+
+
+def get_broadcaster(context: ContextTypes.DEFAULT_TYPE) -> Broadcaster:
+    # One broadcaster per bot, so the rate limits hold across runs
+    if "broadcaster" not in context.bot_data:
+        context.bot_data["broadcaster"] = Broadcaster(context.bot)
+    return context.bot_data["broadcaster"]
+
+
+async def dispatch_outbox(context: ContextTypes.DEFAULT_TYPE, *args, **kwargs) -> None:
+    """Deliver the pending outbox messages.
+
+    No transaction is open while talking to Telegram: pending messages are
+    claimed in one short transaction and the outcomes are stored in another
+    one, so a slow or failing send never holds the database. A run that
+    overlaps with another one does not see the messages claimed by it.
+    All the pending messages of a chat are merged and sent together.
+    """
+    async with write_lock():
+        with SessionLocal() as session:
+            with session.begin():
+                messages = [
+                    (m.id, m.chat_id, m.text, m.parse_mode)
+                    for m in OutboxMessage.claim(session, limit=DISPATCH_BATCH_SIZE)
+                ]
+                backlog = OutboxMessage.backlog(session)
+    metrics.outbox_backlog.set(value=backlog)
+    if not messages:
+        return
+
+    # parse mode -> chat -> messages
+    grouped: dict[str|None, dict[int, list[tuple[int, str]]]] = {}
+    for message_id, chat_id, text, parse_mode in messages:
+        grouped.setdefault(parse_mode, {}).setdefault(chat_id, []).append((message_id, text))
+
+    broadcaster = get_broadcaster(context)
+    outcomes: dict[int, TelegramError|None] = {}
+    for parse_mode, chats in grouped.items():
+        errors = await broadcaster.broadcast(
+            {chat_id: [text for _, text in chat_messages] for chat_id, chat_messages in chats.items()},
+            parse_mode=parse_mode,
+        )
+        for chat_id, chat_messages in chats.items():
+            for (message_id, _), error in zip(chat_messages, errors[chat_id]):
+                outcomes[message_id] = error
+
+    async with write_lock():
+        with SessionLocal() as session:
+            with session.begin():
+                for message_id, error in outcomes.items():
+                    message = session.get(OutboxMessage, message_id)
+                    if error is None:
+                        message.mark_sent()
+                    else:
+                        message.mark_failed(str(error), permanent=isinstance(error, PERMANENT_ERRORS))
+    metrics.outbox_backlog.set(value=backlog - sum(error is None for error in outcomes.values()))
+    logger.info("Outbox: %d messages to %d chats", len(messages), sum(len(c) for c in grouped.values()))
@@ -0,0 +1,84 @@
+import asyncio
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Updates accepted by the processor (running or waiting) before the
+# application stops handing over new ones
+MAX_QUEUED_UPDATES = 1024
+
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different chats concurrently, updates of the same chat one by one.
+
+    Handlers such as /add and /captain read and then advance the draft state
+    of the game of their chat, so two of them must never interleave. Updates
+    first wait for their chat (in arrival order) and only then for one of the
+    `workers` slots, so a busy chat never occupies slots of the others.
+    """
+
+    def __init__(self, workers: int, max_queued_updates: int = MAX_QUEUED_UPDATES):
+        super().__init__(max_concurrent_updates=max(workers, max_queued_updates))
+        self.workers = workers
+        self._workers_semaphore = asyncio.BoundedSemaphore(workers)
+        self._chat_locks: dict[int|None, asyncio.Lock] = {}
+        self._chat_depth: dict[int|None, int] = {}
+        self.queued = 0
+        self.running = 0
+        self.processed = 0
+        self.max_queue_depth = 0
+        self.max_chat_depth = 0
+
+    @staticmethod
+    def chat_key(update: object) -> int|None:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.chat_key(update)
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_depth[key] = self._chat_depth.get(key, 0) + 1
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        self.max_chat_depth = max(self.max_chat_depth, self._chat_depth[key])
+        started = False
+        try:
+            async with lock:
+                async with self._workers_semaphore:
+                    started = True
+                    self.queued -= 1
+                    self.running += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+        finally:
+            if not started:
+                self.queued -= 1
+            self._chat_depth[key] -= 1
+            if not self._chat_depth[key]:
+                del self._chat_depth[key]
+                del self._chat_locks[key]
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queued,
+            "busy_chats": len(self._chat_depth),
+            "processed": self.processed,
+            "max_queue_depth": self.max_queue_depth,
+            "max_chat_depth": self.max_chat_depth,
+        }
@@ -0,0 +1,117 @@
+import io
+import pstats
+import cProfile
+import datetime as dt
+from contextlib import asynccontextmanager
+
+from telegram import Bot
+
+# Longest run that can be requested with /profile N
+MAX_PROFILED_UPDATES = 1000
+# Functions listed in each section of the report
+REPORT_TOP_FUNCTIONS = 40
+
+
+class Profiler:
+    """cProfile runs started from the /profile command.
+
+    A run covers the next N wrapped commands or the next update_deads sweep
+    and ends by sending the report to the chat that asked for it. Handlers,
+    jobs and database calls all run on the event loop thread, so the
+    profile sees everything done on it while enabled, including updates of
+    other chats running at the same time. When no run is active the cost is
+    one attribute check per command.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.run = 0
+        self.label = ""
+        self.remaining_updates = 0
+        self.sweep_requested = False
+        self.bot: Bot|None = None
+        self.chat_id: int|None = None
+        self._profile: cProfile.Profile|None = None
+        self._started_on: dt.datetime|None = None
+
+    @property
+    def busy(self) -> bool:
+        return self.active or self.sweep_requested
+
+    def _requested_by(self, bot: Bot, chat_id: int) -> None:
+        if self.busy:
+            raise ValueError("A profiling run is already in progress")
+        self.bot = bot
+        self.chat_id = chat_id
+
+    def _enable(self, label: str) -> None:
+        self.run += 1
+        self.label = label
+        self._started_on = dt.datetime.now()
+        self._profile = cProfile.Profile()
+        self.active = True
+        self._profile.enable()
+
+    def start_updates(self, bot: Bot, chat_id: int, updates: int) -> None:
+        """Profile the commands starting from now on, until updates of them are over"""
+        if not 0 < updates <= MAX_PROFILED_UPDATES:
+            raise ValueError(f"The number of updates must be between 1 and {MAX_PROFILED_UPDATES}")
+        self._requested_by(bot, chat_id)
+        self.remaining_updates = updates
+        self._enable(f"next {updates} commands")
+
+    def request_sweep(self, bot: Bot, chat_id: int) -> None:
+        self._requested_by(bot, chat_id)
+        self.sweep_requested = True
+
+    async def update_done(self, run: int) -> None:
+        """Called at the end of a command that started during the given run"""
+        if not self.active or run != self.run or self.remaining_updates <= 0:
+            return
+        self.remaining_updates -= 1
+        if not self.remaining_updates:
+            await self.finish()
+
+    @asynccontextmanager
+    async def sweep(self):
+        """Profile the block if a sweep was requested"""
+        if not self.sweep_requested or self.active:
+            yield
+            return
+        self.sweep_requested = False
+        self._enable("update_deads")
+        try:
+            yield
+        finally:
+            await self.finish()
+
+    def report(self) -> str:
+        stream = io.StringIO()
+        elapsed = dt.datetime.now() - self._started_on
+        stream.write(f"Profile of the {self.label}, started {self._started_on:%Y-%m-%d %H:%M:%S}, {elapsed.total_seconds():.1f}s\n\n")
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.strip_dirs()
+        for sort in (pstats.SortKey.CUMULATIVE, pstats.SortKey.TIME):
+            stream.write(f"==== Top {REPORT_TOP_FUNCTIONS} by {sort.value} ====\n")
+            stats.sort_stats(sort).print_stats(REPORT_TOP_FUNCTIONS)
+        return stream.getvalue()
+
+    async def finish(self) -> None:
+        """Stop the run (or forget a requested sweep) and send the report"""
+        self.sweep_requested = False
+        if not self.active:
+            return
+        self._profile.disable()
+        self.active = False
+        self.remaining_updates = 0
+        report = self.report()
+        self._profile = None
+        await self.bot.send_document(
+            chat_id=self.chat_id,
+            document=io.BytesIO(report.encode()),
+            filename=f"profile_{self._started_on:%Y%m%d_%H%M%S}.txt",
+            caption=f"Profile of the {self.label}",
+        )
+
+
+profiler = Profiler()
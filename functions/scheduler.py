@@ -0,0 +1,213 @@
+import math
+import random
+import logging
+import threading
+import datetime as dt
+from dataclasses import dataclass
+
+from sqlalchemy.orm import Session
+
+from database.models import Game, Bonus
+from database.models.wikidata import MAX_IDS_PER_QUERY
+
+from .utils import setupLogger
+
+# Logging
+LOG_FOLDER = "logs"
+LOG_FILENAME = "fantamorto_bot.log"
+LOG_LEVEL = logging.DEBUG
+
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+# Gompertz law of mortality: yearly death rate at age x is A * exp(B * x)
+GOMPERTZ_A = 5e-5
+GOMPERTZ_B = 0.09
+# Yearly death rate (about 85 years old) of an athlet checked every MIN_CHECK_INTERVAL
+REFERENCE_RATE = GOMPERTZ_A * math.exp(GOMPERTZ_B * 85)
+MIN_CHECK_INTERVAL = dt.timedelta(hours=1)
+MAX_CHECK_INTERVAL = dt.timedelta(days=1)
+# Days when a death is worth a bonus are checked this many times more often
+BONUS_DAY_BOOST = 4
+
+# Gap between two sweeps
+MIN_RUN_INTERVAL = dt.timedelta(minutes=10)
+MAX_RUN_INTERVAL = dt.timedelta(hours=1)
+# Random +/- fraction of the gap, so restarts do not line up with Wikidata peaks
+RUN_JITTER = 0.1
+# Share of the calls left in the day for the daily sweep of the unwatched athlets
+UNWATCHED_BUDGET_SHARE = 0.2
+
+
+def yearly_death_rate(age: int) -> float:
+    return min(1.0, GOMPERTZ_A * math.exp(GOMPERTZ_B * age))
+
+
+def is_bonus_day(date_of_birth: dt.date, day: dt.date) -> bool:
+    """A death today would be worth the Zona Cesarini or the Happy Birthday bonus"""
+    cesarini = day.month == 12 and day.day >= 25
+    birthday = (day.month, day.day) == (date_of_birth.month, date_of_birth.day)
+    return cesarini or birthday
+
+
+@dataclass
+class WatchedAthlet:
+    id: int
+    wiki_id: str
+    date_of_birth: dt.date
+    # Teams of active games with the athlet, captains count Bonus.CAPTAIN_MULT times
+    weight: int
+
+    def age(self, day: dt.date) -> int:
+        born = self.date_of_birth
+        return day.year - born.year - ((day.month, day.day) < (born.month, born.day))
+
+    def check_interval(self, day: dt.date) -> dt.timedelta:
+        """Higher risk and weight, shorter interval"""
+        priority = yearly_death_rate(self.age(day)) * self.weight / REFERENCE_RATE
+        boost = BONUS_DAY_BOOST if is_bonus_day(self.date_of_birth, day) else 1
+        interval = MIN_CHECK_INTERVAL / max(priority, 1e-9)
+        return min(max(interval, MIN_CHECK_INTERVAL), MAX_CHECK_INTERVAL) / boost
+
+
+class CallBudget:
+    """Wikidata calls of the day, counted by a requests response hook.
+
+    Every call is counted, but only the sweeps are capped: commands (/add,
+    /info) always reach Wikidata and the sweeps make do with what is left.
+    """
+
+    def __init__(self, per_day: int):
+        self.per_day = per_day
+        self.day = dt.date.today()
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def _roll(self) -> None:
+        today = dt.date.today()
+        if today != self.day:
+            self.day = today
+            self.used = 0
+
+    def record(self, response, *args, **kwargs) -> None:
+        """requests response hook, called from the request threads"""
+        with self._lock:
+            self._roll()
+            self.used += 1
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            self._roll()
+            return max(0, self.per_day - self.used)
+
+    def allowance(self, now: dt.datetime, since_last_run: dt.timedelta) -> int:
+        """Calls for a sweep, spreading what is left evenly on the rest of the day"""
+        remaining = self.remaining
+        left_today = dt.datetime.combine(now.date() + dt.timedelta(days=1), dt.time()) - now
+        share = min(1.0, since_last_run / max(left_today, dt.timedelta(seconds=1)))
+        return min(remaining, max(1, math.floor(remaining * share)))
+
+
+class SweepScheduler:
+    """When update_deads runs and which athlets it checks.
+
+    The job reschedules itself after every run: soon when athlets are due,
+    after MAX_RUN_INTERVAL when nobody is watched. Each athlet is due again
+    after an interval that shrinks with his yearly death rate, with the
+    number of teams (and captaincies) that would score his death and on
+    bonus days (Zona Cesarini, birthday). The athlets sent to Wikidata by a
+    run are the most overdue ones that fit in the share of the daily call
+    budget left for it.
+    """
+
+    def __init__(self, calls_per_day: int):
+        self.budget = CallBudget(calls_per_day)
+        # Athlet id -> last successful check, process local: after a restart
+        # every athlet is due once
+        self.checked_on: dict[int, dt.datetime] = {}
+        # Last unwatched athlet checked, the next unwatched sweep goes on from there
+        self.unwatched_cursor = 0
+        self.next_due: dt.datetime|None = None
+        self.last_run: dt.datetime|None = None
+
+    @staticmethod
+    def watched(session: Session) -> list[WatchedAthlet]:
+        return [
+            WatchedAthlet(id, wiki_id, dob, teams + (Bonus.CAPTAIN_MULT - 1) * (captains or 0))
+            for id, wiki_id, dob, teams, captains in Game.watched_athlets_weights(session)
+        ]
+
+    def due_athlets(self, session: Session, now: dt.datetime|None = None) -> list[WatchedAthlet]:
+        """Athlets to check now, most overdue first, within the budget of the run"""
+        now = now or dt.datetime.now()
+        since_last_run = now - self.last_run if self.last_run else MAX_RUN_INTERVAL
+        self.last_run = now
+        watched = self.watched(session)
+        ids = {athlet.id for athlet in watched}
+        self.checked_on = {k: v for k, v in self.checked_on.items() if k in ids}
+
+        overdue = []
+        self.next_due = None
+        for athlet in watched:
+            interval = athlet.check_interval(now.date())
+            last = self.checked_on.get(athlet.id)
+            if last is None:
+                overdue.append((math.inf, athlet))
+                continue
+            due_on = last + interval
+            if due_on <= now:
+                overdue.append(((now - last) / interval, athlet))
+            elif self.next_due is None or due_on < self.next_due:
+                self.next_due = due_on
+
+        overdue.sort(key=lambda item: item[0], reverse=True)
+        limit = self.budget.allowance(now, since_last_run) * MAX_IDS_PER_QUERY
+        due = [athlet for _, athlet in overdue[:limit]]
+        if len(overdue) > limit:
+            # The others are due already
+            self.next_due = now
+        logger.info(
+            "Sweep: %d watched, %d due, %d to check, %d Wikidata calls left today",
+            len(watched), len(overdue), len(due), self.budget.remaining,
+        )
+        return due
+
+    def unwatched_athlets(self, session: Session) -> list[str]:
+        """Wiki ids for the daily sweep of the unwatched athlets.
+
+        They get UNWATCHED_BUDGET_SHARE of the calls left today; when they do
+        not all fit, each sweep goes on after the last athlet of the previous one.
+        """
+        limit = math.floor(self.budget.remaining * UNWATCHED_BUDGET_SHARE) * MAX_IDS_PER_QUERY
+        athlets = sorted(Game.unwatched_athlets(session), key=lambda athlet: athlet.id)
+        total = len(athlets)
+        if total > limit:
+            start = next((i for i, athlet in enumerate(athlets) if athlet.id > self.unwatched_cursor), 0)
+            athlets = (athlets[start:] + athlets[:start])[:limit]
+            if athlets:
+                self.unwatched_cursor = athlets[-1].id
+        logger.info(
+            "Unwatched sweep: %d athlets, %d to check, %d Wikidata calls left today",
+            total, len(athlets), self.budget.remaining,
+        )
+        return [athlet.wiki_id for athlet in athlets]
+
+    def checked(self, athlets: list[WatchedAthlet], now: dt.datetime|None = None) -> None:
+        now = now or dt.datetime.now()
+        for athlet in athlets:
+            self.checked_on[athlet.id] = now
+            due_on = now + athlet.check_interval(now.date())
+            if self.next_due is None or due_on < self.next_due:
+                self.next_due = due_on
+
+    def next_run(self, now: dt.datetime|None = None) -> dt.timedelta:
+        """Delay of the next sweep, with jitter"""
+        now = now or dt.datetime.now()
+        if not self.budget.remaining:
+            # Budget over: wait for tomorrow
+            delay = dt.datetime.combine(now.date() + dt.timedelta(days=1), dt.time()) - now
+        elif self.next_due is None:
+            delay = MAX_RUN_INTERVAL
+        else:
+            delay = min(max(self.next_due - now, MIN_RUN_INTERVAL), MAX_RUN_INTERVAL)
+        return delay * random.uniform(1 - RUN_JITTER, 1 + RUN_JITTER)
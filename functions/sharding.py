@@ -0,0 +1,184 @@
+import zlib
+import queue
+import asyncio
+import logging
+import multiprocessing
+
+from telegram import Bot, Update
+from telegram.ext import Application, Updater
+from telegram.request import BaseRequest
+
+from database.models.db import engine
+from database.models.snapshot import share_generation
+
+from .processing import ChatUpdateProcessor
+from .utils import setupLogger
+from . import metrics
+
+# Logging
+LOG_FOLDER = "logs"
+LOG_FILENAME = "fantamorto_bot.log"
+LOG_LEVEL = logging.DEBUG
+
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+# Updates waiting for a worker before the ingress stops reading new ones
+MAX_QUEUED_UPDATES = 1024
+# Put in the queue of a worker to stop it once the updates before it are done
+STOP = None
+
+
+def shard_for(update: object, shards: int) -> int:
+    """Worker of an update, the same for all the updates of a chat.
+
+    Python's hash() of a string changes with every process, crc32 does not.
+    """
+    key = ChatUpdateProcessor.chat_key(update)
+    return zlib.crc32(str(key).encode()) % shards
+
+
+class ShardRouter:
+    """Send every update to the queue of its worker, in arrival order"""
+
+    def __init__(self, queues: list, generation=None):
+        self.queues = queues
+        # Kept alive here: the workers open its semaphore while starting
+        self.generation = generation
+        self.routed = [0] * len(queues)
+
+    async def route(self, update: Update) -> int:
+        shard = shard_for(update, len(self.queues))
+        data = update.to_dict()
+        try:
+            self.queues[shard].put_nowait(data)
+        except queue.Full:
+            # The worker is MAX_QUEUED_UPDATES behind: wait for it in a
+            # thread, the loop keeps serving the webhook and the polling
+            await asyncio.get_running_loop().run_in_executor(None, self.queues[shard].put, data)
+        self.routed[shard] += 1
+        return shard
+
+    def stop(self) -> None:
+        for updates in self.queues:
+            updates.put(STOP)
+
+
+async def run_ingress(bot: Bot, router: ShardRouter, mode: str = "polling",
+                      webhook: dict|None = None, max_updates: int|None = None) -> None:
+    """Receive the updates (polling or webhook) and route them to the workers.
+
+    Runs until cancelled or, when given, until max_updates are routed.
+    """
+    update_queue = asyncio.Queue()
+    updater = Updater(bot=bot, update_queue=update_queue)
+    async with updater:
+        if mode == "webhook":
+            await updater.start_webhook(**webhook)
+        else:
+            await updater.start_polling()
+        try:
+            routed = 0
+            while max_updates is None or routed < max_updates:
+                await router.route(await update_queue.get())
+                routed += 1
+        finally:
+            await updater.stop()
+    logger.info("Ingress stopped, updates per worker: %s", router.routed)
+
+
+async def serve_shard(application: Application, updates) -> None:
+    """Run the application on the updates of a worker queue until STOP.
+
+    Updates enter the update queue in the order of the ingress, so the
+    ChatUpdateProcessor keeps the order of each chat as in a single process.
+    """
+    loop = asyncio.get_running_loop()
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is STOP:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        # Waits for the updates already in the update queue
+        await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def worker_main(index: int, updates, generation, build_application, token: str,
+                request_factory=None, metrics_port: int = 0, metrics_host: str = "127.0.0.1") -> None:
+    """Entry point of a worker process.
+
+    Every worker has its own Application, connection pool and caches; the
+    jobs (sweeps and outbox) only run in worker 0.
+    """
+    share_generation(generation)
+    request = request_factory() if request_factory else None
+    application = build_application(token, request=request, jobs=index == 0)
+    if metrics_port:
+        metrics.start_metrics_server(metrics_port + index, metrics_host)
+    logger.info("Worker %d started", index)
+    asyncio.run(serve_shard(application, updates))
+    logger.info("Worker %d stopped", index)
+
+
+def enable_wal() -> None:
+    """Let the readers of the other workers go on during a write.
+
+    WAL does not help the writers: see start_workers.
+    """
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+
+def start_workers(shards: int, build_application, token: str, request_factory=None,
+                  metrics_port: int = 0, metrics_host: str = "127.0.0.1", worker=worker_main):
+    """Spawn the worker processes, return them with the router of the ingress.
+
+    On SQLite the writers of all the workers share one file lock, and
+    write_lock only orders the writers of one process. This works because no
+    write transaction spans an await (see functions.wrappers.write_lock):
+    a writer of another worker waits at most for a commit, within the
+    sqlite3 busy timeout. Code that keeps a transaction open while it awaits
+    Telegram or Wikidata breaks this, and the other workers fail with
+    "database is locked".
+    """
+    if shards < 1:
+        raise ValueError("At least one worker is required")
+    enable_wal()
+    context = multiprocessing.get_context("spawn")
+    generation = context.Value("Q", 0)
+    queues = [context.Queue(MAX_QUEUED_UPDATES) for _ in range(shards)]
+    processes = [
+        context.Process(
+            target=worker,
+            args=(index, queues[index], generation, build_application, token, request_factory, metrics_port, metrics_host),
+            name=f"shard-{index}",
+        )
+        for index in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    return processes, ShardRouter(queues, generation)
+
+
+def run_sharded(token: str, shards: int, build_application, mode: str = "polling",
+                webhook: dict|None = None, request: BaseRequest|None = None,
+                metrics_port: int = 0, metrics_host: str = "127.0.0.1") -> None:
+    """Ingress in this process, `shards` worker processes behind it"""
+    processes, router = start_workers(shards, build_application, token,
+                                      metrics_port=metrics_port, metrics_host=metrics_host)
+    bot = Bot(token, request=request, get_updates_request=request)
+    try:
+        asyncio.run(run_ingress(bot, router, mode, webhook))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Workers finish the updates they received before stopping
+        router.stop()
+        for process in processes:
+            process.join()
@@ -1,25 +1,106 @@
 import os
+import json
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
-def setupLogger(log_folder, log_filename, log_level=logging.INFO) -> logging.Logger:
-    if not os.path.exists(log_folder):
-        os.mkdir(log_folder)
-    logfile = os.path.join(log_folder, log_filename)
+# Environment:
+# LOG_LEVEL   overrides the level of every logger, e.g. INFO
+# LOG_LEVELS  per logger levels, e.g. "functions.commands=INFO,httpx=WARNING"
+# LOG_FORMAT  "json" for one JSON object per line instead of plain text
+LOG_FORMAT = '[%(asctime)s] [%(name)s:%(filename)s:%(lineno)d] [%(levelname)s] %(message)s'
+LOG_MAX_BYTES = 100000
+LOG_BACKUP_COUNT = 10
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, for log collectors"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class LazyQueueHandler(QueueHandler):
+    """Put records on the queue with only the message interpolated.
+
+    The default QueueHandler runs the whole formatter in the calling thread;
+    here timestamps, JSON and tracebacks are formatted by the writer thread.
+    The message itself is interpolated before enqueueing, so arguments (ORM
+    objects, updates) are never read from another thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
-    stream_handler = logging.StreamHandler()
-    file_handler = RotatingFileHandler(logfile, maxBytes=100000, backupCount=10)
+def get_formatter() -> logging.Formatter:
+    if os.getenv("LOG_FORMAT", "").lower() == "json":
+        return JsonFormatter()
+    return logging.Formatter(LOG_FORMAT)
+
+def parse_log_level(level: str, name: str, default: int) -> int:
+    """Level of a name (e.g. INFO) or a number, default with a warning when it is neither"""
+    level = level.strip().upper()
+    value = int(level) if level.isdigit() else logging.getLevelName(level)
+    if not isinstance(value, int):
+        # Not raised: a typo in the environment must not stop the bot at import
+        logging.getLogger(__name__).warning("Unknown log level %r for %s, using %s", level, name, logging.getLevelName(default))
+        return default
+    return value
+
+def get_log_level(name: str, default: int) -> int:
+    for item in os.getenv("LOG_LEVELS", "").split(","):
+        logger_name, _, level = item.partition("=")
+        if logger_name.strip() == name and level.strip():
+            return parse_log_level(level, name, default)
+    level = os.getenv("LOG_LEVEL")
+    if level:
+        return parse_log_level(level, name, default)
+    return default
+
+# One queue and one writer thread per log file, shared by every logger
+_listeners: dict[str, tuple[queue.SimpleQueue, QueueListener]] = {}
+_listeners_lock = threading.Lock()
+
+def get_log_queue(log_folder: str, log_filename: str) -> queue.SimpleQueue:
+    logfile = os.path.join(log_folder, log_filename)
+    with _listeners_lock:
+        if logfile not in _listeners:
+            os.makedirs(log_folder, exist_ok=True)
+            formatter = get_formatter()
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+            file_handler = RotatingFileHandler(logfile, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+            file_handler.setFormatter(formatter)
 
-    formatter = logging.Formatter('[%(asctime)s] [%(name)s:%(filename)s:%(lineno)d] [%(levelname)s] %(message)s')
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            _listeners[logfile] = (log_queue, listener)
+        return _listeners[logfile][0]
 
-    stream_handler.setFormatter(formatter)
-    stream_handler.setLevel(log_level)
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(log_level)
+def setupLogger(log_folder, log_filename, log_level=logging.INFO, name=None) -> logging.Logger:
+    """Logger writing to the console and to a rotating file through a background thread.
 
-    logger = logging.getLogger(__name__)
-    logger.handlers.clear()
-    logger.setLevel(log_level)
-    logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
-    return logger
\ No newline at end of file
+    Calling it again for the same logger only updates its level.
+    """
+    logger = logging.getLogger(name or __name__)
+    logger.setLevel(get_log_level(logger.name, log_level))
+    log_queue = get_log_queue(log_folder, log_filename)
+    if not any(isinstance(h, QueueHandler) and h.queue is log_queue for h in logger.handlers):
+        logger.handlers.clear()
+        logger.addHandler(LazyQueueHandler(log_queue))
+        logger.propagate = False
+    return logger
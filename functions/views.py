@@ -0,0 +1,118 @@
+import datetime as dt
+
+from database.models import Bonus
+from database.models.game import game_version
+from database.models.snapshot import GameSnapshot, data_generation
+
+from .emoji import Emoji
+from .wrappers import LRUCache
+
+# Rendered messages: (game id, view, team id, game version, data generation, day) -> (html, rendered at)
+# The version is bumped by every write path of this process and the data
+# generation by the commits of all the shards; the TTL bounds how long a
+# write made by another process can go unnoticed otherwise.
+RENDER_CACHE_SIZE = 1024
+RENDER_CACHE_TTL = dt.timedelta(minutes=10)
+
+rendered_views = LRUCache(RENDER_CACHE_SIZE)
+
+
+def _cache_lookup(game_id: int, view: str, team_id: int|None) -> tuple[tuple, str|None]:
+    """Key of the view and its cached message, None when missing or expired"""
+    key = (game_id, view, team_id, game_version(game_id), data_generation(), dt.date.today())
+    cached = rendered_views.get(key)
+    if cached and dt.datetime.now() - cached[1] < RENDER_CACHE_TTL:
+        return key, cached[0]
+    return key, None
+
+
+def cached_view(game_id: int, view: str, team_id: int|None, render) -> str:
+    key, msg = _cache_lookup(game_id, view, team_id)
+    if msg is None:
+        msg = render()
+        rendered_views.set(key, (msg, dt.datetime.now()))
+    return msg
+
+
+async def cached_view_async(game_id: int, view: str, team_id: int|None, render) -> str:
+    """cached_view for the views whose render is a coroutine (e.g. it runs in a thread)"""
+    key, msg = _cache_lookup(game_id, view, team_id)
+    if msg is None:
+        msg = await render()
+        rendered_views.set(key, (msg, dt.datetime.now()))
+    return msg
+
+
+def render_ranking(snapshot: GameSnapshot) -> str:
+    msg = "RANKING\n"
+    for idx, team in enumerate(snapshot.ranking):
+        msg += f"{idx+1}. {team.breakdown.total} - {team.name_escaped_html}\n"
+    return msg
+
+
+def render_odds(snapshot: GameSnapshot, odds: list) -> str:
+    """odds: odds.TeamOdds of the teams of the game"""
+    msg = "ODDS (expected final score - win probability)\n"
+    for idx, team_odds in enumerate(sorted(odds, key=lambda o: (o.win_probability, o.expected_score), reverse=True)):
+        team = snapshot.get_team(team_odds.team_id)
+        msg += (f"{idx+1}. {team.name_escaped_html}: {team_odds.score} now, "
+                f"{team_odds.expected_score:.1f} expected - {team_odds.win_probability:.1%}\n")
+    return msg
+
+
+def render_all_teams(snapshot: GameSnapshot) -> str:
+    msg = f"There are {len(snapshot.teams)} teams in game:\n"
+    for team in snapshot.teams:
+        msg += f"{team.name_escaped_html} ({team.owner_name})\n"
+    return msg
+
+
+def render_team(snapshot: GameSnapshot, team_id: int) -> str:
+    team = snapshot.get_team(team_id)
+    breakdown = team.breakdown
+    first_deaths = snapshot.first_death_ids
+    msg = f"NAME: {team.name_escaped_html}\n"
+    msg += f"OWNER: {team.owner_name}\n"
+    msg += f"SCORE: {breakdown.total}\n"
+    msg += f"**** ATHLETS ****\n"
+    for idx, athlet in enumerate(team.athlets):
+        athlet_msg = f"{idx}: "
+        if athlet == breakdown.captain:
+            athlet_msg += f"{Emoji.CAPTAIN} "
+        athlet_msg += f"{athlet.name} - {athlet.age}y "
+        
+        if not athlet.is_dead:
+            athlet_msg += f"{Emoji.ALIVE} "
+        else:
+            athlet_msg += f"{Emoji.DEAD} "
+            if athlet.id in first_deaths:
+                athlet_msg += f"{Emoji.FIRST_DEATH} "
+            if athlet.gonzales:
+                athlet_msg += f"{Emoji.SPEEDY_GONZALES} "
+            if athlet.cesarini:
+                athlet_msg += f"{Emoji.ZONA_CESARINI} "
+            if athlet.club27:
+                athlet_msg += f"{Emoji.CLUB_27} "
+            if athlet.birthday:
+                athlet_msg += f"{Emoji.HAPPY_BIRTHDAY} "
+
+        athlet_msg += f"({breakdown.athlet_scores[athlet]} pt)"
+        msg += f"{athlet_msg}\n"
+    
+    msg += f"**** BONUS *****\n"
+    if breakdown.has_first_death:
+        msg += f"{Emoji.FIRST_DEATH} First death: {Bonus.FIRST_DEATH} pt\n"
+        msg += f"({', '.join([a.name_escaped_html for a in team.athlets if a.id in first_deaths])})\n"
+    msg += f"{Emoji.INCLUSIVITY} Inclusivity: {breakdown.inclusivity_score} pt\n"
+    gender_dead = [f"<b>{g}</b>" for g in breakdown.genders]
+    gender_alive = [g.name for g in breakdown.all_genders if g not in breakdown.genders]
+    msg += f"({', '.join(gender_dead + gender_alive)})\n"
+    msg += f"{Emoji.GLOBETROTTER} Globetrotter: {breakdown.globetrotter_score} pt\n"
+    citizenship_dead = [f"<b>{c}</b>" for c in breakdown.citizenships]
+    citizenship_alive = [c.name for c in breakdown.all_citizenships if c not in breakdown.citizenships]
+    msg += f"({', '.join(citizenship_dead + citizenship_alive)})\n"
+    msg += f"{Emoji.JACK_OF_ALL_TRADES} Jack of all Trades: {breakdown.jack_of_all_trades_score} pt\n"
+    occupation_dead = [f"<b>{o}</b>" for o in breakdown.occupations]
+    occupation_alive = [o.name for o in breakdown.all_occupations if o not in breakdown.occupations]
+    msg += f"({', '.join(occupation_dead + occupation_alive)})\n"
+    return msg
@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from contextlib import suppress
+from dataclasses import dataclass
+
+from .utils import setupLogger
+from . import metrics
+
+# Logging
+LOG_FOLDER = "logs"
+LOG_FILENAME = "fantamorto_bot.log"
+LOG_LEVEL = logging.DEBUG
+
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+# Seconds the loop may be late before it is reported as stalled
+STALL_THRESHOLD = 0.5
+HEARTBEAT_INTERVAL = 0.1
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Files defining the handlers and the jobs
+HANDLER_FILES = tuple(
+    os.path.join(PROJECT_DIR, *path)
+    for path in (("main.py",), ("functions", "commands.py"), ("functions", "notifications.py"))
+)
+WRAPPERS_FILE = os.path.join(PROJECT_DIR, "functions", "wrappers.py")
+
+
+@dataclass
+class Stall:
+    task: str
+    handler: str
+    blocking: str
+    stack: str
+
+
+def describe_stack(frames: traceback.StackSummary) -> tuple[str, str]:
+    """Handler (or job) and innermost project function of a stack"""
+    handler = ""
+    blocking = ""
+    for frame in frames:
+        if frame.filename in HANDLER_FILES and not handler:
+            handler = frame.name
+        if frame.filename.startswith(PROJECT_DIR) and frame.filename not in (__file__, WRAPPERS_FILE):
+            blocking = f"{frame.name} ({os.path.relpath(frame.filename, PROJECT_DIR)}:{frame.lineno})"
+    return handler or "unknown", blocking or "unknown"
+
+
+class LoopWatchdog:
+    """Report the calls that keep the event loop busy.
+
+    A heartbeat task wakes up every interval and measures how late it is.
+    A thread checks the heartbeat: when it is overdue by more than the
+    threshold the loop is stuck in a synchronous call, and the thread takes
+    the stack of the loop thread with sys._current_frames. When the loop is
+    free again the heartbeat logs the stall with its duration, the handler
+    or job running and the stack.
+    """
+
+    def __init__(self, threshold: float = STALL_THRESHOLD, interval: float = HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._stall: Stall|None = None
+        self._beat = time.monotonic()
+        self._loop: asyncio.AbstractEventLoop|None = None
+        self._loop_thread_id: int|None = None
+        self._task: asyncio.Task|None = None
+        self._thread: threading.Thread|None = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Start watching the running loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat(), name="watchdog")
+        self._thread = threading.Thread(target=self._watch, name="watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+        self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - expected)
+            metrics.loop_lag.observe(lag)
+            if lag >= self.threshold:
+                self._report(lag)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            overdue = time.monotonic() - self._beat - self.interval
+            if overdue > self.threshold and self._stall is None:
+                self._stall = self.capture()
+
+    def capture(self) -> Stall|None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        frames = traceback.extract_stack(frame)
+        task = asyncio.current_task(self._loop)
+        handler, blocking = describe_stack(frames)
+        return Stall(
+            task=task.get_name() if task else "-",
+            handler=handler,
+            blocking=blocking,
+            stack="".join(frames.format()),
+        )
+
+    def _report(self, lag: float) -> None:
+        stall, self._stall = self._stall, None
+        self.stalls += 1
+        handler = stall.handler if stall else "unknown"
+        metrics.loop_stalls.observe(lag, handler)
+        if stall:
+            logger.warning(
+                "Event loop blocked for %.2fs by %s in %s (task %s)\n%s",
+                lag, stall.handler, stall.blocking, stall.task, stall.stack,
+            )
+        else:
+            logger.warning("Event loop blocked for %.2fs", lag)
@@ -1,35 +1,251 @@
+import time
+import asyncio
+import logging
+import weakref
 from functools import wraps
+from contextlib import nullcontext
+from collections import OrderedDict
 
-from sqlalchemy import and_
+from sqlalchemy import and_, event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
 from telegram import Update
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 
-from database.models.db import SessionLocal
-from database.models import Game, Status, User
+from database.models.db import SessionLocal, engine
+from database.models import Game, Status, User, Team
+from database.models.wikidata import WikidataPerson, merge_athlets
+
+from .utils import setupLogger
+from . import metrics
+from .profiling import profiler
+
+# Logging
+LOG_FOLDER = "logs"
+LOG_FILENAME = "fantamorto_bot.log"
+LOG_LEVEL = logging.DEBUG
+
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+# Caches
+CHAT_CACHE_SIZE = 2048
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key, value) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+# Only existing games and teams are cached and every hit is checked against
+# the row it points to, so an entry made stale by another process is
+# detected and dropped instead of being served.
+# chat_id -> game id
+chat_games = LRUCache(CHAT_CACHE_SIZE)
+# (game id, telegram user id) -> team id
+game_teams = LRUCache(CHAT_CACHE_SIZE)
+
+def invalidate_chat(chat_id: int) -> None:
+    chat_games.pop(chat_id)
+
+def invalidate_team(game_id: int, telegram_id: int) -> None:
+    game_teams.pop((game_id, telegram_id))
+
+
+# Sessions
+class LazySession:
+    """Stands in for a Session and opens it only on first use.
+
+    Handlers that answer before touching the database (wrong arguments,
+    cached answers...) never create a session, check out a connection or
+    commit an empty transaction. Sessions do not autoflush: the changes of a
+    handler are written by its final commit, so on SQLite no write
+    transaction is open while the handler awaits Telegram or Wikidata. A
+    read-only session is always rolled back and refuses to flush.
+    """
+
+    def __init__(self, read_only: bool = False):
+        self.read_only = read_only
+        self._session: Session|None = None
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            self._session = SessionLocal(autoflush=False)
+            self._session.info["read_only"] = self.read_only
+        return self._session
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def commit(self) -> None:
+        if self._session is None:
+            return
+        if self.read_only:
+            self._session.rollback()
+        else:
+            self._session.commit()
+
+    def rollback(self) -> None:
+        if self._session is not None:
+            self._session.rollback()
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+@event.listens_for(Session, "before_flush")
+def _refuse_read_only_flush(session: Session, flush_context, instances) -> None:
+    if session.info.get("read_only") and (session.new or session.dirty or session.deleted):
+        raise RuntimeError("Changes cannot be flushed from a read-only session")
+
+
+# SQLite has one writer at a time and waits for the write lock by blocking
+# the thread, i.e. the event loop. A write transaction left open across an
+# await would then stop every other writer until the timeout ("database is
+# locked"). So, on SQLite, the writes of the event loop (commits of the
+# handlers, merges of Wikidata answers, sweeps, outbox) take this lock only
+# for their flush and commit, with no await inside: Telegram and Wikidata
+# are always awaited with no lock and no write transaction held.
+_write_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+def write_lock():
+    """Async context manager held while writing from the event loop, a no-op on a server database"""
+    if engine.dialect.name != "sqlite":
+        return nullcontext()
+    # asyncio locks belong to one loop, benchmarks run several in a row
+    loop = asyncio.get_running_loop()
+    lock = _write_locks.get(loop)
+    if lock is None:
+        lock = _write_locks[loop] = asyncio.Lock()
+    return lock
+
+def is_lock_error(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and "locked" in str(error.orig)
+
+def _real_session(session) -> Session:
+    return session.session if isinstance(session, LazySession) else session
+
+async def merge_people(session, people: list[WikidataPerson], source: str = "refresh", preview: bool = False) -> list:
+    """Merge the Wikidata people fetched by a handler and commit them at once.
+
+    The merge looks up the properties it creates, so it autoflushes; it is
+    committed right away behind write_lock, with the changes of the handler
+    so far. A preview, always the case on a read-only session, is only kept
+    in the session for the answer: no event is logged, no game version
+    bumped, and it must be rolled back.
+    """
+    if preview or session.info.get("read_only"):
+        return merge_athlets(session, people, source, preview=True)
+    real = _real_session(session)
+    async with write_lock():
+        real.autoflush = True
+        try:
+            athlets = merge_athlets(real, people, source)
+        finally:
+            real.autoflush = False
+        real.commit()
+    return athlets
+
+async def _reply_busy(args) -> None:
+    update = args[0] if args and isinstance(args[0], Update) else None
+    if update is None or update.effective_message is None:
+        return
+    try:
+        await update.effective_message.reply_text("The bot is busy right now, please try again in a moment")
+    except TelegramError:
+        logger.exception("Could not report a locked database")
 
 
 # Wrappers
-def get_session(func):
+def _session_wrapper(func, read_only: bool):
     @wraps(func)
     async def wrapped(*args, **kwargs):
-        with SessionLocal() as session:
-            with session.begin():
-                try:
-                    await func(session, *args, **kwargs)
+        session = LazySession(read_only=read_only)
+        profiled_run = profiler.run if profiler.active else None
+        start = time.perf_counter()
+        with metrics.scope(func.__name__) as statements:
+            try:
+                await func(session, *args, **kwargs)
+                # All the changes are written here, see write_lock
+                async with (nullcontext() if read_only or not session.opened else write_lock()):
                     session.commit()
-                except:
-                    session.rollback()
+            except Exception as err:
+                metrics.command_errors.inc(func.__name__)
+                session.rollback()
+                if is_lock_error(err):
+                    metrics.database_locked.inc(func.__name__)
+                    logger.error("Database locked in %s: %s", func.__name__, err)
+                    await _reply_busy(args)
+                else:
+                    logger.exception("%s failed", func.__name__)
+            finally:
+                session.close()
+        metrics.command_latency.observe(time.perf_counter() - start, func.__name__)
+        metrics.command_statements.observe(statements[0], func.__name__)
+        if profiled_run is not None:
+            await profiler.update_done(profiled_run)
     return wrapped
 
+def get_session(func):
+    return _session_wrapper(func, read_only=False)
+
+def get_read_only_session(func):
+    return _session_wrapper(func, read_only=True)
+
+def require_args(message: str):
+    """Answer with message when the command has no arguments, before any query"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapped(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            if not context.args:
+                await update.effective_message.reply_html(message)
+                return
+            await func(session, update, context, *args, **kwargs)
+        return wrapped
+    return decorator
+
 def get_chat_game(func):
     @wraps(func)
     async def wrapped(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        game = session.query(Game).where(
-            and_(Game.chat_id == update.effective_chat.id,
-                Game.status != Status.END)
-            ).one_or_none()
+        chat_id = update.effective_chat.id
+        game = None
+        game_id = chat_games.get(chat_id)
+        if game_id:
+            game = session.get(Game, game_id)
+            if not game or game.chat_id != chat_id or game.status == Status.END:
+                invalidate_chat(chat_id)
+                game = None
+        if not game:
+            game = session.query(Game).where(
+                and_(Game.chat_id == chat_id,
+                    Game.status != Status.END)
+                ).one_or_none()
+        if game:
+            chat_games.set(chat_id, game.id)
         await func(session, update, context, game, *args, **kwargs)
     return wrapped
 
@@ -45,8 +261,22 @@ def active_game(func):
 def team_owner(func):
     @wraps(func)
     async def wrapped(session: Session, update: Update, context: ContextTypes.DEFAULT_TYPE, game: Game, *args, **kwargs):
-        user = User.get_or_create_user(update.effective_user, session)
-        team = game.get_team_from_owner(user, session)
+        key = (game.id, update.effective_user.id)
+        team = None
+        team_id = game_teams.get(key)
+        if team_id:
+            team = session.get(Team, team_id)
+            if not team or team.game_id != game.id:
+                invalidate_team(*key)
+                team = None
+        if not team:
+            # Only lookup, a user without a team has nothing to create here
+            team = session.query(Team).join(Team.owner).where(
+                and_(Team.game_id == game.id,
+                    User.telegram_id == update.effective_user.id)
+                ).one_or_none()
+            if team:
+                game_teams.set(key, team.id)
         if not team:
             await update.message.reply_text("You don't have a team in this game :(")
             return
@@ -1,37 +1,35 @@
 import logging
-from logging.handlers import RotatingFileHandler
 import os
-import random
-import requests
-from dotenv import load_dotenv
-import pdb
-import re
 import time
-import os
-from datetime import timedelta, date
-from functools import wraps
-from typing import TypedDict
-from html import escape
-
+from datetime import timedelta
 
 from dotenv import load_dotenv
 
-from telegram import Update, BotCommand
-from telegram.ext import ApplicationBuilder, Application ,ContextTypes, filters, PicklePersistence, CommandHandler
-from telegram.helpers import escape_markdown
+from telegram import BotCommand
+from telegram.ext import ApplicationBuilder, Application, ContextTypes, filters, CommandHandler
+from telegram.request import BaseRequest
 from telegram.constants import ParseMode
 
-from database.models import Game, Team, Athlet, Bonus, Status
 from database.models.db import SessionLocal
-from database.models.wikidata import find_dead_athlets
+from database.models.wikidata import find_dead_people_async, merge_athlets, RESPONSE_HOOKS
+from database.models.db import engine
+from database.models.outbox import OutboxMessage
 
 from functions.utils import setupLogger
 from functions.emoji import Emoji
+from functions.notifications import dispatch_outbox, trigger_dispatch, DISPATCH_JOB
+from functions.wrappers import write_lock
+from functions.processing import ChatUpdateProcessor
+from functions import metrics
+from functions import sharding
+from functions.profiling import profiler
+from functions.watchdog import LoopWatchdog
+from functions.scheduler import SweepScheduler
 
 from functions.commands import on_start, on_stop, on_help, on_join
 from functions.commands import on_draft, on_draft_order, on_cancel_draft
-from functions.commands import on_info, on_add, on_captain, on_ranking, on_team, on_allTeams, on_rename, on_export, on_kill 
-from functions.commands import on_sendmessage
+from functions.commands import on_info, on_add, on_captain, on_ranking, on_team, on_allTeams, on_odds, on_rename, on_export, on_kill 
+from functions.commands import on_sendmessage, on_rescore, on_verify_events, on_stats, on_profile
 
 """
 How should work:
@@ -49,7 +47,34 @@ load_dotenv()
 # Global variables
 TOKEN = os.getenv("TOKEN", "")
 SUPERUSER = os.getenv("SUPERUSER", "")
-BAN_LIST_FILE = "ban_list.yaml"
+
+# Updates: "polling" (default, for development) or "webhook"
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public base url, e.g. https://example.org
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+
+# Updates of different chats processed at the same time (on SQLite only
+# the commits take turns, see functions.wrappers.write_lock)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+
+# Worker processes behind one ingress process, chats are split among them
+# by id (0 runs everything in this process)
+SHARDS = int(os.getenv("SHARDS", "0"))
+
+# Prometheus metrics on http://METRICS_LISTEN:METRICS_PORT/metrics (0 disables),
+# worker N of the sharded mode uses METRICS_PORT + N
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Wikidata calls per day. The commands are counted but never refused, the
+# sweeps (watched and unwatched) adapt to what is left
+WIKIDATA_DAILY_BUDGET = int(os.getenv("WIKIDATA_DAILY_BUDGET", "500"))
+
+# Seconds of event loop lag logged as a stall with the blocking stack (0 disables)
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.5"))
 
 # Constants
 DEFAULT_FANTAMORTO_TEAM_SIZE = 10
@@ -64,7 +89,9 @@ PERSISTENCE_FILE = "fantamorto-persistence.ptb"
 
 SUPERUSER_IDS = ["81855912"]
 
-logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL)
+logger = setupLogger(LOG_FOLDER, LOG_FILENAME, LOG_LEVEL, __name__)
+
+sweep_scheduler = SweepScheduler(WIKIDATA_DAILY_BUDGET)
 
 
 # Commands
@@ -85,60 +112,148 @@ class Commands:
         BotCommand("team", "get your team info"),
         BotCommand("ranking", "get the the current table of the game"),
         BotCommand("allteams", "get a list of the teams in the game"),
+        BotCommand("odds", "get the expected final score and the win probability of the teams"),
         BotCommand("export", "export a csv file with all the teams and athlets"),
         ]
 
 # General functions
 
 async def update_deads(context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-    logger.info(f"Updating deads")
-    with SessionLocal() as session:
-        with session.begin():
-            try:
-                alive_athlets = session.query(Athlet).where(Athlet.date_of_death == None).all()
-                alive_athlets_ids = [
-                    athlet.wiki_id for athlet in alive_athlets
-                ]
-                dead_athlets = find_dead_athlets(session, ids=list(alive_athlets_ids))
-                all_games = []
-                for athlet in dead_athlets:
-                    for team in athlet.teams:
-                        game = team.game
-                        msg = "+++ MORTO +++\n"
-                        msg += f"{athlet.name_escaped_html} ormai è solo un cadavere!\n"
-                        msg += f"Gli unici a rallegrarsi sono i tifosi di {team.name_escaped_html} per i quali la morte porta {athlet.score} punti\n"
-                        msg += "È MORTO! MORTO MORTO MORTO!"
-                        await context.bot.send_message(
-                            chat_id = game.chat_id,
-                            text= msg,
-                            parse_mode=ParseMode.HTML
-                        )
-                        all_games.append(game)
-                for game in set(all_games):
-                    first_death_teams = game.update_first_death(dead_athlets)
-                    if first_death_teams:
-                        teams_names = [t.name_escaped_html for t in first_death_teams]
-                        msg = f"FIRST DEATH! {Emoji.FIRST_DEATH}\n"
-                        msg += f"I punti per il primo sangue versato vanno a {', '.join(teams_names)}"
-                        await context.bot.send_message(
-                            chat_id = game.chat_id,
-                            text= msg,
-                            parse_mode=ParseMode.HTML
-                        )
-                logger.info("End update deads")
-                session.commit()
-            except:
-                session.rollback()
+    """Sweep of the athlets drafted in active games that are due for a check.
+
+    Reschedules itself, see functions/scheduler.py
+    """
+    try:
+        with SessionLocal() as session:
+            due = sweep_scheduler.due_athlets(session)
+        if due:
+            logger.info("Updating deads")
+            async with profiler.sweep():
+                if await sweep_deads(context, lambda session: [a.wiki_id for a in due], "watched"):
+                    sweep_scheduler.checked(due)
+    finally:
+        if context.job_queue:
+            context.job_queue.run_once(update_deads, when=sweep_scheduler.next_run(), name="update_deads")
+
+async def update_other_deads(context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+    """Daily sweep of the alive athlets that are not part of an active game, within its share of the budget"""
+    logger.info("Updating other deads")
+    await sweep_deads(context, sweep_scheduler.unwatched_athlets, "unwatched")
+
+async def sweep_deads(context: ContextTypes.DEFAULT_TYPE, get_ids, name: str) -> bool:
+    start = time.perf_counter()
+    with metrics.scope(f"sweep_{name}"):
+        done = await _sweep_deads(context, get_ids)
+    metrics.sweep_duration.observe(time.perf_counter() - start, name)
+    return done
+
+async def _sweep_deads(context: ContextTypes.DEFAULT_TYPE, get_ids) -> bool:
+    """Check the athlets of get_ids(session), False if the sweep failed"""
+    # Wikidata is queried with no transaction open. The deaths are then
+    # merged, scored and notified in one short transaction behind write_lock
+    # with no await inside; the notifications are only written to the outbox
+    # and delivered later by dispatch_outbox.
+    try:
+        with SessionLocal() as session:
+            alive_athlets_ids = get_ids(session)
+        if not alive_athlets_ids:
+            logger.info("No athlets to check")
+            return True
+        dead_people = await find_dead_people_async(list(alive_athlets_ids))
+    except:
+        logger.exception("Update deads failed")
+        return False
+
+    async with write_lock():
+        with SessionLocal() as session:
+            with session.begin():
+                try:
+                    # The DEATH events are logged by the merge of the athlets
+                    dead_athlets = merge_athlets(session, dead_people, source="sweep")
+                    all_games = []
+                    for athlet in dead_athlets:
+                        for team in athlet.teams:
+                            if team.game not in all_games:
+                                all_games.append(team.game)
+                    first_death_teams = {
+                        game: game.update_first_death(dead_athlets) for game in all_games
+                    }
+                    # Rescore every affected team at once (numpy is loaded only here)
+                    from database.models.scoring import rescore
+                    scores = rescore(session, game_ids=[game.id for game in all_games])
+                    for athlet in dead_athlets:
+                        for team in athlet.teams:
+                            game = team.game
+                            msg = "+++ MORTO +++\n"
+                            msg += f"{athlet.name_escaped_html} ormai è solo un cadavere!\n"
+                            msg += f"Gli unici a rallegrarsi sono i tifosi di {team.name_escaped_html} per i quali la morte porta {athlet.score} punti\n"
+                            if team.id in scores:
+                                msg += f"Ora {team.name_escaped_html} ha {scores[team.id]} punti\n"
+                            msg += "È MORTO! MORTO MORTO MORTO!"
+                            OutboxMessage.enqueue(
+                                session,
+                                key=f"death:{athlet.wiki_id}:{team.id}",
+                                chat_id=game.chat_id,
+                                text=msg,
+                                parse_mode=ParseMode.HTML
+                            )
+                    for game in all_games:
+                        if first_death_teams[game]:
+                            teams_names = [t.name_escaped_html for t in first_death_teams[game]]
+                            msg = f"FIRST DEATH! {Emoji.FIRST_DEATH}\n"
+                            msg += f"I punti per il primo sangue versato vanno a {', '.join(teams_names)}"
+                            OutboxMessage.enqueue(
+                                session,
+                                key=f"firstdeath:{game.id}",
+                                chat_id=game.chat_id,
+                                text=msg,
+                                parse_mode=ParseMode.HTML
+                            )
+                    logger.info("End update deads")
+                    session.commit()
+                except:
+                    logger.exception("Update deads failed")
+                    session.rollback()
+                    return False
+
+    if context.job_queue:
+        trigger_dispatch(context.job_queue)
+    return True
 
 async def post_init(application: Application) -> None:
-    await application.updater.bot.set_my_commands([])
-    await application.updater.bot.set_my_commands(commands=Commands.USER)
+    # Commands rarely change: one read instead of two writes at every start
+    if tuple(await application.bot.get_my_commands()) != tuple(Commands.USER):
+        await application.bot.set_my_commands(commands=Commands.USER)
+    if LOOP_STALL_THRESHOLD:
+        watchdog = LoopWatchdog(threshold=LOOP_STALL_THRESHOLD)
+        watchdog.start()
+        application.bot_data["watchdog"] = watchdog
 
-def main() -> None:
-    print(f"{TOKEN}")
+async def post_shutdown(application: Application) -> None:
+    if "watchdog" in application.bot_data:
+        await application.bot_data.pop("watchdog").stop()
 
-    # Get the application to register handlers
-    application = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
+def build_application(token: str, request: BaseRequest|None = None,
+                      update_processor: ChatUpdateProcessor|None = None, jobs: bool = True) -> Application:
+    """Application with all the handlers and, unless jobs is False, the jobs.
+
+    request replaces the HTTP backend and update_processor the default
+    processor (e.g. in benchmarks).
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(update_processor or ChatUpdateProcessor(workers=UPDATE_WORKERS))
+    )
+    if request:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    metrics.instrument_engine(engine)
+    for hook in (metrics.record_wikidata_response, sweep_scheduler.budget.record):
+        if hook not in RESPONSE_HOOKS:
+            RESPONSE_HOOKS.append(hook)
     job_queue = application.job_queue
 
     # on different commands - answer in Telegram
@@ -156,19 +271,66 @@ def main() -> None:
     application.add_handler(CommandHandler(["ranking", "table"], on_ranking, filters=~filters.UpdateType.EDITED_MESSAGE))
     application.add_handler(CommandHandler("team", on_team, filters=~filters.UpdateType.EDITED_MESSAGE))
     application.add_handler(CommandHandler(["allteams", "all_teams"], on_allTeams, filters=~filters.UpdateType.EDITED_MESSAGE))
+    application.add_handler(CommandHandler("odds", on_odds, filters=~filters.UpdateType.EDITED_MESSAGE))
     application.add_handler(CommandHandler("rename", on_rename, filters=~filters.UpdateType.EDITED_MESSAGE))
     application.add_handler(CommandHandler("export", on_export, filters=~filters.UpdateType.EDITED_MESSAGE))
     application.add_handler(CommandHandler("kill", on_kill, filters=~filters.UpdateType.EDITED_MESSAGE))
     application.add_handler(CommandHandler("send", on_sendmessage, filters=~filters.UpdateType.EDITED_MESSAGE))
+    application.add_handler(CommandHandler("rescore", on_rescore, filters=~filters.UpdateType.EDITED_MESSAGE))
+    application.add_handler(CommandHandler("verifyevents", on_verify_events, filters=~filters.UpdateType.EDITED_MESSAGE))
+    application.add_handler(CommandHandler("stats", on_stats, filters=~filters.UpdateType.EDITED_MESSAGE))
+    application.add_handler(CommandHandler("profile", on_profile, filters=~filters.UpdateType.EDITED_MESSAGE))
 
     # Job queue
-    if job_queue:
-        job_queue.run_repeating(update_deads, interval=timedelta(hours=1))
+    if job_queue and jobs:
+        job_queue.run_once(update_deads, when=timedelta(minutes=1), name="update_deads")
+        job_queue.run_repeating(update_other_deads, interval=timedelta(days=1), first=timedelta(minutes=30))
+        job_queue.run_repeating(dispatch_outbox, interval=timedelta(seconds=30), name=DISPATCH_JOB)
+
+    return application
+
+def webhook_settings() -> dict:
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL is required in webhook mode")
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET is required in webhook mode")
+    # Telegram sends WEBHOOK_SECRET in every request, requests without it are rejected
+    return dict(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+    )
+
+def run_webhook(application: Application) -> None:
+    application.run_webhook(**webhook_settings())
+
+def main() -> None:
+    print(f"{TOKEN}")
+
+    if SHARDS:
+        sharding.run_sharded(
+            TOKEN, SHARDS, build_application,
+            mode=UPDATE_MODE,
+            webhook=webhook_settings() if UPDATE_MODE == "webhook" else None,
+            metrics_port=METRICS_PORT,
+            metrics_host=METRICS_LISTEN,
+        )
+        return
+
+    # Get the application to register handlers
+    application = build_application(TOKEN)
+    if METRICS_PORT:
+        metrics.start_metrics_server(METRICS_PORT, METRICS_LISTEN)
 
     # Start the Bot
-    application.run_polling()
+    if UPDATE_MODE == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 
 
 if __name__ == '__main__':
-    main()
+    main()
\ No newline at end of file
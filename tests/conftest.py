@@ -0,0 +1,23 @@
+"""Tests run on a temporary SQLite file, whatever DATABASE_URL the shell has."""
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="fantamorto-tests-"), "tests.db")
+
+import pytest
+
+from benchmarks.datagen import generate
+
+# Small synthetic games, override any generate() argument with @pytest.mark.games(...)
+GAMES = dict(num_chats=1, num_teams=2, team_size=3, dead_ratio=0)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "games(**kwargs): generate() arguments of the games fixture")
+
+
+@pytest.fixture
+def games(request):
+    """A new database with the synthetic games of benchmarks.datagen"""
+    marker = request.node.get_closest_marker("games")
+    generate(**{**GAMES, **(marker.kwargs if marker else {})})
@@ -0,0 +1,124 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram import Bot
+
+from benchmarks.datagen import reset_db
+from benchmarks.fakebot import FakeRequest, TOKEN
+from database.models.db import SessionLocal
+from database.models.outbox import OutboxMessage, MAX_ATTEMPTS
+from functions.broadcast import Broadcaster, merge_texts, split_text, MESSAGE_MAX_LENGTH
+from functions.notifications import dispatch_outbox
+
+BAD_HTML = {"error_code": 400, "description": "Bad Request: can't parse entities"}
+BLOCKED = {"error_code": 403, "description": "Forbidden: bot was kicked from the group chat"}
+BAD_GATEWAY = {"error_code": 502, "description": "Bad Gateway"}
+
+
+def fail_on(marker: str, error: dict):
+    def fail(endpoint, params):
+        if endpoint == "sendMessage" and marker in params["text"]:
+            return error
+        return None
+    return fail
+
+
+def fast_broadcaster(bot: Bot) -> Broadcaster:
+    return Broadcaster(bot, global_rate=10**6, global_burst=10**6, chat_rate=10**6, chat_burst=10**6)
+
+
+def send_chat(texts: list[str], fail=None) -> tuple[list, list[str]]:
+    """Errors of send_chat and texts of the messages sent"""
+    request = FakeRequest(fail=fail)
+
+    async def run():
+        async with Bot(TOKEN, request=request) as bot:
+            return await fast_broadcaster(bot).send_chat(-1, texts)
+    errors = asyncio.run(run())
+    sent = [p["text"] for _, endpoint, p in request.calls if endpoint == "sendMessage" and not (fail and fail("sendMessage", p))]
+    return errors, sent
+
+
+def test_merge_texts_indexes():
+    texts = ["a" * 3000, "b" * 1000, "c" * 200]
+    merged = merge_texts(texts)
+    assert [indexes for _, indexes in merged] == [[0, 1], [2]]
+    assert all(len(message) <= MESSAGE_MAX_LENGTH for message, _ in merged)
+
+
+def test_long_text_is_split():
+    text = "\n".join("line %d" % i + "x" * 90 for i in range(200))
+    merged = merge_texts(["short", text, "after"])
+    assert all(len(message) <= MESSAGE_MAX_LENGTH for message, _ in merged)
+    assert [message for message, indexes in merged if indexes == [1]] == split_text(text)
+    assert "\n".join(split_text(text)) == text
+    # One line longer than a message is cut anyway
+    assert [len(piece) for piece in split_text("y" * 9000)] == [4096, 4096, 808]
+
+
+def test_bad_text_does_not_fail_the_others():
+    texts = ["ok 1", "<b>broken", "ok 2"]
+    errors, sent = send_chat(texts, fail_on("<b>broken", BAD_HTML))
+    assert [e is None for e in errors] == [True, False, True]
+    # The merged message failed, then the texts went one by one
+    assert sent == ["ok 1", "ok 2"]
+
+
+def test_failed_message_only_fails_its_texts():
+    texts = ["a" * 4000, "b" * 4000, "c" * 4000]
+    errors, sent = send_chat(texts, fail_on("b", BAD_GATEWAY))
+    assert [e is None for e in errors] == [True, False, True]
+    assert sent == ["a" * 4000, "c" * 4000]
+
+
+def test_forbidden_fails_the_whole_chat():
+    texts = ["a" * 4000, "b" * 4000, "c" * 4000]
+    errors, sent = send_chat(texts, fail_on("a", BLOCKED))
+    assert all(e is not None for e in errors)
+    assert sent == []
+
+
+def add_messages(texts: list[tuple[int, str]]) -> None:
+    with SessionLocal() as session:
+        for idx, (chat_id, text) in enumerate(texts):
+            OutboxMessage.enqueue(session, f"test:{idx}", chat_id, text)
+        session.commit()
+
+
+def run_dispatch(request: FakeRequest, runs: int = 1) -> None:
+    async def run():
+        async with Bot(TOKEN, request=request) as bot:
+            context = SimpleNamespace(bot=bot, bot_data={"broadcaster": fast_broadcaster(bot)})
+            await asyncio.gather(*(dispatch_outbox(context) for _ in range(runs)))
+    asyncio.run(run())
+
+
+def test_dispatch_outcomes_per_message():
+    reset_db()
+    add_messages([(-1, "ok"), (-1, "<b>broken"), (-2, "down"), (-3, "kicked")])
+    def fail(endpoint, params):
+        text = params.get("text", "")
+        if params.get("chat_id") == -3:
+            return BLOCKED
+        if "<b>broken" in text:
+            return BAD_HTML
+        if "down" in text:
+            return BAD_GATEWAY
+        return None
+    run_dispatch(FakeRequest(fail=fail))
+    with SessionLocal() as session:
+        messages = {m.text: m for m in session.query(OutboxMessage)}
+        assert messages["ok"].sent_on is not None
+        assert messages["<b>broken"].sent_on is None and messages["<b>broken"].attempts == MAX_ATTEMPTS
+        assert messages["kicked"].attempts == MAX_ATTEMPTS
+        # Temporary errors are retried later
+        assert messages["down"].attempts == 1
+        assert OutboxMessage.backlog(session) == 1
+
+
+def test_overlapping_dispatches_send_once():
+    reset_db()
+    add_messages([(-chat, f"death {chat}") for chat in range(1, 6)])
+    request = FakeRequest(latency=0.05)
+    run_dispatch(request, runs=2)
+    assert sorted(params["text"] for _, _, params in request.sent_messages()) == [f"death {chat}" for chat in range(1, 6)]
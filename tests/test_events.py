@@ -0,0 +1,126 @@
+"""The event log must follow every change of the games, whatever path made it."""
+import datetime as dt
+
+import pytest
+from sqlalchemy import select
+
+from database.models import Athlet, Game, Status, Team
+from database.models.db import SessionLocal
+from database.models.events import GameEvent, EventKind
+from database.models.replay import backfill, check_replay
+from database.models.snapshot import GameSnapshot
+from database.models.wikidata import WikidataPerson, merge_athlets
+
+
+@pytest.fixture(autouse=True)
+def logged_games(games):
+    with SessionLocal() as session, session.begin():
+        backfill(session)
+
+
+def person(athlet: Athlet, death: str|None) -> WikidataPerson:
+    return WikidataPerson(athlet.wiki_id, athlet.name, athlet.date_of_birth.isoformat(), death, [], [], [])
+
+
+def deaths(session) -> list[tuple[str, dt.date]]:
+    return session.execute(
+        select(GameEvent.source, GameEvent.date).where(GameEvent.kind == EventKind.DEATH)
+    ).all()
+
+
+def test_refresh_logs_death():
+    with SessionLocal() as session, session.begin():
+        athlet = session.scalars(select(Athlet).where(Athlet.teams.any())).first()
+        merge_athlets(session, [person(athlet, "2024-03-01")])
+        assert athlet.date_of_death == dt.date(2024, 3, 1)
+        assert deaths(session) == [("refresh", dt.date(2024, 3, 1))]
+        assert check_replay(session) == []
+
+        # Same date again: nothing changed, nothing is logged
+        merge_athlets(session, [person(athlet, "2024-03-01")])
+        assert len(deaths(session)) == 1
+
+
+def test_pick_order():
+    with SessionLocal() as session, session.begin():
+        team = session.scalars(select(Team).order_by(Team.id)).first()
+        picks = sorted(team.athlets, key=lambda a: a.id, reverse=True)
+        team.athlets = []
+        session.flush()
+        for athlet in picks:
+            # One pick per command
+            team.athlets.append(athlet)
+            session.flush()
+        session.expire(team)
+        assert team.athlets == picks
+        roster = next(t.athlets for t in GameSnapshot.load(session, team.game_id).teams if t.id == team.id)
+        assert [a.id for a in roster] == [a.id for a in picks]
+
+
+def first_game(session) -> Game:
+    return session.scalars(select(Game).order_by(Game.id)).first()
+
+
+@pytest.mark.games(status=Status.DRAFT)
+def test_add_athlet():
+    with SessionLocal() as session, session.begin():
+        game = first_game(session)
+        athlet = Athlet(session, "New pick", dt.date(1950, 1, 1), None, "Q999999", [], [], [])
+        game.add_athlet(game.teams[1], athlet)
+        assert check_replay(session) == []
+
+
+@pytest.mark.games(status=Status.CAPTAIN)
+def test_set_captain():
+    with SessionLocal() as session, session.begin():
+        game = first_game(session)
+        team = game.teams[0]
+        idx = next(i for i, athlet in enumerate(team.athlets) if athlet != team.captain)
+        game.set_captain(team, idx)
+        assert check_replay(session) == []
+
+
+@pytest.mark.games(status=Status.DRAFT)
+def test_cancel_draft_and_new_picks():
+    with SessionLocal() as session, session.begin():
+        game = first_game(session)
+        picks = {team: list(reversed(team.athlets)) for team in game.teams}
+        game.cancel_draft()
+        session.flush()
+        assert check_replay(session) == []
+
+        game.status = Status.DRAFT
+        for team, athlets in picks.items():
+            for athlet in athlets:
+                # One pick per command
+                game.add_athlet(team, athlet)
+                session.flush()
+        game.set_captain(game.teams[0], 0)
+        assert check_replay(session) == []
+
+
+def test_kill():
+    with SessionLocal() as session, session.begin():
+        game = first_game(session)
+        athlet = game.teams[0].athlets[0]
+        # Same as /kill
+        athlet.date_of_death = dt.date.today()
+        Game.bump_athlet_games(athlet)
+        Game.log_death(athlet, source="kill")
+        game.update_first_death([athlet], source="kill")
+        assert game.teams[0].has_first_death
+        assert check_replay(session) == []
+
+
+def test_update_first_death():
+    with SessionLocal() as session, session.begin():
+        game = first_game(session)
+        first, later = game.teams[0].athlets[0], game.teams[1].athlets[0]
+        merge_athlets(session, [person(first, "2024-03-01"), person(later, "2024-03-05")], source="sweep")
+        assert game.update_first_death([first, later])
+        assert game.first_deaths == [first]
+        assert check_replay(session) == []
+
+        # The first death is decided once
+        assert game.update_first_death([later]) == []
+        assert check_replay(session) == []
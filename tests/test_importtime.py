@@ -0,0 +1,13 @@
+"""Starting the bot must stay fast: no heavy import on the way to main."""
+from benchmarks.importtime import DEFAULT_BUDGET, import_times
+
+RUNS = 3
+
+
+def test_import_main_within_budget():
+    # Best of a few runs, like the benchmark, one slow run is noise
+    best = min((import_times("main") for _ in range(RUNS)), key=lambda times: times["main"][1])
+    assert best["main"][1] / 1000 <= DEFAULT_BUDGET
+    # numpy comes with the scoring engine and the odds, imported on first use
+    assert "numpy" not in best
+    assert "pandas" not in best
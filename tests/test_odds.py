@@ -0,0 +1,57 @@
+"""The Monte Carlo projection must be reproducible and agree with the columnar engine."""
+import datetime as dt
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from database.models import Game
+from database.models.db import SessionLocal
+from database.models.odds import simulate, load_sexes, SEX_OTHER
+from database.models.scoring import ScoringArrays, team_scores
+
+TODAY = dt.date(2024, 6, 1)
+SEASONS = 2000
+
+
+@pytest.fixture
+def arrays(games):
+    with SessionLocal() as session:
+        game_id = session.scalar(select(Game.id))
+        arrays = ScoringArrays.load(session, [game_id], today=TODAY)
+        return arrays, load_sexes(session, arrays)
+
+
+@pytest.mark.games(num_teams=4, team_size=5, dead_ratio=0.3)
+def test_seeded_projection(arrays):
+    arrays, sexes = arrays
+    odds = simulate(arrays, sexes, seasons=SEASONS, seed=7)
+    assert odds == simulate(arrays, sexes, seasons=SEASONS, seed=7)
+    assert sum(team.win_probability for team in odds) == pytest.approx(1)
+    for team in odds:
+        assert team.expected_score >= team.score
+
+
+def test_all_dead_season_is_team_scores():
+    # athlets: (id, birth, death, banned, gender, citizenship, occupation)
+    athlets = [
+        (1, dt.date(1950, 3, 10), dt.date(2024, 1, 5), False, 1, 1, 1),    # captain
+        (2, dt.date(1940, 5, 20), dt.date(2023, 5, 20), False, 1, 2, 1),
+        (3, dt.date(1996, 7, 1), dt.date(2023, 12, 28), False, 2, 3, 2),   # captain
+        (4, dt.date(1930, 1, 1), dt.date(2023, 8, 1), True, 1, 4, 3),      # banned
+        (5, dt.date(1935, 2, 2), dt.date(2023, 9, 9), False, 1, 1, 1),
+    ]
+    # teams: (id, game id, captain, first death); members: (athlet, team)
+    # Team 10 has the first death, team 20 the most diverse dead
+    teams = [(10, 1, 1, True), (20, 1, 3, False)]
+    members = [(1, 10), (2, 10), (5, 10), (3, 20), (4, 20)]
+    arrays = ScoringArrays(athlets, teams, members, TODAY)
+    sexes = np.full(len(athlets), SEX_OTHER)
+
+    odds = simulate(arrays, sexes, seasons=10, seed=0)
+    expected = team_scores(arrays)
+    assert [team.score for team in odds] == expected.tolist()
+    # Nobody left to die: every season ends with the current scores
+    assert [team.expected_score for team in odds] == expected.astype(float).tolist()
+    winner = int(expected.argmax())
+    assert [team.win_probability for team in odds] == [float(i == winner) for i in range(2)]
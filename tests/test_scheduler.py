@@ -0,0 +1,24 @@
+"""The unwatched sweep must stay within its share of the Wikidata budget."""
+import pytest
+
+from database.models import Status
+from database.models.db import SessionLocal
+from functions import scheduler
+from functions.scheduler import SweepScheduler
+
+# Ended games: all their athlets are unwatched
+pytestmark = [pytest.mark.usefixtures("games"), pytest.mark.games(status=Status.END)]
+
+
+def test_unwatched_sweep_budget(monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_IDS_PER_QUERY", 2)
+    sweeps = SweepScheduler(calls_per_day=10)  # 2 calls, 4 athlets per sweep
+    with SessionLocal() as session:
+        first = sweeps.unwatched_athlets(session)
+        second = sweeps.unwatched_athlets(session)
+        assert len(first) == len(second) == 4
+        # The second sweep goes on from the first one, then starts over
+        assert set(first) | set(second) == {f"Q{i}" for i in range(1, 7)}
+
+        sweeps.budget.used = 10
+        assert sweeps.unwatched_athlets(session) == []
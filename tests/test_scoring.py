@@ -0,0 +1,106 @@
+"""The columnar engine (rescore) must give the same scores as Team._calculate_score."""
+import itertools
+import datetime as dt
+
+import pytest
+from hypothesis import given, settings, HealthCheck, strategies as st
+
+from benchmarks.datagen import reset_db, FakeTelegramUser
+from database.models import Game, Team, Athlet, User, Status
+from database.models.athlet import Gender, Citizenship, Occupation
+from database.models.db import SessionLocal
+from database.models.scoring import rescore
+
+TODAY = dt.date.today()
+# Few properties, so that teams often have several dead athlets with the same one
+PROPERTIES = 3
+
+ids = itertools.count(1)
+
+
+@st.composite
+def death_dates(draw, birth: dt.date):
+    """Dates of death after birth, often on a day worth a bonus"""
+    def on(year: int, month: int, day: int) -> dt.date|None:
+        try:
+            return dt.date(year, month, day)
+        except ValueError:  # e.g. Feb 29
+            return None
+    year = draw(st.integers(birth.year + 1, TODAY.year))
+    death = draw(st.one_of(
+        st.dates(birth, TODAY),
+        st.just(on(year, birth.month, birth.day)),                   # birthday
+        st.just(on(birth.year + 27, *draw(st.sampled_from([(1, 1), (birth.month, birth.day), (12, 31)])))),  # club 27
+        st.builds(lambda d: on(year, 12, d), st.integers(20, 31)),   # zona Cesarini
+        st.builds(lambda d: on(year, 1, d), st.integers(1, 31)),     # speedy Gonzales
+    ))
+    if death is None or not birth <= death <= TODAY:
+        return draw(st.dates(birth, TODAY))
+    return death
+
+
+@st.composite
+def athlets(draw):
+    birth = draw(st.dates(dt.date(1900, 1, 1), dt.date(2010, 12, 31)))
+    return {
+        "birth": birth,
+        "death": draw(st.none() | death_dates(birth)),
+        "banned": draw(st.booleans()),
+        "gender": draw(st.none() | st.integers(0, PROPERTIES - 1)),
+        "citizenship": draw(st.none() | st.integers(0, PROPERTIES - 1)),
+        "occupation": draw(st.none() | st.integers(0, PROPERTIES - 1)),
+    }
+
+
+@st.composite
+def games(draw):
+    people = draw(st.lists(athlets(), min_size=1, max_size=12))
+    teams = []
+    for _ in range(draw(st.integers(1, 4))):
+        roster = draw(st.lists(st.integers(0, len(people) - 1), unique=True, max_size=len(people)))
+        captain = draw(st.none() | st.sampled_from(roster)) if roster else None
+        teams.append({"roster": roster, "captain": captain, "first_death": draw(st.booleans())})
+    return people, teams
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    reset_db()
+
+
+def build_game(session, people: list[dict], teams: list[dict]) -> Game:
+    run = next(ids)
+    properties = {
+        kind: [kind(wiki_id=f"Q{run}{kind.__name__}{i}", name=f"{kind.__name__} {i}") for i in range(PROPERTIES)]
+        for kind in (Gender, Citizenship, Occupation)
+    }
+    rows = []
+    for idx, person in enumerate(people):
+        athlet = Athlet(session, f"Athlet {idx}", person["birth"], person["death"], f"Q{run}A{idx}", [], [], [])
+        athlet.is_banned = person["banned"]
+        for kind, key in ((Gender, "gender"), (Citizenship, "citizenship"), (Occupation, "occupation")):
+            if person[key] is not None:
+                setattr(athlet, f"main_{key}", properties[kind][person[key]])
+        rows.append(athlet)
+    creator = User(FakeTelegramUser(run))
+    game = Game(chat_id=-run, creator=creator, status=Status.RUN)
+    session.add(game)
+    for t, spec in enumerate(teams):
+        team = Team(name=f"Team {t}", owner=creator, game=game, draft_order=t, has_first_death=spec["first_death"])
+        session.add(team)
+        with session.no_autoflush:
+            team.athlets.extend(rows[idx] for idx in spec["roster"])
+        team.captain = rows[spec["captain"]] if spec["captain"] is not None else None
+    session.flush()
+    return game
+
+
+@settings(max_examples=200, deadline=None, suppress_health_check=[HealthCheck.too_slow])
+@given(games())
+def test_rescore_matches_orm_score(game_spec):
+    people, teams = game_spec
+    with SessionLocal() as session:
+        game = build_game(session, people, teams)
+        expected = {team.id: team.score for team in game.teams}
+        assert rescore(session, [game.id]) == expected
+        session.rollback()
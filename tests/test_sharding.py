@@ -0,0 +1,28 @@
+"""The ingress must keep its event loop free while a worker is behind."""
+import asyncio
+import multiprocessing
+
+from telegram import Update
+
+from functions.sharding import ShardRouter
+
+
+def test_route_waits_off_the_loop():
+    updates = multiprocessing.get_context("spawn").Queue(1)
+    router = ShardRouter([updates])
+
+    async def run():
+        await router.route(Update(update_id=1))
+        # The queue is full: the second update waits for the worker
+        pending = asyncio.create_task(router.route(Update(update_id=2)))
+        ticks = 0
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks == 5 and not pending.done()
+        assert (await asyncio.to_thread(updates.get, timeout=5))["update_id"] == 1
+        await asyncio.wait_for(pending, timeout=5)
+        assert (await asyncio.to_thread(updates.get, timeout=5))["update_id"] == 2
+
+    asyncio.run(run())
+    assert router.routed == [2]
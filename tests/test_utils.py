@@ -0,0 +1,15 @@
+"""A bad log level in the environment must not stop the bot."""
+import logging
+
+from functions.utils import get_log_level
+
+
+def test_log_levels(monkeypatch):
+    monkeypatch.setenv("LOG_LEVEL", "warning")
+    monkeypatch.setenv("LOG_LEVELS", "bot.a=verbose, bot.b=15")
+    assert get_log_level("bot", logging.DEBUG) == logging.WARNING
+    assert get_log_level("bot.a", logging.DEBUG) == logging.DEBUG
+    assert get_log_level("bot.b", logging.DEBUG) == 15
+
+    monkeypatch.setenv("LOG_LEVEL", "Level 5")
+    assert get_log_level("bot", logging.INFO) == logging.INFO
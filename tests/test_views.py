@@ -0,0 +1,30 @@
+"""Cached views must be rendered again after any change of their game."""
+import pytest
+from sqlalchemy import select
+
+from database.models import Athlet
+from database.models.db import SessionLocal
+from database.models.wikidata import WikidataPerson, merge_athlets
+from functions.views import cached_view
+
+pytestmark = pytest.mark.usefixtures("games")
+
+
+def test_refresh_renders_again():
+    renders = []
+    def render():
+        renders.append(1)
+        return "ranking"
+
+    with SessionLocal() as session, session.begin():
+        athlet = session.scalars(select(Athlet).where(Athlet.teams.any())).first()
+        game_id = athlet.teams[0].game_id
+        cached_view(game_id, "ranking", None, render)
+        cached_view(game_id, "ranking", None, render)
+        assert len(renders) == 1
+
+        merge_athlets(session, [WikidataPerson(
+            athlet.wiki_id, athlet.name, athlet.date_of_birth.isoformat(), "2024-03-01", [], [], []
+        )])
+        cached_view(game_id, "ranking", None, render)
+        assert len(renders) == 2
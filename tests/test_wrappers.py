@@ -0,0 +1,78 @@
+"""Writers must not wait for each other while one of them awaits Telegram or Wikidata."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+import main
+from benchmarks.datagen import FakeTelegramUser
+from database.models import Athlet, User
+from database.models.db import SessionLocal
+from database.models.events import GameEvent, EventKind
+from database.models.outbox import OutboxMessage
+from database.models.wikidata import WikidataPerson
+from database.models.game import game_version
+from functions.wrappers import LazySession, get_session, merge_people, write_lock
+
+pytestmark = pytest.mark.usefixtures("games")
+
+
+def test_handler_awaiting_does_not_block_writers():
+    release = asyncio.Event()
+
+    @get_session
+    async def slow(session):
+        session.add(User(FakeTelegramUser(1001)))
+        await release.wait()  # e.g. a reply to a slow chat
+
+    @get_session
+    async def fast(session):
+        session.add(User(FakeTelegramUser(1002)))
+
+    async def run():
+        slow_handler = asyncio.create_task(slow())
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(fast(), timeout=2)
+        release.set()
+        await slow_handler
+
+    asyncio.run(run())
+    with SessionLocal() as session:
+        assert set(session.scalars(select(User.telegram_id).where(User.telegram_id > 1000))) == {1001, 1002}
+
+
+def test_sweep_fetches_without_lock(monkeypatch):
+    with SessionLocal() as session:
+        athlet = session.scalars(select(Athlet).where(Athlet.teams.any())).first()
+        person = WikidataPerson(athlet.wiki_id, athlet.name, athlet.date_of_birth.isoformat(), "2024-03-01", [], [], [])
+
+    async def find_dead_people(ids):
+        assert not write_lock().locked()
+        return [person] if person.wiki_id in ids else []
+
+    monkeypatch.setattr(main, "find_dead_people_async", find_dead_people)
+    context = SimpleNamespace(job_queue=None)
+    assert asyncio.run(main.sweep_deads(context, lambda session: [person.wiki_id], "watched"))
+    with SessionLocal() as session:
+        assert session.scalars(select(GameEvent.source).where(GameEvent.kind == EventKind.DEATH)).all() == ["sweep"]
+        assert session.scalar(select(OutboxMessage.id).where(OutboxMessage.key.startswith(f"death:{person.wiki_id}:")))
+
+
+def test_read_only_merge_is_a_preview():
+    session = LazySession(read_only=True)
+    athlet = session.scalars(select(Athlet).where(Athlet.teams.any())).first()
+    game_id = athlet.teams[0].game_id
+    version = game_version(game_id)
+    person = WikidataPerson(athlet.wiki_id, athlet.name, athlet.date_of_birth.isoformat(), "2024-03-01", [], [], [])
+
+    # e.g. /info of an athlet whose death the sweep did not see yet
+    assert asyncio.run(merge_people(session, [person])) == [athlet]
+    assert athlet.date_of_death is not None
+    assert not any(isinstance(obj, GameEvent) for obj in session.new)
+    assert game_version(game_id) == version
+    athlet_id = athlet.id
+    session.commit()
+    session.close()
+    with SessionLocal() as session:
+        assert session.get(Athlet, athlet_id).date_of_death is None